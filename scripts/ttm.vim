@@ -103,14 +103,14 @@ function! RegisterTask()
   let l:current_line = line('.')
   let l:current_file = expand('%:p')
   echo "Current File: " . l:current_file . " | Line Number: " . l:current_line
-  execute '!python3 ~/.local/bin/tmlib.notes-register-task.py' shellescape(l:current_file) l:current_line
+  execute '!~/.local/bin/ttm-run notes-register-task' shellescape(l:current_file) l:current_line
 endfunction
 
 function! RegisterObjective()
   let l:current_line = line('.')
   let l:current_file = expand('%:p')
   echo "Current File: " . l:current_file . " | Line Number: " . l:current_line
-  execute '!python3 ~/.local/bin/tmlib.notes-register-objective.py' shellescape(l:current_file) l:current_line
+  execute '!~/.local/bin/ttm-run notes-register-objective' shellescape(l:current_file) l:current_line
 endfunction
 
 function! LinkObjective()
@@ -146,7 +146,7 @@ function! LinkObjective()
   echo "Sink File: " . l:current_file . " | Line Number: " . l:current_line
   
   " Execute the external Python script with the necessary arguments
-  execute '!python3 ~/.local/bin/tmlib.notes-link-objective.py' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:source_filename_lineno) . ' ' . shellescape(l:sink_filename_lineno) . ' link-task'
+  execute '!~/.local/bin/ttm-run notes-link-objective' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:source_filename_lineno) . ' ' . shellescape(l:sink_filename_lineno) . ' link-task'
 endfunction
 
 function! DualLinkObjective()
@@ -182,7 +182,7 @@ function! DualLinkObjective()
   echo "Sink File: " . l:current_file . " | Line Number: " . l:current_line
   
   " Link the sink to the source first
-  execute '!python3 ~/.local/bin/tmlib.notes-link-objective.py' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:sink_filename_lineno) . ' ' . shellescape(l:source_filename_lineno) . ' link-task'
+  execute '!~/.local/bin/ttm-run notes-link-objective' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:sink_filename_lineno) . ' ' . shellescape(l:source_filename_lineno) . ' link-task'
 
   " Now the file content could have changed, so search again.
 
@@ -198,7 +198,7 @@ function! DualLinkObjective()
   echo "Sink File: " . l:current_file . " | Line Number: " . l:current_line
 
   " Link the source to the sink
-  execute '!python3 ~/.local/bin/tmlib.notes-link-objective.py' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:source_filename_lineno) . ' ' . shellescape(l:sink_filename_lineno) . ' link-task'
+  execute '!~/.local/bin/ttm-run notes-link-objective' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:source_filename_lineno) . ' ' . shellescape(l:sink_filename_lineno) . ' link-task'
 endfunction
 
 function! LinkGoal()
@@ -234,7 +234,7 @@ function! LinkGoal()
   echo "Sink File: " . l:current_file . " | Line Number: " . l:current_line
   
   " Link the sink first (has-goal), since it can cause a search change for source.
-  execute '!python3 ~/.local/bin/tmlib.notes-link-objective.py' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:source_filename_lineno) . ' ' . shellescape(l:sink_filename_lineno) . ' link-has-goal'
+  execute '!~/.local/bin/ttm-run notes-link-objective' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:source_filename_lineno) . ' ' . shellescape(l:sink_filename_lineno) . ' link-has-goal'
 
   " Now the file content could have changed, so search again.
 
@@ -250,7 +250,7 @@ function! LinkGoal()
   echo "Sink File: " . l:current_file . " | Line Number: " . l:current_line
 
   " Link goal-of
-  execute '!python3 ~/.local/bin/tmlib.notes-link-objective.py' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:source_filename_lineno) . ' ' . shellescape(l:sink_filename_lineno) . ' link-goal-of'
+  execute '!~/.local/bin/ttm-run notes-link-objective' . ' ' . shellescape(l:ttm_timedate) . ' ' . shellescape(l:source_filename_lineno) . ' ' . shellescape(l:sink_filename_lineno) . ' link-goal-of'
 endfunction
 
 function! TargetObjective()
@@ -275,43 +275,43 @@ function! SyncTask()
   let l:current_line = line('.')
   let l:current_file = expand('%:p')
   echo "Current File: " . l:current_file . " | Line Number: " . l:current_line
-  execute '!python3 ~/.local/bin/tmlib.notes-sync-task.py' shellescape(l:current_file) l:current_line
+  execute '!~/.local/bin/ttm-run notes-sync-task' shellescape(l:current_file) l:current_line
 endfunction
 
 function! CheckTask()
   let l:current_line = line('.')
   let l:current_file = expand('%:p')
   echo "Current File: " . l:current_file . " | Line Number: " . l:current_line
-  execute '!python3 ~/.local/bin/tmlib.notes-check-task.py' shellescape(l:current_file) l:current_line
+  execute '!~/.local/bin/ttm-run notes-check-task' shellescape(l:current_file) l:current_line
 endfunction
 
 function! CalcureAddEvent()
   let l:current_line = line('.')
   let l:current_file = expand('%:p')
   echo "Current File: " . l:current_file . " | Line Number: " . l:current_line
-  execute '!python3 ~/.local/bin/tmlib.notes-add-event.py' shellescape(l:current_file) l:current_line
+  execute '!~/.local/bin/ttm-run notes-add-event' shellescape(l:current_file) l:current_line
 endfunction
 
 function! CalcureAddLog()
   let l:current_line = line('.')
   let l:current_file = expand('%:p')
   echo "Current File: " . l:current_file . " | Line Number: " . l:current_line
-  execute '!python3 ~/.local/bin/tmlib.notes-add-log.py' shellescape(l:current_file) l:current_line
+  execute '!~/.local/bin/ttm-run notes-add-log' shellescape(l:current_file) l:current_line
 endfunction
 
 function! EventsAddExpected()
   let l:current_line = line('.')
   let l:current_file = expand('%:p')
   echo "Current File: " . l:current_file . " | Line Number: " . l:current_line
-  execute '!python3 ~/.local/bin/tmlib.notes-add-expected-event.py' shellescape(l:current_file) l:current_line
+  execute '!~/.local/bin/ttm-run notes-add-expected-event' shellescape(l:current_file) l:current_line
 endfunction
 
 function! GotoUuidWithTmux()
   let l:current_line = line('.')
   let l:current_file = expand('%:p')
   echo "Current File: " . l:current_file . " | Line Number: " . l:current_line
-  # execute '!python3 ~/.local/bin/tmlib.cli-goto-uuid.py' shellescape(l:current_file) l:current_line
-  execute '!python3 ~/.local/bin/tmlib.cli-goto-uuid.py' shellescape(l:current_file) l:current_line
+  # execute '!~/.local/bin/ttm-run cli-goto-uuid' shellescape(l:current_file) l:current_line
+  execute '!~/.local/bin/ttm-run cli-goto-uuid' shellescape(l:current_file) l:current_line
 endfunction
 
 
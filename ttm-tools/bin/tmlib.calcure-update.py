@@ -1,110 +1,118 @@
 import argparse
+import csv
+import os
 import sys
 import json
 from typing import List
 
-class CalcureCsvEvent:
-    def __init__(self, year, month, day, start, end, tag, desc, repeat_amt, repeat_mode, priority,
-                 gcode=None, uuid=None, project=None, item_desc=None):
-        self.year = year
-        self.month = month
-        self.day = day
-        self.start = start
-        self.end = end
-        self.tag = tag
-        self.desc = desc
-        self.repeat_amt = repeat_amt
-        self.repeat_mode = repeat_mode
-        self.priority = priority
-        self.gcode = gcode
-        self.uuid=uuid
-        self.project = project
-        self.item_desc = item_desc
-
-    @staticmethod
-    def parse(csv_line: str) -> 'CalcureCsvEvent':
-        tokens = csv_line.split(',')
-        if len(tokens) != 8:
-            raise Exception(f'Calcure event csv line must have 8 comma-seperated tokens. Line: {csv_line}')
-
-        _id = tokens[0]
-        year = tokens[1]
-        month = tokens[2]
-        day = tokens[3]
-        desc = tokens[4]
-        repeat_amt = tokens[5]
-        repeat_mode = tokens[6]
-        priority = tokens[7]
-
-        # process out start-end from description. Required.
-        if len(desc) < len('"0000:0000 ') or desc[5] != ':':
-            raise Exception(f'Description must start with time stamp like 0000:0000. Desc: {desc}')
-        desc_split = desc.split(':')
-        start = desc_split[0][1:]
-        end = desc_split[1][:4]
-        desc_remaining = ':'.join(desc_split[1:])[5:-1]
-
-        # Every item should have a unique tag
-        desc_remaining_tokens = desc_remaining.split(' ')
-        if len(desc_remaining_tokens) < 2 or len(desc_remaining_tokens[0]) != 4:
-            raise Exception(f'Description must start with a 4 character tag like EVNT. Desc: {desc_remaining}')
-        tag = desc_remaining_tokens[0]
-        desc_remaining = ' '.join(desc_remaining_tokens[1:])
-
-        # Try to parse extra information from the description if possible: gcode, UUID, project, item_desc (remaining)
-        desc_remaining_tokens = desc_remaining.split(' ')
-        gcode = None
-        uuid = None
-        project = None
-        item_desc = None
-        if len(desc_remaining_tokens) >= 4:
-            gcode = desc_remaining_tokens[0]
-            uuid = desc_remaining_tokens[1]
-
-            # Since this is a variable length field, assumme some default padding
-            project = desc_remaining_tokens[2]
-            project = project + ' ' * (max(0, len('some_long_project_name') - len(project)))
-            item_desc = ' '.join(desc_remaining_tokens[3:]).strip()
-
-
-        return CalcureCsvEvent(year, month, day, start, end, tag, desc_remaining, repeat_amt, repeat_mode, priority,
-                               gcode, uuid, project, item_desc)
-
-
-    def display(self, event_id: int) -> str:
-        #if self.gcode != None:
-        #    return f'{event_id},{self.year},{self.month},{self.day},"{self.start}:{self.end} {self.gcode} {self.uuid} {self.project} {self.item_desc}",{self.repeat_amt},{self.repeat_mode},{self.priority}'
-        #else:
-        #    return f'{event_id},{self.year},{self.month},{self.day},"{self.start}:{self.end} {self.desc}",{self.repeat_amt},{self.repeat_mode},{self.priority}'
-        return f'{event_id},{self.year},{self.month},{self.day},"{self.start}:{self.end} {self.tag} {self.desc}",{self.repeat_amt},{self.repeat_mode},{self.priority}'
+import ttm
+from ttm import calcure_events
+from ttm.calcure_events import CalcureCsvEvent
 
 
 def reorder_events():
-    with open(args.events_csv, 'r') as f:
-        csv_lines = f.readlines()
-
     # parse csv file
     try:
-        events: List[CalcureCsvEvent] = []
-        for line in csv_lines:
-            events.append(CalcureCsvEvent.parse(line))
+        events: List[CalcureCsvEvent] = list(calcure_events.iter_events(args.events_csv))
     except Exception as e:
         print(f'Exception: {e}')
         return 2
 
+    sorted_lines = sorted_event_lines(events)
+
+    # write new sorted csv
+    with open(args.events_csv, 'w') as f:
+        f.writelines(sorted_lines)
+
+    print('Sorted calcure events')
+    return 0
+
+
+def sorted_event_lines(events: List[CalcureCsvEvent]) -> List[str]:
     # sort items by year, month, day, and start time.
     events_sorted = sorted(events, key=lambda e: (int(e.year), int(e.month), int(e.day), int(e.start)))
 
     # transform back to lines
     sorted_lines = []
     for i, event in enumerate(events_sorted):
-        sorted_lines.append(event.display(i))
+        sorted_lines.append(event.display(i) + '\n')
+    return sorted_lines
 
-    # write new sorted csv
-    with open(args.events_csv, 'w') as f:
-        f.writelines(sorted_lines)
 
-    print('Sorted calcure events')
+def event_line_sort_key(csv_line: str):
+    """The (year, month, day, start) reorder_events sorts by, parsing only those fields of the line."""
+    tokens = csv_line.split(',', 5)
+    return (int(tokens[1]), int(tokens[2]), int(tokens[3]), int(tokens[4][1:5]))
+
+
+def with_event_id(csv_line: str, event_id: int) -> str:
+    return f'{event_id}{csv_line[csv_line.index(","):]}'
+
+
+def insert_event_line(csv_lines: List[str], event_csv: str) -> List[str]:
+    """
+    The lines of a sorted events file with event_csv inserted after the events that start at the same time or
+    earlier, like appending it and reordering would. Only the sort fields of each line are split out to check
+    that the file is sorted and to find the insertion point, and only the ids of the lines after it are
+    rewritten. A file that is not sorted, e.g. after an edit by calcure, has every line reordered instead.
+    """
+    import bisect
+
+    # The line must be a valid event
+    new_event = CalcureCsvEvent.parse(event_csv.strip())
+    key = event_line_sort_key(event_csv)
+
+    try:
+        keys = [event_line_sort_key(line) for line in csv_lines]
+        in_order = all(a <= b for a, b in zip(keys, keys[1:]))
+    except (IndexError, ValueError):
+        # A blank or malformed line
+        in_order = False
+    if not in_order:
+        return sorted_event_lines([CalcureCsvEvent.from_row(row) for row in csv.reader(csv_lines) if len(row) > 0] +
+                                  [new_event])
+
+    lo = bisect.bisect_right(keys, key)
+    head = csv_lines[:lo]
+    if len(head) > 0 and not head[-1].endswith('\n'):
+        head[-1] += '\n'
+    tail = [with_event_id(line, i) for i, line in enumerate(csv_lines[lo:], start=lo + 1)]
+    return head + [with_event_id(event_csv.strip(), lo) + '\n'] + tail
+
+
+def insert_event():
+    """
+    Adds args.event to the sorted events file, keeping it sorted and its ids consistent. The file is read and
+    replaced whole, since the ids of the events after the new one change.
+    """
+    import tempfile
+
+    csv_lines = []
+    if os.path.exists(args.events_csv):
+        with open(args.events_csv, 'r') as f:
+            csv_lines = f.readlines()
+
+    try:
+        csv_lines = insert_event_line(csv_lines, args.event)
+    except Exception as e:
+        print(f'Exception: {e}')
+        return 2
+
+    # calcure reads the file while it is being updated, so it is replaced at once
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(args.events_csv)),
+                                        prefix='.' + os.path.basename(args.events_csv) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(csv_lines)
+        if os.path.exists(args.events_csv):
+            import shutil
+            shutil.copymode(args.events_csv, tmp_filename)
+        os.replace(tmp_filename, args.events_csv)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+
+    print('Inserted calcure event')
     return 0
 
 
@@ -120,8 +128,10 @@ def parse_args():
     p.add_argument('events_csv',
                    help='Path to events file to process')
 
-    p.add_argument('action', choices=['reorder-events'],
+    p.add_argument('action', choices=['reorder-events', 'insert-event'],
                    help='Action to perform')
+    p.add_argument('event', nargs='?',
+                   help='insert-event: the csv line of the event, its id is replaced')
 
     #  p.add_argument('required_positional_arg',
                    #  help='desc')
@@ -131,11 +141,64 @@ def parse_args():
                    #  help='include to enable')
 
     args = p.parse_args()
+    if args.action == 'insert-event' and args.event is None:
+        p.error('insert-event needs the csv line of the event')
 
     return args
 
+
+class UnitTests(ttm.TestCase):
+    def test_insert_event_is_append_and_reorder(self):
+        import tempfile
+
+        lines = [f'0,2024,6,{day},"{start}:0100 EVNT g1 1a2b3c4d proj event {day} {start}",1,once,normal\n'
+                 for day in [3, 10, 24] for start in ['0900', '1300', '1300', '2000']]
+        lines = [with_event_id(line, i) for i, line in enumerate(lines)]
+
+        for new_event in ['0,2024,6,10,"1300:0020 DTSK g2 5e6f7a8b proj new",1,once,important',
+                          '0,2024,6,1,"0800:0020 EVNT new",1,once,normal',
+                          '0,2024,7,1,"0800:0020 EVNT new",1,once,normal',
+                          '0,2024,6,24,"0000:0020 EVNT new",1,once,normal']:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                global args
+                args = argparse.Namespace(events_csv=os.path.join(tmp_dir, 'events.csv'), event=None)
+                with open(args.events_csv, 'w') as f:
+                    f.writelines(lines + [new_event + '\n'])
+                reorder_events()
+                with open(args.events_csv) as f:
+                    expected = f.read()
+
+                with open(args.events_csv, 'w') as f:
+                    f.writelines(lines)
+                args.event = new_event
+                self.assertEqual(insert_event(), 0)
+                with open(args.events_csv) as f:
+                    self.assertEqual(f.read(), expected)
+
+        # A file that is not sorted anywhere, or holds a blank line, is reordered
+        new_event = '0,2024,7,1,"0800:0020 EVNT new",1,once,normal'
+        for unsorted_lines in [lines[:10] + [lines[11], lines[10]], [lines[4], lines[0]] + lines[1:4] + lines[5:],
+                               lines[:3] + ['\n'] + lines[3:]]:
+            expected = sorted_event_lines([CalcureCsvEvent.parse(line) for line in unsorted_lines + [new_event]
+                                           if line.strip() != ''])
+            self.assertEqual(insert_event_line(unsorted_lines, new_event), expected)
+            self.assertEqual([line.split(',')[0] for line in expected], [str(i) for i in range(13)])
+
+        self.assertEqual(insert_event_line([], lines[0]), [lines[0]])
+        with self.assertRaises(Exception):
+            insert_event_line(lines, '0,2024,6,1,"not an event",1,once,normal')
+
 if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'unittest':
+        import unittest
+        sys.argv[0] += ' unittest'
+        sys.argv.remove('unittest')
+        unittest.main()
+        exit(0)
+
     args = parse_args()
 
     if args.action == 'reorder-events':
         exit(reorder_events())
+    if args.action == 'insert-event':
+        exit(insert_event())
@@ -1,15 +1,13 @@
 #!/bin/python3
 
+import os
 import sys
-import subprocess
 import re
-import fileinput
 from enum import Enum, auto
-from typing import List, Optional, Tuple, Dict
-import pipe
-import argparse
-import datetime
-import unittest
+from typing import List, Optional, Tuple, Dict, NamedTuple
+
+# Everything else is imported where it is used, this module is loaded by every tool. tw_client is ttm.tw_client.
+import ttm
 
 log_file = '/tmp/note-parser.log'
 verbose = 2
@@ -56,7 +54,33 @@ class ItemType(Enum):
     CITE_RELATION = auto()                  # (node: KV, relation: KV, is_from: KV[, status: KV])
     CITE_CODE = auto()                     # ({code: KV[, n: KV] ...})
 
+# Line grammar shared by Item.parse and the line tokenizer
+RE_UUID = '[abcdef1234567890]{8}'
+RE_TAB_LEVEL = '[\s]*'
+RE_NOTE_TOKEN = 'P\[[\d]{6}-W[\d]+[MTWRFSU]-[\d]{4}\]'
+RE_NOTE_TOKEN_GRP = '(P)\[([\d]{6})-W([\d]+)([MTWRFSU])-([\d]{4})\]'
+RE_TAGS = f'\(tags:.*\)'
+RE_TAGS_GRP = f'\(tags:\s*(.*)\s*\)'
+RE_TIME_DATE = '\d{6}-W\d{2}[MTWRFSU] \d{2}:\d{2}'
+RE_TIME_DATE_GRP = '(\d{6})-W(\d{2})([MTWRFSU]) (\d{2}):(\d{2})'
+RE_USED_AS_REF = '\(Ref\)'
+RE_REF_COUNT = '\[Refs \d+\]'
+RE_REF_COUNT_GRP = '\[Refs (\d+)\]'
+RE_OBJECTIVE_STATUS = '\([-!XAB]\)'
+RE_OBJECTIVE_STATUS_GRP = '\(([-!XAB])\)'
+RE_CITE_RELATION_FROM = r'/[^\s]*::[^\s]*?/'
+RE_CITE_RELATION_FROM_GRP = r'/([^\s]*?)::([^\s]*?)/'
+RE_CITE_RELATION_TO = r'\\[^\s]*?::[^\s]*?\\'
+RE_CITE_RELATION_TO_GRP = r'\\([^\s]*?)::([^\s]*?)\\'
+RE_CITE_CODE_GRP = r'\[\^([^\]]+)\]'
+RE_CITE_CODE = r'\[\^.*?\]'
+RE_NOTE_DEF_DESC_GRP = f'{RE_TAB_LEVEL}{RE_NOTE_TOKEN}-\s*(.*)\s*{RE_TAGS}'
+RE_OBJECTIVE_LINE_DESC_GRP = f'{RE_TAB_LEVEL}- {RE_TIME_DATE} - {RE_OBJECTIVE_STATUS}\s*(.*)'
+RE_LOG_LINE_DESC_GRP = f'{RE_TAB_LEVEL}[-_] {RE_TIME_DATE} -\s*(.*)'
+
 class Item:
+    __slots__ = ('item_type', 'value', 'parts')
+
     def __init__(self, item_type: ItemType, value, parts: List['Item']=None):
         self.item_type = item_type
         self.value = value
@@ -86,29 +110,6 @@ class Item:
 
     @staticmethod
     def parse(item_type: ItemType, line: str, verbose=False) -> Optional['Item']:
-        RE_UUID = '[abcdef1234567890]{8}'
-        RE_TAB_LEVEL = '[\s]*'
-        RE_NOTE_TOKEN = 'P\[[\d]{6}-W[\d]+[MTWRFSU]-[\d]{4}\]'
-        RE_NOTE_TOKEN_GRP = '(P)\[([\d]{6})-W([\d]+)([MTWRFSU])-([\d]{4})\]'
-        RE_TAGS = f'\(tags:.*\)'
-        RE_TAGS_GRP = f'\(tags:\s*(.*)\s*\)'
-        RE_TIME_DATE = '\d{6}-W\d{2}[MTWRFSU] \d{2}:\d{2}'
-        RE_TIME_DATE_GRP = '(\d{6})-W(\d{2})([MTWRFSU]) (\d{2}):(\d{2})'
-        RE_USED_AS_REF = '\(Ref\)'
-        RE_REF_COUNT = '\[Refs \d+\]'
-        RE_REF_COUNT_GRP = '\[Refs (\d+)\]'
-        RE_OBJECTIVE_STATUS = '\([-!XAB]\)'
-        RE_OBJECTIVE_STATUS_GRP = '\(([-!XAB])\)'
-        RE_CITE_RELATION_FROM = r'/[^\s]*::[^\s]*?/'
-        RE_CITE_RELATION_FROM_GRP = r'/([^\s]*?)::([^\s]*?)/'
-        RE_CITE_RELATION_TO = r'\\[^\s]*?::[^\s]*?\\'
-        RE_CITE_RELATION_TO_GRP = r'\\([^\s]*?)::([^\s]*?)\\'
-        RE_CITE_CODE_GRP = r'\[\^([^\]]+)\]'
-        RE_CITE_CODE = r'\[\^.*?\]'
-        RE_NOTE_DEF_DESC_GRP = f'{RE_TAB_LEVEL}{RE_NOTE_TOKEN}-\s*(.*)\s*{RE_TAGS}'
-        RE_OBJECTIVE_LINE_DESC_GRP = f'{RE_TAB_LEVEL}- {RE_TIME_DATE} - {RE_OBJECTIVE_STATUS}\s*(.*)'
-        RE_LOG_LINE_DESC_GRP = f'{RE_TAB_LEVEL}[-_] {RE_TIME_DATE} -\s*(.*)'
-
         cls = Item
 
         def kv(k, v):
@@ -695,8 +696,8 @@ class Item:
                     codes.append(code)
                     ns.append('')
 
-            codes_kvs = codes | pipe.map(lambda s: kv('code', s)) | pipe.Pipe(list)
-            ns_kvs = ns | pipe.map(lambda s: kv('n', s)) | pipe.Pipe(list)
+            codes_kvs = [kv('code', s) for s in codes]
+            ns_kvs = [kv('n', s) for s in ns]
 
             return Item(item_type, full_item_str, codes_kvs + ns_kvs)
 
@@ -731,22 +732,525 @@ class Item:
             result += '\n\t' + s.replace('\n', '\n\t')
         return result
 
+class TimeDate(NamedTuple):
+    value: str
+    date_code: str
+    week_num: str
+    MTWRFSU: str
+    HH: str
+    MM: str
+
+
+class NoteToken(NamedTuple):
+    value: str
+    entry_name: str
+    date_code: str
+    week_num: str
+    MTWRFSU: str
+    rand4: str
+
+
+class CiteCode(NamedTuple):
+    value: str
+    codes: Tuple[str, ...]
+    ns: Tuple[str, ...]
+
+
+class CiteRelation(NamedTuple):
+    value: str
+    node: str
+    relation: str
+    is_from: str
+    status: Optional[str]
+
+
+class NoteLine:
+    """
+    Compact line item produced by the tokenizer. Parsed fields are plain attributes rather than a tree of KV items.
+
+    The Item tree is still available through `parts`/`get_part` for existing callers. It is built on first access, and
+    from then on it is the source of truth for the item since callers may modify it in place: the field attributes
+    are dropped and reading one derives it from the parts.
+    """
+    __slots__ = ('item_type', 'value', 'tab_level', 'note_token', 'time_date', 'status', 'desc', 'cite_code',
+                 'relations', 'cite_uuid', 'used_as_ref', 'ref_count', 'tags_value', 'tags', '_parts')
+    _FIELDS = ('tab_level', 'note_token', 'time_date', 'status', 'desc', 'cite_code', 'relations', 'cite_uuid',
+               'used_as_ref', 'ref_count', 'tags_value', 'tags')
+    # The part that holds each of the other fields once they are dropped
+    _FIELD_PARTS = {'tab_level': ItemType.TAB_LEVEL, 'note_token': ItemType.NOTE_TOKEN,
+                    'time_date': ItemType.TIME_DATE, 'cite_code': ItemType.CITE_CODE,
+                    'used_as_ref': ItemType.USED_AS_REF, 'ref_count': ItemType.REF_COUNT,
+                    'tags_value': ItemType.TAGS, 'tags': ItemType.TAGS}
+
+    def __init__(self, item_type: ItemType, value: str, tab_level: str, note_token: Optional[NoteToken]=None,
+                 time_date: Optional[TimeDate]=None, status: Optional[str]=None, desc: str='',
+                 cite_code: Optional[CiteCode]=None, relations: Tuple[CiteRelation, ...]=(), cite_uuid: str='',
+                 used_as_ref: bool=False, ref_count: Optional[str]=None, tags_value: Optional[str]=None,
+                 tags: Tuple[Tuple[str, str], ...]=()):
+        self.item_type = item_type
+        self.value = value
+        self.tab_level = tab_level
+        self.note_token = note_token
+        self.time_date = time_date
+        self.status = status
+        self.desc = desc
+        self.cite_code = cite_code
+        self.relations = relations
+        self.cite_uuid = cite_uuid
+        self.used_as_ref = used_as_ref
+        self.ref_count = ref_count
+        self.tags_value = tags_value
+        self.tags = tags
+        self._parts = None
+
+    @property
+    def uuid(self) -> str:
+        return self.tag('uuid')
+
+    @property
+    def childno(self) -> str:
+        return self.tag('childno')
+
+    def tag(self, key) -> str:
+        for k, v in self.tags:
+            if k == key:
+                return v
+        return ''
+
+    def fields(self) -> tuple:
+        return (self.item_type, self.value, self.tab_level, self.note_token, self.time_date, self.status, self.desc,
+                self.cite_code, self.relations, self.cite_uuid, self.used_as_ref, self.ref_count, self.tags_value,
+                self.tags)
+
+    def is_modified(self) -> bool:
+        return self._parts is not None
+
+    @property
+    def parts(self) -> List[Item]:
+        if self._parts is None:
+            self.parts = self._build_parts()
+        return self._parts
+
+    @parts.setter
+    def parts(self, parts: List[Item]):
+        self._parts = parts
+        for name in self._FIELDS:
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
+
+    def __getattr__(self, name):
+        # Only reached for a field dropped by the parts setter
+        if name not in NoteLine._FIELDS:
+            raise AttributeError(name)
+        return self._field_from_parts(name)
+
+    def _field_from_parts(self, name):
+        if name in ['status', 'desc']:
+            return get_kv(self, name)
+        if name == 'cite_uuid':
+            return get_kv(self, 'uuid') or ''
+        if name == 'relations':
+            return tuple(CiteRelation(part.value, get_kv(part, 'node'), get_kv(part, 'relation'),
+                                      get_kv(part, 'is_from'), get_kv(part, 'status'))
+                         for part in self._parts if part.item_type == ItemType.CITE_RELATION)
+
+        part = next((part for part in self._parts if part.item_type == self._FIELD_PARTS[name]), None)
+        if name == 'used_as_ref':
+            return part is not None
+        if part is None:
+            return {'tab_level': '', 'tags': ()}.get(name)
+        if name in ['tab_level', 'tags_value']:
+            return part.value
+        if name == 'tags':
+            return tuple(kv for tag in part.parts for kv in tag.value.items())
+        if name == 'ref_count':
+            return get_kv(part, 'n')
+        if name == 'cite_code':
+            return CiteCode(part.value, tuple(kv.value['code'] for kv in part.parts if 'code' in kv.value),
+                            tuple(kv.value['n'] for kv in part.parts if 'n' in kv.value))
+        field_type = NoteToken if name == 'note_token' else TimeDate
+        return field_type(part.value, *(get_kv(part, key) for key in field_type._fields[1:]))
+
+    def _build_parts(self) -> List[Item]:
+        parts = [Item(ItemType.TAB_LEVEL, self.tab_level, [])]
+
+        if self.note_token:
+            t = self.note_token
+            parts.append(Item(ItemType.NOTE_TOKEN, t.value,
+                              [_kv('entry_name', t.entry_name), _kv('date_code', t.date_code),
+                               _kv('week_num', t.week_num), _kv('MTWRFSU', t.MTWRFSU), _kv('rand4', t.rand4)]))
+
+        if self.time_date:
+            t = self.time_date
+            parts.append(Item(ItemType.TIME_DATE, t.value,
+                              [_kv('date_code', t.date_code), _kv('week_num', t.week_num),
+                               _kv('MTWRFSU', t.MTWRFSU), _kv('HH', t.HH), _kv('MM', t.MM)]))
+
+        if self.status is not None:
+            parts.append(_kv('status', self.status))
+
+        if self.cite_code:
+            parts.append(Item(ItemType.CITE_CODE, self.cite_code.value,
+                              [_kv('code', s) for s in self.cite_code.codes] +
+                              [_kv('n', s) for s in self.cite_code.ns]))
+
+        parts.append(_kv('desc', self.desc))
+
+        for relation in self.relations:
+            relation_parts = [_kv('node', relation.node), _kv('relation', relation.relation),
+                              _kv('is_from', relation.is_from)]
+            if relation.status:
+                relation_parts.append(_kv('status', relation.status))
+            parts.append(Item(ItemType.CITE_RELATION, relation.value, relation_parts))
+
+        if self.cite_uuid != '':
+            parts.append(_kv('uuid', self.cite_uuid))
+
+        if self.used_as_ref:
+            parts.append(Item(ItemType.USED_AS_REF, '', []))
+
+        if self.ref_count is not None:
+            parts.append(Item(ItemType.REF_COUNT, f'[Refs {self.ref_count}]', [_kv('n', self.ref_count)]))
+
+        if self.tags_value is not None:
+            parts.append(Item(ItemType.TAGS, self.tags_value, [_kv(k, v) for k, v in self.tags]))
+
+        return parts
+
+    def kv(self, key):
+        """
+        The value get_kv would return for key, read from the fields.
+        """
+        if key == 'desc':
+            return self.desc
+        if key == 'status':
+            return self.status
+        if key == 'uuid' and self.cite_uuid != '':
+            return self.cite_uuid
+        return None
+
+    get_part = Item.get_part
+    __str__ = Item.__str__
+
+
+def _kv(k, v):
+    return Item(ItemType.KV, {k: v}, [])
+
+
 def get_kv(part, key):
     """
     Extracts the property `key` in `part` if it has a KV with that key.
     """
+    if type(part) is NoteLine and part._parts is None:
+        return part.kv(key)
+
     kv_part = part.get_part(ItemType.KV, key=key)
     if not kv_part:
         return None
 
     if type(kv_part) is list:
-        result = kv_part | pipe.map(lambda part: part.value[key]) | pipe.Pipe(list)
+        result = [part.value[key] for part in kv_part]
         return result
 
     return kv_part.value[key]
 
+# Precompiled patterns for the line tokenizer. A line is classified once from its head and the matched groups are
+# handed to the builders, instead of trial parsing it against every line type.
+_P_ENTRY_DEFINITION_LINE = re.compile(f'({RE_TAB_LEVEL})({RE_NOTE_TOKEN_GRP})-\s*(.*)\s*{RE_TAGS}')
+_P_TIMED_LINE = re.compile(
+    f'({RE_TAB_LEVEL})([-_]) ({RE_TIME_DATE_GRP}) -( {RE_OBJECTIVE_STATUS_GRP})?')
+_P_TIME_DATE = re.compile(RE_TIME_DATE_GRP)
+_P_TAGS = re.compile(f'^.*({RE_TAGS}).*$')
+_P_TAGS_GRP = re.compile(f'^.*{RE_TAGS_GRP}.*$')
+_P_USED_AS_REF = re.compile(f'.*({RE_USED_AS_REF})')
+_P_REF_COUNT = re.compile(f'.*({RE_REF_COUNT_GRP})')
+_P_UUID = re.compile(RE_UUID)
+_P_CHILDNO = re.compile('\.\d+')
+_P_OBJECTIVE_LINE_DESC = re.compile(RE_OBJECTIVE_LINE_DESC_GRP)
+_P_LOG_LINE_DESC = re.compile(RE_LOG_LINE_DESC_GRP)
+_P_CITATION_UUID = re.compile(f'.*?(#({RE_UUID}))')
+
+
+def _tab_level_len(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def _build_time_date(line: str, m: re.Match) -> TimeDate:
+    """
+    Builds the TIME_DATE of a timed line from its head match. Like Item.parse, the last time date on the first line wins
+    if the description happens to contain another one.
+    """
+    first_line_end = line.find('\n')
+    if first_line_end == -1:
+        first_line_end = len(line)
+
+    td_m = None
+    for td_m in _P_TIME_DATE.finditer(line, m.end(3), first_line_end):
+        pass
+
+    if td_m:
+        return TimeDate(td_m.group(0), *td_m.groups())
+    return TimeDate(m.group(3), *m.groups()[3:8])
+
+
+def _build_tags(line: str, childno=False) -> Tuple[Optional[str], Tuple[Tuple[str, str], ...]]:
+    """
+    Parses the optional tags of a line. Returns (tags_value, ((key, tag), ...)) where key is uuid, childno or tag.
+    """
+    m1 = _P_TAGS.match(line)
+    if not m1:
+        return (None, ())
+
+    m2 = _P_TAGS_GRP.match(line)
+    if not m2:
+        return (None, ())
+
+    tag_list = m2.groups()[0]
+    if '#' not in tag_list:
+        return (None, ())
+
+    tags = []
+    for tag in tag_list.replace('#', '').split(','):
+        tag = tag.strip()
+
+        if _P_UUID.match(tag):
+            tags.append(('uuid', tag))
+        elif childno and _P_CHILDNO.match(tag):
+            tags.append(('childno', tag))
+        else:
+            tags.append(('tag', tag))
+
+    return (m1.groups()[0], tuple(tags))
+
+
+def _strip_line_refs(line: str) -> Tuple[bool, bool, Optional[str], str]:
+    """
+    Strips the optional (Ref) and [Refs n] parts from a line. Returns (ok, used_as_ref, ref_count, desc).
+    """
+    used_as_ref = _P_USED_AS_REF.match(line) is not None
+
+    ref_count = None
+    m = _P_REF_COUNT.match(line)
+    if m:
+        ref_count = m.groups()[1]
+
+    if used_as_ref and ref_count is not None:
+        return (False, False, None, '')
+
+    desc = line
+    if used_as_ref:
+        desc = desc.replace('(Ref)', '').strip()
+
+    if ref_count is not None:
+        desc = desc.replace(m.groups()[0], '').strip()
+
+    return (True, used_as_ref, ref_count, desc)
+
+
+def _build_entry_definition_line(line: str, m: re.Match) -> Optional[NoteLine]:
+    tags_value, tags = _build_tags(line)
+    if tags_value is None:
+        return None
+
+    groups = m.groups()
+    return NoteLine(ItemType.ENTRY_DEFINITION_LINE, line, groups[0], note_token=NoteToken(*groups[1:7]),
+                    desc=groups[7], tags_value=tags_value, tags=tags)
+
+
+def _build_objective_line(line: str, m: re.Match) -> Optional[NoteLine]:
+    ok, used_as_ref, ref_count, desc = _strip_line_refs(line)
+    if not ok:
+        return None
+
+    tags_value, tags = _build_tags(line, childno=True)
+    if tags_value is not None:
+        desc = desc.replace(tags_value, '').strip()
+
+    desc_m = _P_OBJECTIVE_LINE_DESC.match(desc)
+    if not desc_m:
+        return None
+
+    return NoteLine(ItemType.OBJECTIVE_LINE, line, m.groups()[0], time_date=_build_time_date(line, m),
+                    status=m.groups()[9], desc=desc_m.groups()[0], used_as_ref=used_as_ref, ref_count=ref_count,
+                    tags_value=tags_value, tags=tags)
+
+
+def _build_log_desc(line: str) -> Tuple[bool, bool, Optional[str], Optional[str], tuple, str]:
+    """
+    Common description processing of log and citation lines, including multiline continuations.
+    Returns (ok, used_as_ref, ref_count, tags_value, tags, desc).
+    """
+    ok, used_as_ref, ref_count, desc = _strip_line_refs(line)
+    if not ok:
+        return (False, False, None, None, (), '')
+
+    tags_value, tags = _build_tags(line)
+    if tags_value is not None:
+        desc = desc.replace(tags_value, '').strip()
+
+    desc_m = _P_LOG_LINE_DESC.match(desc)
+    if not desc_m:
+        return (False, False, None, None, (), '')
+    _desc = desc_m.groups()[0]
+
+    _lines = desc.split('\n')
+    if len(_lines) > 1:
+        for _line in _lines[1:]:
+            _desc += '\n' + _line.strip()
+
+    return (True, used_as_ref, ref_count, tags_value, tags, _desc)
+
+
+def _build_log_line(line: str, m: re.Match) -> Optional[NoteLine]:
+    ok, used_as_ref, ref_count, tags_value, tags, _desc = _build_log_desc(line)
+    if not ok:
+        return None
+
+    return NoteLine(ItemType.LOG_LINE, line, m.groups()[0], time_date=_build_time_date(line, m), desc=_desc,
+                    used_as_ref=used_as_ref, ref_count=ref_count, tags_value=tags_value, tags=tags)
+
+
+def _build_citation_line(line: str, m: re.Match) -> Optional[NoteLine]:
+    ok, used_as_ref, ref_count, tags_value, tags, _desc = _build_log_desc(line)
+    if not ok:
+        return None
+
+    # The description must begin with the citation code and a ': ' to be valid.
+    cite_code = Item.parse(ItemType.CITE_CODE, _desc)
+    if not cite_code or not _desc.startswith(cite_code.value + ': '):
+        return None
+
+    _desc = _desc.replace(cite_code.value + ':', '')
+    _desc = _desc.strip()
+
+    uuid = ''
+    uuid_m = _P_CITATION_UUID.match(_desc)
+    if uuid_m:
+        uuid = uuid_m.groups()[1]
+        _desc = _desc.replace(uuid_m.groups()[0], '')
+
+    # Relations do not deal well with new lines. Temporarily remove them.
+    _desc = _desc.replace('\n','_NEWWLINEE_')
+
+    relations = []
+    while True:
+        relation = Item.parse(ItemType.CITE_RELATION, _desc)
+        if not relation:
+            break
+        relations.append(CiteRelation(relation.value, get_kv(relation, 'node'), get_kv(relation, 'relation'),
+                                      get_kv(relation, 'is_from'), get_kv(relation, 'status')))
+        _desc = _desc.replace(relation.value, '')
+
+    _desc = _desc.replace('_NEWWLINEE_', '\n')
+
+    codes = tuple(part.value['code'] for part in cite_code.parts if 'code' in part.value)
+    ns = tuple(part.value['n'] for part in cite_code.parts if 'n' in part.value)
+
+    return NoteLine(ItemType.CITATION_LINE, line, m.groups()[0], time_date=_build_time_date(line, m),
+                    desc=_desc.strip(), cite_code=CiteCode(cite_code.value, codes, ns), relations=tuple(relations),
+                    cite_uuid=uuid, used_as_ref=used_as_ref, ref_count=ref_count, tags_value=tags_value, tags=tags)
+
+
+_line_builders = {
+    ItemType.ENTRY_DEFINITION_LINE: _build_entry_definition_line,
+    ItemType.OBJECTIVE_LINE: _build_objective_line,
+    ItemType.CITATION_LINE: _build_citation_line,
+    ItemType.LOG_LINE: _build_log_line,
+}
+
+
+def tokenize_note_line(line: str, incl_logs=False, incl_refs=False) -> List[Tuple[ItemType, re.Match]]:
+    """
+    Classifies a line by its head. Returns the candidate line types in priority order along with the head match that
+    their builders consume. Lines that cannot start an item produce no candidates.
+    """
+    head = line.lstrip()[:2]
+
+    if head == 'P[':
+        m = _P_ENTRY_DEFINITION_LINE.match(line)
+        if m:
+            return [(ItemType.ENTRY_DEFINITION_LINE, m)]
+        return []
+
+    if head != '- ' and head != '_ ':
+        return []
+
+    m = _P_TIMED_LINE.match(line)
+    if not m:
+        return []
+
+    candidates = []
+    if m.groups()[1] == '-' and m.groups()[9] is not None:
+        candidates.append((ItemType.OBJECTIVE_LINE, m))
+    if incl_refs and '[^' in line:
+        candidates.append((ItemType.CITATION_LINE, m))
+    if incl_logs:
+        candidates.append((ItemType.LOG_LINE, m))
+
+    return candidates
+
+
+def parse_note_line(item_type: ItemType, line: str) -> Optional[Item]:
+    """
+    Parses a (possibly multiline) line as item_type through the tokenizer builders.
+    """
+    if item_type == ItemType.ENTRY_DEFINITION_LINE:
+        m = _P_ENTRY_DEFINITION_LINE.match(line)
+    else:
+        m = _P_TIMED_LINE.match(line)
+    if not m:
+        return None
+
+    return _line_builders[item_type](line, m)
+
+
 def process_note_file_lines(lines, incl_logs=False, incl_refs=False) -> List[Tuple[int, Item]]:
     parsed_lines = []
+
+    def process_multiline(line, item_type):
+        # It is possible that the current line is a multiline continuation of the last line.
+        if len(parsed_lines) == 0 or parsed_lines[-1][1].item_type != ItemType.LOG_LINE:
+            return
+
+        cur_tab_level = _tab_level_len(line) + 1 # +1: margin, missing space between '-' and the desc.
+
+        # We want to measure the amount of characters until we begin the description. We take as referece only the
+        # first line, hence value.split('\n')[0].
+        prev_item = parsed_lines[-1][1]
+        expected_tab_level = len(prev_item.value.split('\n')[0]) - len(get_kv(prev_item, 'desc'))
+
+        if cur_tab_level >= expected_tab_level:
+            # Let's reparse the last element.
+            item = parse_note_line(item_type, prev_item.value + '\n' + line)
+            if item:
+                parsed_lines[-1] = (parsed_lines[-1][0], item)
+
+    for i, line in enumerate(lines):
+        item = None
+        for item_type, m in tokenize_note_line(line, incl_logs, incl_refs):
+            item = _line_builders[item_type](line, m)
+            if item:
+                break
+
+        if item:
+            parsed_lines.append((i+1, item))
+            continue
+
+        if incl_logs:
+            process_multiline(line, ItemType.LOG_LINE)
+        if incl_refs:
+            process_multiline(line, ItemType.CITATION_LINE)
+
+    return parsed_lines
+
+def process_note_file_lines_reference(lines, incl_logs=False, incl_refs=False) -> List[Tuple[int, Item]]:
+    """
+    Trial parses every line against each line type through Item.parse. This is the original parser and is kept as the
+    reference that the tokenizer in process_note_file_lines is checked against.
+    """
+    parsed_lines = []
     for i, line in enumerate(lines):
         item = Item.parse(ItemType.ENTRY_DEFINITION_LINE, line)
         if item:
@@ -805,26 +1309,492 @@ def process_note_file_lines(lines, incl_logs=False, incl_refs=False) -> List[Tup
 
     return parsed_lines
 
-def process_note_file(filename, incl_logs=False, incl_refs=False) -> List[Tuple[int, Item]]:
+def diff_note_lines(old_lines: List[str], new_lines: List[str]) -> Optional[Tuple[int, int, int]]:
+    """
+    Finds the changed line range between two versions of a file by trimming their common prefix and suffix.
+    Returns (lineno, old_count, new_count) where old_count lines starting at lineno were replaced by new_count lines,
+    or None if both are the same.
+    """
+    n_prefix = 0
+    n_max = min(len(old_lines), len(new_lines))
+    while n_prefix < n_max and old_lines[n_prefix] == new_lines[n_prefix]:
+        n_prefix += 1
+
+    if n_prefix == len(old_lines) and n_prefix == len(new_lines):
+        return None
+
+    n_suffix = 0
+    n_max -= n_prefix
+    while n_suffix < n_max and old_lines[-1 - n_suffix] == new_lines[-1 - n_suffix]:
+        n_suffix += 1
+
+    return (n_prefix + 1, len(old_lines) - n_prefix - n_suffix, len(new_lines) - n_prefix - n_suffix)
+
+
+def process_note_file_lines_incremental(parsed_items: List[Tuple[int, Item]], lines, lineno: int, old_count: int,
+                                        new_count: int, incl_logs=False, incl_refs=False) -> List[Tuple[int, Item]]:
+    """
+    Updates parsed_items, the parse of a previous version of lines, after old_count lines starting at lineno were
+    replaced by new_count lines. Only the edited region is re-parsed and items after it are shifted.
+
+    Any line following an item may be a multiline continuation of it, so parsing restarts at the last item before the
+    edit. Lines that start an item parse the same regardless of what precedes them, so parsing stops at the first
+    untouched item after the edit.
+    """
+    delta = new_count - old_count
+    edit_end = lineno + old_count
+
+    head = [(i, item) for i, item in parsed_items if i < lineno]
+    tail = [(i + delta, item) for i, item in parsed_items if i >= edit_end]
+
+    restart = 1
+    if len(head) > 0:
+        restart = head.pop()[0]
+
+    stop = len(lines) + 1
+    if len(tail) > 0:
+        stop = tail[0][0]
+
+    window = process_note_file_lines(lines[restart-1:stop-1], incl_logs, incl_refs)
+
+    return head + [(i + restart - 1, item) for i, item in window] + tail
+
+# Parsed note files are cached on disk so that every keystroke-triggered tool does not re-parse the whole file.
+# Entries are keyed on path + parse flags and validated against mtime/size, falling back to a content hash. A stale
+# entry keeps the lines it was parsed from, so only the edited region of the file is re-parsed.
+# Bump NOTE_CACHE_VERSION whenever the parser output changes.
+NOTE_CACHE_VERSION = 3
+
+
+def note_cache_dir() -> str:
+    return os.environ.get('TTM_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ttm'))
+
+
+def note_cache_enabled() -> bool:
+    # This is an environment variable so that it holds for every loaded copy of this module and for subprocesses.
+    return os.environ.get('TTM_NO_CACHE', '') == ''
+
+
+def disable_note_cache():
+    os.environ['TTM_NO_CACHE'] = '1'
+
+
+def strip_no_cache_arg(argv: List[str]) -> List[str]:
+    """
+    Removes --no-cache from argv, disabling the parse cache if it was given.
+    """
+    if '--no-cache' not in argv:
+        return argv
+
+    disable_note_cache()
+    return [arg for arg in argv if arg != '--no-cache']
+
+
+def _note_cache_filename(filename: str, incl_logs: bool, incl_refs: bool) -> str:
+    import hashlib
+
+    key = f'{os.path.abspath(filename)}:{int(incl_logs)}:{int(incl_refs)}:{NOTE_CACHE_VERSION}'
+    return os.path.join(note_cache_dir(), 'notes', hashlib.sha256(key.encode()).hexdigest()[:32] + '.pickle')
+
+
+def _item_to_data(item: Item):
+    # Only builtin types are stored. Pickle cannot resolve this module's classes since scripts load it under
+    # different module names.
+    if type(item) is NoteLine and not item.is_modified():
+        (item_type, value, tab_level, note_token, time_date, status, desc, cite_code, relations, cite_uuid,
+         used_as_ref, ref_count, tags_value, tags) = item.fields()
+        return ('NoteLine', item_type.name, value, tab_level, note_token and tuple(note_token),
+                time_date and tuple(time_date), status, desc, cite_code and tuple(cite_code),
+                tuple(tuple(relation) for relation in relations), cite_uuid, used_as_ref, ref_count, tags_value, tags)
+
+    return ('Item', item.item_type.name, item.value, [_item_to_data(part) for part in item.parts])
+
+
+def _item_from_data(data) -> Item:
+    if data[0] == 'NoteLine':
+        (_, item_type, value, tab_level, note_token, time_date, status, desc, cite_code, relations, cite_uuid,
+         used_as_ref, ref_count, tags_value, tags) = data
+        return NoteLine(ItemType[item_type], value, tab_level, note_token and NoteToken(*note_token),
+                        time_date and TimeDate(*time_date), status, desc, cite_code and CiteCode(*cite_code),
+                        tuple(CiteRelation(*relation) for relation in relations), cite_uuid, used_as_ref, ref_count,
+                        tags_value, tags)
+
+    _, item_type, value, parts = data
+    return Item(ItemType[item_type], value, [_item_from_data(part) for part in parts])
+
+
+def _read_note_cache(cache_filename: str) -> Optional[Dict]:
+    import pickle
+
+    try:
+        with open(cache_filename, 'rb') as f:
+            entry = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log_warn(f'Ignoring unreadable note cache {cache_filename}: {e}')
+        return None
+
+    if type(entry) is not dict or entry.get('version') != NOTE_CACHE_VERSION:
+        return None
+    return entry
+
+
+def _write_note_cache(cache_filename: str, entry: Dict):
+    import pickle
+    import tempfile
+
+    try:
+        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(cache_filename))
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, cache_filename)
+    except Exception as e:
+        log_warn(f'Failed to write note cache {cache_filename}: {e}')
+
+
+def invalidate_note_file_cache(filename: str):
+    """
+    Drops the cached parses of filename. Call this after modifying a note file.
+    """
+    for incl_logs in [False, True]:
+        for incl_refs in [False, True]:
+            try:
+                os.remove(_note_cache_filename(filename, incl_logs, incl_refs))
+            except FileNotFoundError:
+                pass
+
+
+def process_note_file(filename, incl_logs=False, incl_refs=False, use_cache=None) -> List[Tuple[int, Item]]:
+    import hashlib
+    import io
+
+    if use_cache is None:
+        use_cache = note_cache_enabled()
+
+    if not use_cache:
+        with open(filename, 'r') as f:
+            lines = f.readlines()
+
+        return process_note_file_lines(lines, incl_logs, incl_refs)
+
+    st = os.stat(filename)
+    cache_filename = _note_cache_filename(filename, incl_logs, incl_refs)
+    entry = _read_note_cache(cache_filename)
+
+    if entry and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+        return [(lineno, _item_from_data(data)) for lineno, data in entry['items']]
+
     with open(filename, 'r') as f:
-        lines = f.readlines()
-    
-    return process_note_file_lines(lines, incl_logs, incl_refs)
-    
+        content = f.read()
+    content_hash = hashlib.sha256(content.encode()).hexdigest()
+
+    if entry and entry['hash'] == content_hash:
+        # Touched but not modified. Only refresh the stat key.
+        entry['mtime_ns'] = st.st_mtime_ns
+        entry['size'] = st.st_size
+        _write_note_cache(cache_filename, entry)
+        return [(lineno, _item_from_data(data)) for lineno, data in entry['items']]
+
+    lines = io.StringIO(content).readlines()
+
+    diff = None
+    if entry:
+        diff = diff_note_lines(entry['lines'], lines)
+
+    if diff:
+        prev_parsed_items = [(lineno, _item_from_data(data)) for lineno, data in entry['items']]
+        parsed_items = process_note_file_lines_incremental(prev_parsed_items, lines, *diff, incl_logs, incl_refs)
+    else:
+        parsed_items = process_note_file_lines(lines, incl_logs, incl_refs)
+
+    _write_note_cache(cache_filename, {
+        'version': NOTE_CACHE_VERSION,
+        'filename': os.path.abspath(filename),
+        'mtime_ns': st.st_mtime_ns,
+        'size': st.st_size,
+        'hash': content_hash,
+        'lines': lines,
+        'items': [(lineno, _item_to_data(item)) for lineno, item in parsed_items],
+    })
+
+    return parsed_items
+
+
+def list_note_files(directory: str) -> List[str]:
+    """
+    Note files below directory in path order, skipping dot directories (git internals, caches), dotfiles,
+    editor swap/backup files and anything that is not a regular file, like a dangling symlink.
+    """
+    filenames = []
+    for dirpath, dirnames, names in os.walk(directory):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in names:
+            filename = os.path.join(dirpath, name)
+            if not name.startswith('.') and not name.endswith('~') and os.path.isfile(filename):
+                filenames.append(filename)
+    return sorted(filenames)
+
+
+# Note edits ------------------------------------------------------------------
+#
+# Changes to note files go through an EditTransaction: edits address lines by their lineno in the file as it
+# was parsed, are applied in memory, and every touched file is written once with write_file_atomic. A reader
+# sees the old or the new file, never a half written one, and no backup copy is needed.
+
+def write_file_atomic(filename: str, content: str):
+    """Replaces filename with content: writes a temporary file next to it, fsyncs it and renames it over."""
+    import tempfile
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(dir=dirname, prefix='.' + os.path.basename(filename) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(filename):
+            import shutil
+            shutil.copymode(filename, tmp_filename)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+
+    # Make the rename itself durable
+    dir_fd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class EditTransaction:
+    """
+    Line edits of one or more note files, written on commit(). Linenos are 1-based and refer to the file as
+    it was parsed, so edits do not shift each other. Passing the line the edit expects (e.g. item.value)
+    makes commit() fail, without writing anything, if the file changed in between.
+    """
+    def __init__(self):
+        self.edits = {}     # filename -> {lineno: [lines before, replacement or None, lines after]}
+        self.expected = {}  # filename -> {lineno: line}
+
+    def _edit(self, filename: str, lineno: int, expected: Optional[str]) -> list:
+        lineno = int(lineno)
+        if expected is not None:
+            self.expected.setdefault(filename, {})[lineno] = expected
+        return self.edits.setdefault(filename, {}).setdefault(lineno, [[], None, []])
+
+    def replace(self, filename: str, lineno: int, line: str, expected: Optional[str] = None):
+        self._edit(filename, lineno, expected)[1] = line
+
+    def insert_before(self, filename: str, lineno: int, line: str, expected: Optional[str] = None):
+        self._edit(filename, lineno, expected)[0].append(line)
+
+    def insert_after(self, filename: str, lineno: int, line: str, expected: Optional[str] = None):
+        self._edit(filename, lineno, expected)[2].append(line)
+
+    def apply(self, filename: str, lines: List[str]) -> List[str]:
+        """lines with the edits of filename applied."""
+        for lineno, line in self.expected.get(filename, {}).items():
+            if lineno > len(lines) or lines[lineno - 1] != line:
+                raise Exception(f'{filename}:{lineno} changed since it was parsed, not modifying it')
+
+        edits = self.edits.get(filename, {})
+        for lineno in edits:
+            if lineno < 1 or lineno > len(lines):
+                raise Exception(f'{filename}:{lineno} is out of range, not modifying it')
+
+        new_lines = []
+        for lineno, line in enumerate(lines, 1):
+            if lineno not in edits:
+                new_lines.append(line)
+                continue
+            before, replacement, after = edits[lineno]
+            new_lines += [_with_newline(l) for l in before]
+            new_lines.append(line if replacement is None else _with_newline(replacement))
+            new_lines += [_with_newline(l) for l in after]
+        return new_lines
+
+    def check(self) -> Dict[str, str]:
+        """The new content of every touched file. Raises like commit() would, without writing anything."""
+        contents = {}
+        for filename in self.edits:
+            with open(filename, 'r') as f:
+                contents[filename] = ''.join(self.apply(filename, f.readlines()))
+        return contents
+
+    def commit(self):
+        """Checks and applies the edits of every file, then writes each touched file once."""
+        contents = self.check()
+
+        try:
+            for filename, content in contents.items():
+                write_file_atomic(filename, content)
+        finally:
+            for filename in contents:
+                invalidate_note_file_cache(filename)
+        self.edits = {}
+        self.expected = {}
+
+
+def _with_newline(line: str) -> str:
+    return line if line.endswith('\n') else line + '\n'
+
+
+# Note index daemon client ---------------------------------------------------
+#
+# tmlib.notes-indexd.py keeps every note file of the vault parsed in memory and answers lookups over a Unix
+# socket. Callers treat a None result as "no daemon" and fall back to parsing or grepping themselves.
+
+def note_index_socket_path() -> str:
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR', '/tmp')
+    return os.environ.get('TTM_INDEXD_SOCKET', os.path.join(runtime_dir, f'ttm-indexd-{os.getuid()}.sock'))
+
+
+def query_note_index(op: str, arg: str = '', timeout: float = 2.0) -> Optional[List[Dict]]:
+    """
+    Sends one query to a running ttm-indexd. Returns the list of matching locations
+    ({'filename', 'lineno', 'text', ...}), or None if there is no daemon or the query failed.
+    """
+    import json
+    import socket
+
+    if os.environ.get('TTM_NO_INDEXD', '') != '':
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(note_index_socket_path())
+            sock.sendall((json.dumps({'op': op, 'arg': arg}) + '\n').encode())
+
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+    except OSError:
+        return None
+
+    try:
+        response = json.loads(data)
+    except ValueError:
+        log_warn(f'Malformed response from note index daemon for {op} {arg}')
+        return None
+
+    if not response.get('ok'):
+        log_warn(f'Note index daemon failed {op} {arg}: {response.get("error")}')
+        return None
+    return response['result']
+
+def get_tab_level(item: Item) -> str:
+    if type(item) is NoteLine and item._parts is None:
+        return item.tab_level
+    return item.get_part(ItemType.TAB_LEVEL).value
+
+class OutlineIndex:
+    """Parent/children links over the parsed lines of a note file, keyed by lineno.
+
+    Built with a single stack pass over the tab levels: the parent of a line is the closest
+    preceding line with a smaller tab level. Other items (logs, citations) are not part of the outline
+    and are skipped.
+    """
+
+    __slots__ = ('parsed_items', 'position', 'parent_pos', 'children_pos')
+
+    def __init__(self, parsed_items: List[Tuple[int, Item]]):
+        self.parsed_items = parsed_items
+        self.position: Dict[int, int] = {}
+        self.parent_pos: List[Optional[int]] = []
+        self.children_pos: List[List[int]] = []
+
+        stack = []      # [(tab_level, pos)] with strictly increasing tab levels
+        for pos, (lineno, item) in enumerate(parsed_items):
+            if item.item_type not in [ItemType.ENTRY_DEFINITION_LINE, ItemType.OBJECTIVE_LINE]:
+                self.parent_pos.append(None)
+                self.children_pos.append([])
+                continue
+
+            tab_level = len(get_tab_level(item))
+            while stack and stack[-1][0] >= tab_level:
+                stack.pop()
+
+            parent = stack[-1][1] if stack else None
+            self.position[lineno] = pos
+            self.parent_pos.append(parent)
+            self.children_pos.append([])
+            if parent is not None:
+                self.children_pos[parent].append(pos)
+
+            stack.append((tab_level, pos))
+
+    def item_at(self, lineno: int) -> Optional[Item]:
+        pos = self.position.get(lineno)
+        return None if pos is None else self.parsed_items[pos][1]
+
+    def parent(self, lineno: int) -> Optional[Tuple[int, Item]]:
+        pos = self.position.get(lineno)
+        if pos is None or self.parent_pos[pos] is None:
+            return None
+        return self.parsed_items[self.parent_pos[pos]]
+
+    def branch(self, lineno: int) -> List[Tuple[int, Item]]:
+        """Ancestors of lineno, closest first."""
+        branch = []
+        pos = self.position.get(lineno)
+        while pos is not None:
+            pos = self.parent_pos[pos]
+            if pos is not None:
+                branch.append(self.parsed_items[pos])
+        return branch
+
+    def children(self, lineno: int) -> List[Tuple[int, Item]]:
+        pos = self.position.get(lineno)
+        if pos is None:
+            return []
+        return [self.parsed_items[i] for i in self.children_pos[pos]]
+
+def build_outline_index(parsed_items: List[Tuple[int, Item]]) -> OutlineIndex:
+    return OutlineIndex(parsed_items)
+
 def find_item_at_lineno(parsed_items: List[Tuple[int, Item]], lineno: int) -> Item:
-    for i, item in parsed_items:
-        if lineno == i:
-            return item
+    # parsed_items is always in file order, so a binary search is enough. bisect takes no key before 3.10.
+    lo, hi = 0, len(parsed_items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if parsed_items[mid][0] < lineno:
+            lo = mid + 1
+        else:
+            hi = mid
+    i = lo
+    if i < len(parsed_items) and parsed_items[i][0] == lineno:
+        return parsed_items[i][1]
     return None
         
-def find_parent_item(parsed_items: List[Tuple[int, Item]], lineno: int) -> Optional[Tuple[int, Item]]:
+def find_parent_item(parsed_items: List[Tuple[int, Item]], lineno: int,
+                     index: Optional[OutlineIndex] = None) -> Optional[Tuple[int, Item]]:
+    if index is None:
+        index = build_outline_index(parsed_items)
+    return index.parent(lineno)
+
+def find_parent_branch_items(parsed_items: List[Tuple[int, Item]], lineno: int,
+                             index: Optional[OutlineIndex] = None) -> Optional[List[Tuple[int, Item]]]:
+    if index is None:
+        index = build_outline_index(parsed_items)
+    return index.branch(lineno)
+
+def find_parent_item_reference(parsed_items: List[Tuple[int, Item]], lineno: int) -> Optional[Tuple[int, Item]]:
+    """Reverse linear scan that OutlineIndex replaces; kept to check the index against."""
     reversed_parsed_items = list(reversed(parsed_items))
 
     start_looking_for_parent = False
     current_tab_level = 0
     for i, item in reversed_parsed_items:
         if start_looking_for_parent:
-            tab_level = len(item.get_part(ItemType.TAB_LEVEL).value)
+            tab_level = len(get_tab_level(item))
             if tab_level < current_tab_level:
                 return (i, item)
         else:
@@ -832,25 +1802,14 @@ def find_parent_item(parsed_items: List[Tuple[int, Item]], lineno: int) -> Optio
                 raise Exception('Root-level items must be lines')
 
             if lineno == i:
-                current_tab_level = len(item.get_part(ItemType.TAB_LEVEL).value)
+                current_tab_level = len(get_tab_level(item))
                 start_looking_for_parent = True
     return None
 
-def find_parent_branch_items(parsed_items: List[Tuple[int, Item]], lineno: int) -> Optional[List[Tuple[int, Item]]]:
-    branch = []
-
-    while True:
-        opt_lineno_item = find_parent_item(parsed_items, lineno)
-        if opt_lineno_item:
-            branch.append((opt_lineno_item[0], opt_lineno_item[1]))
-            lineno = opt_lineno_item[0]
-        else:
-            break
-    
-    return branch
-
-
 def get_tag(item: Item, key) -> str:
+    if type(item) is NoteLine and item._parts is None:
+        return item.tag(key)
+
     tags = item.get_part(ItemType.TAGS)
     if tags:
         kv = tags.get_part(ItemType.KV, key=key)
@@ -859,21 +1818,21 @@ def get_tag(item: Item, key) -> str:
     return ''
 
 def system_create_objective(uuid) -> str:
-    result = subprocess.run(['tmlib.cli-vit-new-objective', uuid], stdout=subprocess.PIPE)
+    # The helper calls task itself, run it against the same task backend
+    stdout = ttm.tw_client.run_script(['tmlib.cli-vit-new-objective', uuid])
 
-    if result.returncode != 0:
+    if stdout is None:
         log_error(f'Failed to create objective for {uuid}')
         return ''
     
     # Parse new UUID from stdout
     new_uuid = ''
-    stdout = result.stdout.decode('ascii')
     stdout_lines = stdout.split('\n')
     re_s = '.*Created new objective ([abcdef1234567890]{8}) for ' + uuid
     #print(re_s)
     p = re.compile(re_s)
     for line in stdout_lines:
-        m = p.match(str(result.stdout))
+        m = p.match(line)
         if m:
             new_uuid = m.groups()[0]
     if new_uuid == '':
@@ -883,11 +1842,10 @@ def system_create_objective(uuid) -> str:
     return new_uuid
 
 def system_rename_objective(uuid, desc) -> str:
-    result = subprocess.run(['task', '_get', f'{uuid}.description'], stdout=subprocess.PIPE)
-    if result.returncode != 0:
+    stdout = ttm.tw_client.read_value(f'{uuid}.description')
+    if stdout is None:
         log_error(f'Failed to get description of {uuid}')
         return ''
-    stdout = result.stdout.decode('ascii')
 
     # keep the first portion as it indicates this is an objective
     p = re.compile('^([abcdef1234567890]{8}\.\d+).*')
@@ -898,8 +1856,7 @@ def system_rename_objective(uuid, desc) -> str:
     new_desc = m.groups()[0] + ' ' + desc
     #print(desc, '->', new_desc)
     
-    result = subprocess.run(['task', 'modify', f'{uuid}', f'description:{new_desc}'], stdout=subprocess.PIPE)
-    if result.returncode != 0:
+    if not ttm.tw_client.modify_task(uuid, [f'description:{new_desc}']):
         log_error(f'Failed to modify description for {uuid}')
         return ''
     return new_desc
@@ -1000,24 +1957,60 @@ def build_note_def_line_item(item: Item) -> str:
     return result
 
 def system_cmd(command):
+    import subprocess
+
     process = subprocess.Popen(command, stdout=subprocess.PIPE, shell=True)
     output, error = process.communicate()
     stdout = output.decode().strip()
     return stdout
 
-def main(args: argparse.Namespace):
+def bench_memory(filenames: List[str]):
+    """
+    Compares the memory held by the parsed items of the reference parser and of the tokenizer.
+    """
+    import gc
+    import time
+    import tracemalloc
+
+    lines_by_file = []
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            lines_by_file.append(f.readlines())
+
+    for name, cb_process in [('reference', process_note_file_lines_reference), ('tokenizer', process_note_file_lines)]:
+        gc.collect()
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        parsed = [cb_process(lines, incl_logs=True, incl_refs=True) for lines in lines_by_file]
+        dt = time.perf_counter() - t0
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        n_items = sum(len(items) for items in parsed)
+        print(f'{name}: {n_items} items, {size / 1024:.0f} KiB held ({size / max(n_items, 1):.0f} B/item), '
+              f'{peak / 1024:.0f} KiB peak, {dt:.3f}s')
+        del parsed
+
+
+def main(args: 'argparse.Namespace'):
     print(args)
 
+    if args.subcommand == 'bench-memory':
+        bench_memory(args.filenames)
+
     if args.subcommand == 'iso':
         print('iso!', args.week_date)
     if args.subcommand == 'of':
         print('of!', args.date)
     if args.subcommand == 'today':
+        import datetime
         today = datetime.date.today()
         print(today)
 
 
 def cmdline_args():
+    import argparse
+
     # Make parser object
     p = argparse.ArgumentParser(description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -1031,6 +2024,11 @@ def cmdline_args():
     sp = subparsers.add_parser('unittest', 
                     help='run the unit tests instead of main')
 
+    sp = subparsers.add_parser('bench-memory', 
+                    help='Compare memory used by parsed items of the reference parser and the tokenizer')
+    sp.add_argument('filenames', nargs='+',
+                    help='Note files to parse')
+
     return(p.parse_args())
 
 def _main():
@@ -1051,14 +2049,33 @@ def _main():
     args = cmdline_args()
     main(args)
 
-class UnitTests(unittest.TestCase):
+class UnitTests(ttm.TestCase):
+    # Line fixtures shared by the tests of the parsers
+    NOTE_LOG_LINES = [
+        '               - 240624-W26U 18:52 - We need to have three variations. Lets say triggered by !C, !c, and #C. One greps the tuple (task, citation), the second',
+        '                                     greps the tuple (task, context, citation), and the third greps (task, notelog)',
+        '                                     The first ensures uniqueness of (task, citation).',
+    ]
+
+    CITATION_LINES = {
+        'G0.0': '- 240701-W27T 21:52 - [^T1]: Update Task-Notelog solution to work with argparse interface #548991db',
+        'G0.1': '   - 240708-W28M 06:57 - [^CMT1]: 5ff942c (HEAD -> main) feat[TaskGraph]: Added ArgParse and Clustered multiline grep',
+        'G0.2': '- 240701-W27S 18:31 - [^FL2.1]: WSL, $HOME/src/ttm/ttm-tools/bin/tmlib.notes-citations-processor.py',
+        'G0.3': '   - 240701-W27M 09:02 - [^T5]: (-) /T::goal_of/ TaskGraph: Impl parsing for Citation Notelog #e142cb79',
+        'G0.4': '                    - 240701-W27M 04:47 - [^T1]: /T::spawned_by/    TaskGraph: Extend tmlib.note-parser to account for multiline log lines\n' +
+                '                                                 (!) /T::solved_by/',
+        'G0.5': '                - 240701-W27R 19:58 - [^T1]: /T::is_self/ TaskGraph::MSTN: Able to render graph representation of tasks/citations\n' +
+                '                                             (-) /T::blocks(goal)/',
+        'G0.6': '- 240715-W29T 16:21 - [^FL#ntp_src]: WSL, $HOME/src/ttm/ttm-tools/bin/tmlib.note-parser.py',
+
+        # False non-parsing examples
+        'NP1': '- 240701-W27S 18:45 - With help of [^GT1]:',
+        'NP2': '- 240701-W27M 06:00 - [^NT1]::Iteration3 shows that we successfully trigger the condition on each two new lines for the last long line.',
+    }
+
     # Parsing Notelog
     def test_can_parse_normal_note_log(self):
-        test_lines = [
-            '               - 240624-W26U 18:52 - We need to have three variations. Lets say triggered by !C, !c, and #C. One greps the tuple (task, citation), the second',
-            '                                     greps the tuple (task, context, citation), and the third greps (task, notelog)',
-            '                                     The first ensures uniqueness of (task, citation).',
-        ]
+        test_lines = self.NOTE_LOG_LINES
 
         # This will get us a list of tuples of linenos and items.
         result = process_note_file_lines(test_lines, incl_logs=True)
@@ -1250,21 +2267,7 @@ class UnitTests(unittest.TestCase):
                 self.assertEqual(get_kv(item, 'n'), '')
 
     def test_can_parse_citation_lines(self):
-        test_lines_dict = {
-            'G0.0': '- 240701-W27T 21:52 - [^T1]: Update Task-Notelog solution to work with argparse interface #548991db',
-            'G0.1': '   - 240708-W28M 06:57 - [^CMT1]: 5ff942c (HEAD -> main) feat[TaskGraph]: Added ArgParse and Clustered multiline grep',
-            'G0.2': '- 240701-W27S 18:31 - [^FL2.1]: WSL, $HOME/src/ttm/ttm-tools/bin/tmlib.notes-citations-processor.py',
-            'G0.3': '   - 240701-W27M 09:02 - [^T5]: (-) /T::goal_of/ TaskGraph: Impl parsing for Citation Notelog #e142cb79',
-            'G0.4': '                    - 240701-W27M 04:47 - [^T1]: /T::spawned_by/    TaskGraph: Extend tmlib.note-parser to account for multiline log lines\n' +
-                    '                                                 (!) /T::solved_by/',
-            'G0.5': '                - 240701-W27R 19:58 - [^T1]: /T::is_self/ TaskGraph::MSTN: Able to render graph representation of tasks/citations\n' +
-                    '                                             (-) /T::blocks(goal)/',
-            'G0.6': '- 240715-W29T 16:21 - [^FL#ntp_src]: WSL, $HOME/src/ttm/ttm-tools/bin/tmlib.note-parser.py',
-
-            # False non-parsing examples
-            'NP1': '- 240701-W27S 18:45 - With help of [^GT1]:',
-            'NP2': '- 240701-W27M 06:00 - [^NT1]::Iteration3 shows that we successfully trigger the condition on each two new lines for the last long line.',
-        }
+        test_lines_dict = self.CITATION_LINES
 
         for test_no in test_lines_dict:
             test_line = test_lines_dict[test_no]
@@ -1493,5 +2496,240 @@ class UnitTests(unittest.TestCase):
 
         pass
 
+    def test_tokenizer_matches_reference_parser(self):
+        test_lines = [
+            'P[240624-W26M-ab12]- TaskGraph project (tags: #1a2b3c4d, #gcode, )',
+            '- 240624-W26M 10:00 - (-) TaskGraph: Render tasks (tags: #.1, #abcdef12, )',
+            '    - 240624-W26M 10:05 - (!) Extend note-parser [Refs 3] (tags: #.2, #12345678, #refd=2)',
+            '    - 240624-W26M 10:05 - (X) Used as a reference (Ref)',
+            '    - 240624-W26M 10:05 - (A) Cannot be both (Ref) [Refs 2]',
+            '    - 240624-W26M 10:05 - (B) Mentions 240101-W01M 09:30 in its description',
+            '               - 240624-W26U 18:52 - We need to have three variations. Lets say triggered by !C, !c, and #C. One greps the tuple (task, citation), the second',
+            '                                     greps the tuple (task, context, citation), and the third greps (task, notelog)',
+            '                                     The first ensures uniqueness of (task, citation).',
+            '        _ 240624-W26M 10:07 - Underscore log line (tags: #abcdef99)',
+            '- 240701-W27T 21:52 - [^T1]: Update Task-Notelog solution to work with argparse interface #548991db',
+            '   - 240708-W28M 06:57 - [^CMT1]: 5ff942c (HEAD -> main) feat[TaskGraph]: Added ArgParse and Clustered multiline grep',
+            '   - 240701-W27M 09:02 - [^T5]: (-) /T::goal_of/ TaskGraph: Impl parsing for Citation Notelog #e142cb79',
+            '                    - 240701-W27M 04:47 - [^T1]: /T::spawned_by/    TaskGraph: Extend tmlib.note-parser to account for multiline log lines',
+            '                                                 (!) /T::solved_by/',
+            '- 240715-W29T 16:21 - [^FL#ntp_src]: WSL, $HOME/src/ttm/ttm-tools/bin/tmlib.note-parser.py',
+            '- 240701-W27S 18:45 - With help of [^GT1]:',
+            '- 240701-W27M 06:00 - [^NT1]::Iteration3 shows that we successfully trigger the condition on each two new lines for the last long line.',
+            '\t- 240624-W26M 10:00 - (-) Tabbed objective (tags: #.3)',
+            '   Plain text that is not an item',
+            '',
+        ]
+
+        # Each line fixture of the parser tests, and each line above, through both parsers as every line type
+        fixture_lines = dict(self.CITATION_LINES, log='\n'.join(self.NOTE_LOG_LINES))
+        fixture_lines.update((f'line {i}', line) for i, line in enumerate(test_lines, 1))
+        for test_no, test_line in fixture_lines.items():
+            for item_type in [ItemType.ENTRY_DEFINITION_LINE, ItemType.OBJECTIVE_LINE, ItemType.CITATION_LINE,
+                              ItemType.LOG_LINE]:
+                self.assertEqual(str(parse_note_line(item_type, test_line)), str(Item.parse(item_type, test_line)),
+                                 f'Tokenizer parse of {test_no} as {item_type} differs')
+
+        test_lines = [line + '\n' for line in test_lines]
+
+        for incl_logs in [False, True]:
+            for incl_refs in [False, True]:
+                expected = process_note_file_lines_reference(test_lines, incl_logs=incl_logs, incl_refs=incl_refs)
+                result = process_note_file_lines(test_lines, incl_logs=incl_logs, incl_refs=incl_refs)
+
+                self.assertEqual([(lineno, str(item)) for lineno, item in result],
+                                 [(lineno, str(item)) for lineno, item in expected],
+                                 f'Tokenizer parse differs for incl_logs={incl_logs}, incl_refs={incl_refs}')
+
+    def test_note_line_fields_follow_modified_parts(self):
+        test_lines = list(self.CITATION_LINES.values()) + [
+            'P[240624-W26M-1000]- TaskGraph project (tags: #1a2b3c4d, #gcode, )',
+            '- 240624-W26M 10:00 - (-) TaskGraph: Render tasks (tags: #.1, #abcdef12, )',
+            '    - 240624-W26M 10:05 - (!) Extend note-parser [Refs 3] (tags: #.2, #12345678, #refd=2)',
+            '    - 240624-W26M 10:05 - (X) Used as a reference (Ref)',
+            '\n'.join(self.NOTE_LOG_LINES),
+        ]
+        items = [item for line in test_lines
+                 for item in process_note_file_lines([line + '\n'], incl_logs=True, incl_refs=True)]
+        self.assertEqual({item.item_type for _, item in items},
+                         {ItemType.ENTRY_DEFINITION_LINE, ItemType.OBJECTIVE_LINE, ItemType.CITATION_LINE,
+                          ItemType.LOG_LINE})
+
+        # Building the parts drops the fields, reading them derives the same values from the parts
+        for lineno, item in items:
+            fields = item.fields()
+            item.get_part(ItemType.TAGS)
+            self.assertTrue(item.is_modified())
+            self.assertEqual(item.fields(), fields)
+
+        lineno, item = process_note_file_lines([test_lines[-4] + '\n'])[0]
+        self.assertEqual((item.uuid, item.desc), ('abcdef12', 'TaskGraph: Render tasks'))
+        tags = item.get_part(ItemType.TAGS)
+        tags.parts = [_kv('uuid', '99999999'), _kv('tag', 'refd=1')]
+        item.get_part(ItemType.KV, key='desc').value['desc'] = 'Renamed'
+        self.assertEqual((item.uuid, item.tag('tag'), item.desc), ('99999999', 'refd=1', 'Renamed'))
+        self.assertEqual(get_tag(item, 'uuid'), '99999999')
+
+    def test_incremental_parse_matches_full_parse(self):
+        old_lines = [
+            '- 240624-W26M 10:00 - (-) First objective (tags: #.1, #abcdef12, )\n',
+            '    - 240624-W26M 10:06 - A log line that continues\n',
+            '                          onto this line\n',
+            '    - 240624-W26M 10:07 - [^T1]: Cited task #12345678\n',
+            '- 240624-W26M 10:10 - (-) Second objective\n',
+            '    - 240624-W26M 10:11 - Another log line\n',
+        ]
+
+        edits = {
+            'continuation': (3, 0, ['                          and onto a new line\n']),
+            'objective': (1, 1, ['- 240624-W26M 10:00 - (!) First objective (tags: #.1, #abcdef12, )\n']),
+            'delete': (2, 3, []),
+            'append': (7, 0, ['                          continues the last log\n']),
+        }
+
+        for edit_name, (lineno, old_count, replacement) in edits.items():
+            new_lines = old_lines[:lineno-1] + replacement + old_lines[lineno-1+old_count:]
+
+            for incl_logs in [False, True]:
+                for incl_refs in [False, True]:
+                    prev = process_note_file_lines(old_lines, incl_logs=incl_logs, incl_refs=incl_refs)
+                    diff = diff_note_lines(old_lines, new_lines)
+                    result = process_note_file_lines_incremental(prev, new_lines, *diff, incl_logs, incl_refs)
+                    expected = process_note_file_lines(new_lines, incl_logs=incl_logs, incl_refs=incl_refs)
+
+                    self.assertEqual([(i, str(item)) for i, item in result],
+                                     [(i, str(item)) for i, item in expected],
+                                     f'Incremental parse differs for edit {edit_name}')
+
+        self.assertEqual(diff_note_lines(old_lines, list(old_lines)), None)
+
+    def test_outline_index_matches_reverse_scan(self):
+        test_lines = [
+            'P[240624-W26M-ab12]- TaskGraph project (tags: #1a2b3c4d, #gcode, )',
+            '- 240624-W26M 10:00 - (-) TaskGraph: Render tasks (tags: #.1, #abcdef12, )',
+            '    - 240624-W26M 10:05 - (!) Extend note-parser (tags: #.2, #12345678, )',
+            '        - 240624-W26M 10:06 - (-) Deeper objective',
+            '            - 240624-W26M 10:07 - (-) Deepest objective',
+            '      - 240624-W26M 10:08 - (-) Shallower than its predecessor',
+            '    - 240624-W26M 10:09 - (X) Sibling of Extend note-parser',
+            '\t- 240624-W26M 10:10 - (-) Tabbed objective',
+            '- 240624-W26M 11:00 - (-) Second root',
+            '    - 240624-W26M 11:05 - (-) Child of second root',
+        ]
+        test_lines = [line + '\n' for line in test_lines]
+        parsed_items = process_note_file_lines(test_lines)
+        index = build_outline_index(parsed_items)
+
+        for lineno, item in parsed_items:
+            self.assertIs(find_item_at_lineno(parsed_items, lineno), item)
+            self.assertEqual(find_parent_item(parsed_items, lineno, index),
+                             find_parent_item_reference(parsed_items, lineno))
+
+        self.assertEqual([i for i, _ in find_parent_branch_items(parsed_items, 5, index)], [4, 3, 2])
+        self.assertEqual([i for i, _ in index.children(3)], [4, 6])
+        self.assertEqual([i for i, _ in index.children(2)], [3, 7, 8])
+        self.assertEqual(find_item_at_lineno(parsed_items, 42), None)
+        self.assertEqual(find_parent_item(parsed_items, 42), None)
+
+        # Logs and citations parsed along are skipped, the outline of the lines stays the same
+        mixed_lines = test_lines[:3] + ['        - 240624-W26M 10:05 - [^T1]: A citation #abcdef12\n',
+                                        '        _ 240624-W26M 10:05 - A log line\n'] + test_lines[3:]
+        mixed_items = process_note_file_lines(mixed_lines, incl_logs=True, incl_refs=True)
+        self.assertGreater(len(mixed_items), len(parsed_items))
+        mixed_index = build_outline_index(mixed_items)
+        for lineno, item in mixed_items:
+            self.assertIs(find_item_at_lineno(mixed_items, lineno), item)
+            parent = find_parent_item(mixed_items, lineno, mixed_index)
+            if item.item_type in [ItemType.ENTRY_DEFINITION_LINE, ItemType.OBJECTIVE_LINE]:
+                expected = find_parent_item(parsed_items, lineno - 2 if lineno > 3 else lineno, index)
+                self.assertEqual(parent and parent[1].value, expected and expected[1].value)
+            else:
+                self.assertIsNone(parent)
+                self.assertEqual(mixed_index.children(lineno), [])
+
+    def test_note_file_cache_tracks_file_changes(self):
+        import tempfile
+
+        test_lines = [
+            '- 240624-W26M 10:00 - (-) Cached objective (tags: #.1, #abcdef12, )\n',
+            '    - 240624-W26M 10:06 - A log line under it\n',
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            prev_cache_dir = os.environ.get('TTM_CACHE_DIR')
+            os.environ['TTM_CACHE_DIR'] = os.path.join(tmp_dir, 'cache')
+            try:
+                filename = os.path.join(tmp_dir, 'TTM1-notes')
+                with open(filename, 'w') as f:
+                    f.writelines(test_lines)
+
+                expected = [(lineno, str(item)) for lineno, item in process_note_file_lines(test_lines, incl_logs=True)]
+
+                # Cold and warm reads must both match a direct parse
+                for _ in range(2):
+                    result = process_note_file(filename, incl_logs=True, use_cache=True)
+                    self.assertEqual([(lineno, str(item)) for lineno, item in result], expected)
+                    self.assertTrue(os.path.exists(_note_cache_filename(filename, True, False)))
+
+                # A touch without content change keeps the entry, a content change replaces it
+                os.utime(filename, ns=(0, 0))
+                result = process_note_file(filename, incl_logs=True, use_cache=True)
+                self.assertEqual([(lineno, str(item)) for lineno, item in result], expected)
+
+                test_lines[0] = test_lines[0].replace('(-)', '(!)')
+                with open(filename, 'w') as f:
+                    f.writelines(test_lines)
+                result = process_note_file(filename, incl_logs=True, use_cache=True)
+                self.assertEqual(get_kv(result[0][1], 'status'), '!')
+
+                invalidate_note_file_cache(filename)
+                self.assertFalse(os.path.exists(_note_cache_filename(filename, True, False)))
+            finally:
+                if prev_cache_dir is None:
+                    del os.environ['TTM_CACHE_DIR']
+                else:
+                    os.environ['TTM_CACHE_DIR'] = prev_cache_dir
+
+    def test_list_note_files(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ['b', 'a/c', 'a/.c.swp', 'a/c~', '.git/HEAD', '.cache/x', 'a.git/d']:
+                os.makedirs(os.path.dirname(os.path.join(tmp_dir, name)), exist_ok=True)
+                with open(os.path.join(tmp_dir, name), 'w') as f:
+                    f.write('\n')
+            os.symlink(os.path.join(tmp_dir, 'missing'), os.path.join(tmp_dir, 'dangling'))
+            self.assertEqual(list_note_files(tmp_dir),
+                             [os.path.join(tmp_dir, name) for name in ['a.git/d', 'a/c', 'b']])
+
+    def test_edit_transaction_addresses_lines_by_lineno(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'TTM1-notes')
+            with open(filename, 'w') as f:
+                f.writelines(['same\n', 'same\n', 'last\n'])
+            os.chmod(filename, 0o600)
+
+            # The second of two identical lines, and inserts that do not shift later linenos
+            tx = EditTransaction()
+            tx.replace(filename, 2, 'second', expected='same\n')
+            tx.insert_before(filename, 2, 'before second')
+            tx.insert_after(filename, 3, 'after last')
+            tx.insert_after(filename, 2, 'after second')
+            tx.commit()
+            with open(filename) as f:
+                self.assertEqual(f.read(), 'same\nbefore second\nsecond\nafter second\nlast\nafter last\n')
+            self.assertEqual(os.stat(filename).st_mode & 0o777, 0o600)
+            self.assertEqual(os.listdir(tmp_dir), ['TTM1-notes'])
+
+            # A file that changed since it was parsed is left alone
+            tx = EditTransaction()
+            tx.replace(filename, 1, 'first', expected='other\n')
+            with self.assertRaises(Exception):
+                tx.commit()
+            with open(filename) as f:
+                self.assertEqual(f.readline(), 'same\n')
+
 if __name__ == '__main__':
     _main()
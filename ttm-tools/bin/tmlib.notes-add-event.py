@@ -4,30 +4,31 @@ import sys
 import subprocess
 import re
 import fileinput
-import importlib.util
 from importlib import import_module
 from enum import Enum, auto
 from typing import List, Optional, Tuple
 
-spec=importlib.util.spec_from_file_location("note_parser","/root/.local/bin/tmlib.note-parser.py")
-note_parser = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(note_parser)
+import ttm
+from ttm import calcure_events
+
+note_parser = ttm.note_parser
 ntp = note_parser
 #print(ntp.find_parent_item, ntp.Item)
 
-spec=importlib.util.spec_from_file_location("reg_objective","/root/.local/bin/tmlib.notes-register-objective.py")
-reg_objective = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(reg_objective)
+reg_objective = ttm.register_objective
 rgo = reg_objective
 
+tw_client = ttm.tw_client
+twc = tw_client
+
 prn_error = print
 prn_warn = print
 prn_info = print
 
 
 def system_calcure_add_event(uuid) -> bool:
-    result = subprocess.run(['tmlib.cli-calcure-add-tw-event', uuid], stdout=subprocess.PIPE)
-    if result.returncode != 0:
+    # The helper calls task itself, run it against the same task backend
+    if twc.run_script(['tmlib.cli-calcure-add-tw-event', uuid]) is None:
         prn_error(f'error: Failed to add calcure event')
         return False
 
@@ -54,73 +55,18 @@ def system_set_schedule_event_to_today(uuid) -> bool:
     # When adding an event, let's just assume it's added for now. Rounded to 5 minutes.
     hh, mm = get_rounded_time_now()
 
-    result = subprocess.run(['task', 'modify', f'{uuid}', f'sch:today+{hh}h+{mm}min'], stdout=subprocess.PIPE)
-    if result.returncode != 0:
-        prn_error(f'error: Failed to modify sch for {uuid}')
-        return False
-
-    result = subprocess.run(['task', 'modify', f'{uuid}', f'endsch:today'], stdout=subprocess.PIPE)
-    if result.returncode != 0:
-        prn_error(f'error: Failed to modify endsch for {uuid}')
+    if not twc.modify_task(uuid, [f'sch:today+{hh}h+{mm}min', 'endsch:today']):
+        prn_error(f'error: Failed to modify sch and endsch for {uuid}')
         return False
 
     return True
 
 
-def get_uuid_from_expected_csv(filename: str, lineno: int) -> Optional[str]:
-    with open(filename, 'r') as fr:
-        lines = fr.readlines()
-
-    for i, line in enumerate(lines):
-        if lineno != i+1:
-            continue
-        
-        # Don't care about tabbing or anything for this
-        line = line.strip()
-
-        expected_fields = ['status', 'yyyy', 'mm', 'dd', 'weekcode', 'interval', 'scope', 'color', 'type', 'priority', 
-                           'gcode', 'uuid', 'proj', 'desc']
-
-        tokens = line.split(',')
-
-        if len(tokens) < len(expected_fields):
-            raise Exception(f'line does not match expected format: {line}')
-
-        return tokens[expected_fields.index('uuid')]
-
-
-def get_uuid_from_events_csv(filename: str, lineno: int) -> Optional[str]:
-    with open(filename, 'r') as fr:
-        lines = fr.readlines()
-
-    for i, line in enumerate(lines):
-        if lineno != i+1:
-            continue
-        
-        # Don't care about tabbing or anything for this
-        line = line.strip()
-
-        expected_fields = ['id', 'yyyy', 'mm', 'dd', 'desc', 'repeat', 'repeat1', 'status']
-        expected_desc_fields = ['interval', 'type', 'gcode', 'uuid', 'proj', 'desc']
-
-        tokens = line.split(',')
-
-        if len(tokens) < len(expected_fields):
-            raise Exception(f'line does not match expected format: {line}')
-
-        tokens = tokens[expected_fields.index('desc')].split(' ')
-
-        if len(tokens) < len(expected_desc_fields):
-            raise Exception(f'line does not match expected format for desc: {line}')
-
-        return tokens[expected_desc_fields.index('uuid')]
-
-
 def add_event(filename, lineno) -> str:
     if 'expected.csv' in filename:
-        cur_item_uuid = get_uuid_from_expected_csv(filename, lineno)
+        cur_item_uuid = calcure_events.get_uuid_from_expected_csv(filename, lineno)
     elif 'events.csv' in filename:
-        cur_item_uuid = get_uuid_from_events_csv(filename, lineno)
+        cur_item_uuid = calcure_events.get_uuid_from_events_csv(filename, lineno)
     else:
         # Assume this is a notelog file format
         parsed_items = ntp.process_note_file(filename)
@@ -142,6 +88,7 @@ def add_event(filename, lineno) -> str:
     return cur_item_uuid
 
 if __name__ == '__main__':
-    filename = sys.argv[1]
-    lineno = int(sys.argv[2])
+    argv = ntp.strip_no_cache_arg(sys.argv)
+    filename = argv[1]
+    lineno = int(argv[2])
     add_event(filename, lineno)
@@ -5,20 +5,17 @@ import os
 import subprocess
 import re
 import fileinput
-import importlib.util
 from importlib import import_module
 from enum import Enum, auto
 from typing import List, Optional, Tuple
 
-spec=importlib.util.spec_from_file_location("note_parser","/root/.local/bin/tmlib.note-parser.py")
-note_parser = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(note_parser)
+import ttm
+
+note_parser = ttm.note_parser
 ntp = note_parser
 #print(ntp.find_parent_item, ntp.Item)
 
-spec=importlib.util.spec_from_file_location("reg_objective","/root/.local/bin/tmlib.notes-register-objective.py")
-reg_objective = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(reg_objective)
+reg_objective = ttm.register_objective
 rgo = reg_objective
 
 prn_error = print
@@ -46,6 +43,7 @@ def check_task(filename, lineno) -> str:
     return cur_item_uuid
 
 if __name__ == '__main__':
-    filename = sys.argv[1]
-    lineno = int(sys.argv[2])
+    argv = ntp.strip_no_cache_arg(sys.argv)
+    filename = argv[1]
+    lineno = int(argv[2])
     check_task(filename, lineno)
@@ -5,25 +5,15 @@ import os
 import subprocess
 import re
 import fileinput
-import importlib.util
-import unittest
 from importlib import import_module
 from enum import Enum, auto
 from typing import List, Optional, Tuple, Dict
-import pipe
 import argparse
-import pandas as pd
 from datetime import datetime as dtdt
 
-try:
-    spec=importlib.util.spec_from_file_location("note_parser","/root/.local/bin/tmlib.note-parser.py")
-    note_parser = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(note_parser)
-except Exception:
-    spec=importlib.util.spec_from_file_location("note_parser","tmlib.note-parser.py")
-    note_parser = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(note_parser)
+import ttm
 
+note_parser = ttm.note_parser
 ntp = note_parser
 
 log_file = '/tmp/citations-processor.log'
@@ -89,20 +79,20 @@ def process_task_notelog_entries_for_file(filename: str, clustered=False):
 
                 # Here we print the task with the same lineno as the notelog so that it is the
                 # priority to go to.
-                print(filename + ':' + str(lineno) + ':' + first_item.value.strip())
+                entry = [filename + ':' + str(lineno) + ':' + first_item.value.strip()]
 
                 item_val = item.value.replace('\n\n', '\n').strip()
 
                 for line in item_val.split('\n'):
                     line = line.strip()
                     if line:
-                        print(filename + ':' + str(lineno) + ':\t' + line)
+                        entry.append(filename + ':' + str(lineno) + ':\t' + line)
 
-                print('/ENTRY')
+                print_entry(entry)
 
         else: # clustered
             # Initially, we specify the task
-            print(filename + ':' + str(first_lineno) + ':' + first_item.value.strip())
+            entry = [filename + ':' + str(first_lineno) + ':' + first_item.value.strip()]
 
             for lineno, item in task_grouped[i][1:]:
                 desc = item.get_part(ntp.ItemType.KV, key='desc').value['desc'].strip()
@@ -116,10 +106,23 @@ def process_task_notelog_entries_for_file(filename: str, clustered=False):
                 for line in item_val.split('\n'):
                     line = line.strip()
                     if line:
-                        print(filename + ':' + str(lineno) + ':\t' + line)
+                        entry.append(filename + ':' + str(lineno) + ':\t' + line)
 
             # Finally, all these lines are out entry.
-            print('/ENTRY')
+            print_entry(entry)
+
+
+def print_entry(lines: List[str]):
+    """
+    Prints one grep entry: its lines followed by /ENTRY, or with --read0 a single NUL-terminated record with
+    the newlines escaped as \\n, which is what fzf --read0 reads.
+    """
+    if getattr(g_args, 'read0', False):
+        sys.stdout.write('\n'.join(lines).replace('\n', '\\n') + '\0')
+    else:
+        for line in lines:
+            print(line)
+        print('/ENTRY')
 
 
 def item_contains_cite_code(item):
@@ -162,6 +165,8 @@ def _format_note_desc(note_item):
 
 
 def process_task_notelog_ref_entries_for_file(filename: str, clustered=False):
+    import pipe
+
     parsed_items = ntp.process_note_file(filename, incl_refs=True, incl_logs=True)
 
     task_parsed_items = parsed_items \
@@ -191,6 +196,8 @@ def process_task_notelog_ref_entries_for_file(filename: str, clustered=False):
     if len(task_parsed_items) == 0:
         return
 
+    task_index = ntp.build_outline_index(task_parsed_items)
+
     # The entries cover the Tasks x Citations space, so there is always a task and a citation.
     #   It should be exactly tasks_refs_grouped.
     for i_grp in range(len(task_refs_grouped)):
@@ -223,15 +230,17 @@ def process_task_notelog_ref_entries_for_file(filename: str, clustered=False):
 
                     if cite_code.value in note_desc:
                         found = True
-                        print(filename + ':' + str(note_lineno) + ':' + task_item.value.strip())
-                        print(filename + ':' + str(note_lineno) + ':' + ref_item.value.strip())
-                        print(filename + ':' + str(note_lineno) + ':' + _format_note_desc(note_item))
-                        print('/ENTRY')
+                        print_entry([
+                            filename + ':' + str(note_lineno) + ':' + task_item.value.strip(),
+                            filename + ':' + str(note_lineno) + ':' + ref_item.value.strip(),
+                            filename + ':' + str(note_lineno) + ':' + _format_note_desc(note_item),
+                        ])
                 
                 if not found:
-                    print(filename + ':' + str(ref_lineno) + ':' + task_item.value.strip())
-                    print(filename + ':' + str(ref_lineno) + ':' + ref_item.value.strip())
-                    print('/ENTRY')
+                    print_entry([
+                        filename + ':' + str(ref_lineno) + ':' + task_item.value.strip(),
+                        filename + ':' + str(ref_lineno) + ':' + ref_item.value.strip(),
+                    ])
                 
             else:
                 # This is clustered by notelog
@@ -242,15 +251,14 @@ def process_task_notelog_ref_entries_for_file(filename: str, clustered=False):
                     if cite_code.value in note_desc:
                         notelogs.append(filename + ':' + str(ref_lineno) + ':' + _format_note_desc(note_item))
                 
-                print(filename + ':' + str(ref_lineno) + ':' + task_item.value.strip())
-                print(filename + ':' + str(ref_lineno) + ':' + ref_item.value.strip())
-                if len(notelogs) != 0: # This was here before, because we only printed the task/ref if notelogs are found.
-                    for notelog in notelogs:
-                        print(notelog)
-                print('/ENTRY')
+                # The task/ref used to be printed only if notelogs are found.
+                print_entry([
+                    filename + ':' + str(ref_lineno) + ':' + task_item.value.strip(),
+                    filename + ':' + str(ref_lineno) + ':' + ref_item.value.strip(),
+                ] + notelogs)
 
         # Now let's process the non-obvious cases. notelogs can refer to citations from the parent branch!
-        task_branch = ntp.find_parent_branch_items(task_parsed_items, task_lineno)
+        task_branch = ntp.find_parent_branch_items(task_parsed_items, task_lineno, task_index)
 
         for parent_task_lineno, parent_task in task_branch:
             i_prn_grp = None
@@ -292,11 +300,12 @@ def process_task_notelog_ref_entries_for_file(filename: str, clustered=False):
                         if parent_cite_code.value in note_desc or \
                            parent_cite_code.value.replace('^', '^P::') in note_desc or \
                            parent_cite_code.value.replace('^', '^PRJ::') in note_desc:
-                            print(filename + ':' + str(note_lineno) + ':' + task_item.value.strip())
-                            print(filename + ':' + str(note_lineno) + ':' + parent_task.value.strip())
-                            print(filename + ':' + str(note_lineno) + ':' + ref_item.value.strip())
-                            print(filename + ':' + str(note_lineno) + ':' + _format_note_desc(note_item))
-                            print('/ENTRY')
+                            print_entry([
+                                filename + ':' + str(note_lineno) + ':' + task_item.value.strip(),
+                                filename + ':' + str(note_lineno) + ':' + parent_task.value.strip(),
+                                filename + ':' + str(note_lineno) + ':' + ref_item.value.strip(),
+                                filename + ':' + str(note_lineno) + ':' + _format_note_desc(note_item),
+                            ])
                 else:
                     # This is clustered by notelog
                     notelogs = []
@@ -309,12 +318,11 @@ def process_task_notelog_ref_entries_for_file(filename: str, clustered=False):
                             notelogs.append(filename + ':' + str(ref_lineno) + ':' + _format_note_desc(note_item))
                     
                     if len(notelogs) != 0:
-                        print(filename + ':' + str(ref_lineno) + ':' + task_item.value.strip())
-                        print(filename + ':' + str(ref_lineno) + ':' + parent_task.value.strip())
-                        print(filename + ':' + str(ref_lineno) + ':' + ref_item.value.strip())
-                        for notelog in notelogs:
-                            print(notelog)
-                        print('/ENTRY')
+                        print_entry([
+                            filename + ':' + str(ref_lineno) + ':' + task_item.value.strip(),
+                            filename + ':' + str(ref_lineno) + ':' + parent_task.value.strip(),
+                            filename + ':' + str(ref_lineno) + ':' + ref_item.value.strip(),
+                        ] + notelogs)
 
 
 def sha256_hash(s):
@@ -332,26 +340,91 @@ def process_global_node_id(item, category, desc):
     return 'N:' + sha256_hash(category + desc)
     
 
-def parse_citation_dataset(filename: str) -> pd.DataFrame:
+# pandas takes most of a second to import, so only the dataset code imports it, where it is used
+class CitationDataset:
+    """
+    Column-wise accumulator for the citation dataset. Rows from every file are appended to plain lists and a
+    single DataFrame is made at the end.
+    """
+    COLUMNS = ['filename', 'lineno', 'node_uuid', 'datetime', 'task_datetime', 'task_uuid', 'subject_node',
+               'category', 'object_node', 'relation', 'is_from', 'status', 'desc']
+    CATEGORICAL_COLUMNS = ['filename', 'category', 'relation', 'status']
+    FORMATS = ['csv', 'parquet', 'feather']
+
+    def __init__(self):
+        self.columns: Dict[str, list] = {column: [] for column in self.COLUMNS}
+
+    def __len__(self):
+        return len(self.columns['filename'])
+
+    def append(self, **row):
+        for column in self.COLUMNS:
+            self.columns[column].append(row[column])
+
+    def extend(self, columns: Dict[str, list]):
+        for column in self.COLUMNS:
+            self.columns[column].extend(columns[column])
+
+    def to_dataframe(self) -> 'pd.DataFrame':
+        import pandas as pd
+        return self.categorize(pd.DataFrame(self.columns, columns=self.COLUMNS))
+
+    @classmethod
+    def categorize(cls, df: 'pd.DataFrame') -> 'pd.DataFrame':
+        for column in cls.CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype('category')
+        return df
+
+    @classmethod
+    def output_format(cls, filename: str, fmt: Optional[str] = None) -> str:
+        """The format defaults to the one named by the file extension, and otherwise csv."""
+        if fmt is None:
+            ext = os.path.splitext(filename)[1].lstrip('.')
+            fmt = ext if ext in cls.FORMATS else 'csv'
+        return fmt
+
+    @classmethod
+    def write(cls, df: 'pd.DataFrame', filename: str, fmt: Optional[str] = None):
+        fmt = cls.output_format(filename, fmt)
+        if fmt == 'csv':
+            df.to_csv(filename)
+        elif fmt == 'parquet':
+            df.to_parquet(filename)
+        elif fmt == 'feather':
+            df.to_feather(filename)
+        else:
+            raise ValueError(f'Unknown dataset format {fmt}')
+
+    @classmethod
+    def read(cls, filename: str, fmt: Optional[str] = None) -> 'pd.DataFrame':
+        import pandas as pd
+
+        fmt = cls.output_format(filename, fmt)
+        if fmt == 'csv':
+            # Everything is read back as the text that was written, so that writing it again gives the same
+            # file (uuids like 00001234 must not turn into numbers).
+            return pd.read_csv(filename, index_col=0, dtype=str, keep_default_na=False)
+        elif fmt == 'parquet':
+            return pd.read_parquet(filename)
+        elif fmt == 'feather':
+            return pd.read_feather(filename)
+        raise ValueError(f'Unknown dataset format {fmt}')
+
+
+def collect_citation_dataset(filename: str, dataset: CitationDataset):
     parsed_items = ntp.process_note_file(filename, incl_refs=True)
     task_grouped = cluster_items_by_objective(parsed_items)
 
-    records = []
-
     for i in range(len(task_grouped)):
         if len(task_grouped[i]) <= 1:
             continue
 
         _, first_item = task_grouped[i][0]
 
-        task_datetime = first_item.get_part(ntp.ItemType.TIME_DATE)
+        task_datetime = first_item.time_date
 
-        task_tags = first_item.get_part(ntp.ItemType.TAGS)
-        if not task_tags:
-            continue
-
-        uuid = ntp.get_kv(task_tags, 'uuid')
-        if uuid == None:
+        uuid = first_item.uuid
+        if uuid == '':
             continue
         log_debug(f'task uuid: {uuid}')
 
@@ -359,95 +432,67 @@ def parse_citation_dataset(filename: str) -> pd.DataFrame:
             if item.item_type != ntp.ItemType.CITATION_LINE:
                 continue
 
-            time_date = item.get_part(ntp.ItemType.TIME_DATE)
-            cite_code = item.get_part(ntp.ItemType.CITE_CODE)
-            relations = item.get_part(ntp.ItemType.CITE_RELATION)
-            desc = ntp.get_kv(item, 'desc').strip()
+            time_date = item.time_date
+            cite_code = item.cite_code
+            desc = item.desc.strip()
 
             # Figure out the category for the subject_node
-            codes = ntp.get_kv(cite_code, 'code')
-            if type(codes) is list:
-                category = codes[-1]
-            else:
-                category = codes
+            category = cite_code.codes[-1]
             
             # Figure out the global node_id for this citation
             node_id = process_global_node_id(item, category, desc)
 
-            record = {
-                'filename': filename,
-                'lineno': lineno,
-                'node_uuid': node_id,
-                'datetime': time_date.value,
-                'task_datetime': task_datetime.value,
-                'task_uuid': uuid, 
-                'subject_node': cite_code.value, 
-                'category': category,
-            }
-
-            if relations is None:
-                record = {**record, **{
-                    'object_node': None,
-                    'relation': None,
-                    'is_from': None,
-                    'status': None,
-                }}
-            elif type(relations) is list:
-                for relation in relations:
-                    record = {**record, **{
-                        'object_node': ntp.get_kv(relation, 'node'), 
-                        'relation': ntp.get_kv(relation, 'relation'), 
-                        'is_from': ntp.get_kv(relation, 'is_from'),
-                        'status': ntp.get_kv(relation, 'status'),
-                    }}
-            else:
-                record = {**record, **{
-                    'object_node': ntp.get_kv(relations, 'node'), 
-                    'relation': ntp.get_kv(relations, 'relation'), 
-                    'is_from': ntp.get_kv(relations, 'is_from'),
-                    'status': ntp.get_kv(relations, 'status'),
-                }}
-            
-            record = {**record, **{'desc': desc}}
-            records.append(record)
-    
-    return pd.DataFrame.from_records(records)
-
-
-def main(args: argparse.Namespace):
-    log_debug('==================================================================================')
-    log_debug(f'args: {args}')
-
-    directory = args.directory
-
-    import os
-    from glob import glob
-    filenames = [y for x in os.walk(directory) for y in glob(os.path.join(x[0], '*'))]
-
-    # Some commands may want to accumulate a dataset across multiple files
-    df_tot = None
-
-    for filename in filenames:
+            # Only the last relation is kept in the record
+            relation = item.relations[-1] if len(item.relations) != 0 else None
+
+            dataset.append(
+                filename=filename,
+                lineno=lineno,
+                node_uuid=node_id,
+                datetime=time_date.value,
+                task_datetime=task_datetime.value,
+                task_uuid=uuid,
+                subject_node=cite_code.value,
+                category=category,
+                object_node=relation.node if relation else None,
+                relation=relation.relation if relation else None,
+                is_from=relation.is_from if relation else None,
+                status=relation.status if relation else None,
+                desc=desc,
+            )
+
+
+def parse_citation_dataset(filename: str) -> 'pd.DataFrame':
+    dataset = CitationDataset()
+    collect_citation_dataset(filename, dataset)
+    return dataset.to_dataframe()
+
+
+def process_file(filename: str, subcommand: str, clustered: bool) -> Tuple[str, Optional[Dict[str, list]], bool]:
+    """
+    Runs subcommand on one file. Returns what it printed, for parse-citation-dataset its dataset columns, and
+    False if processing the file failed part way, so that results computed in worker processes can be merged in
+    order.
+    """
+    import io
+    import contextlib
+
+    out = io.StringIO()
+    dataset = None
+    ok = True
+    with contextlib.redirect_stdout(out):
         try:
-            if '.git' in filename:
-                continue
-            
             log_debug(f'filename: {filename}')
 
-            f = os.path.join(directory, filename)
-            if os.path.isfile(f):
-                if args.subcommand == 'group-task-notelog':
-                    process_task_notelog_entries_for_file(filename, clustered=args.clustered)
+            if subcommand == 'group-task-notelog':
+                process_task_notelog_entries_for_file(filename, clustered=clustered)
 
-                if args.subcommand == 'parse-citation-dataset':
-                    df = parse_citation_dataset(filename)
-                    if df_tot is None:
-                        df_tot = df
-                    else:
-                        df_tot = pd.concat([df_tot, df], ignore_index=True)
+            if subcommand == 'parse-citation-dataset':
+                dataset = CitationDataset()
+                collect_citation_dataset(filename, dataset)
 
-                if args.subcommand == 'group-task-notelog-reference':
-                    process_task_notelog_ref_entries_for_file(filename, clustered=args.clustered)
+            if subcommand == 'group-task-notelog-reference':
+                process_task_notelog_ref_entries_for_file(filename, clustered=clustered)
 
         except UnicodeDecodeError:
             pass
@@ -455,9 +500,252 @@ def main(args: argparse.Namespace):
             import traceback
             error_trace = traceback.format_exc()
             log_error(f'Reached an error while processing filename {filename}:\n{error_trace}')
+            ok = False
+
+    return out.getvalue(), dataset.columns if dataset else None, ok
+
+
+def _init_worker(verbose, read0):
+    global g_args
+    g_args = argparse.Namespace(verbose=verbose, read0=read0)
+
+
+def _process_file_star(job):
+    return process_file(*job)
+
+
+def iter_file_results(filenames: List[str], args: argparse.Namespace):
+    """
+    Yields process_file results for filenames, in order. With --jobs the files are processed in worker
+    processes.
+    """
+    clustered = getattr(args, 'clustered', False)
+    jobs = [(filename, args.subcommand, clustered) for filename in filenames]
+
+    if args.jobs <= 1 or len(jobs) <= 1:
+        yield from map(_process_file_star, jobs)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    executor = ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(args.verbose, args.read0))
+    try:
+        # map() yields in submission order, which keeps the output identical to a serial run
+        chunksize = max(1, len(jobs) // (args.jobs * 8))
+        yield from executor.map(_process_file_star, jobs, chunksize=chunksize)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def write_citation_dataset(df: 'pd.DataFrame', filename: str, fmt: Optional[str]):
+    try:
+        CitationDataset.write(df, filename, fmt)
+    except ImportError as e:
+        # Parquet and feather need pyarrow
+        log_error(f'Cannot write {filename}: {e}')
+        sys.stderr.write(f'error: {e}\n')
+        sys.exit(1)
+
+
+def _file_digest(filename: str) -> str:
+    import hashlib
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+CITATION_MANIFEST_VERSION = 1
+
+def citation_manifest_filename(dataset_filename: str) -> str:
+    return dataset_filename + '.manifest.json'
+
+
+def load_citation_manifest(dataset_filename: str, fmt: str) -> Optional[Dict]:
+    """
+    Returns the manifest of a dataset written by refresh_citation_dataset, or None if there is none or the
+    dataset was rewritten by something else since.
+    """
+    import json
+
+    try:
+        with open(citation_manifest_filename(dataset_filename), 'r') as f:
+            manifest = json.load(f)
+        st = os.stat(dataset_filename)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('version') != CITATION_MANIFEST_VERSION or manifest.get('format') != fmt:
+        return None
+    if manifest.get('dataset') != {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}:
+        log_info(f'{dataset_filename} changed since its manifest was written')
+        return None
+    return manifest
+
+
+def _replace_file(filename: str, cb_write):
+    import tempfile
+
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                        prefix='.' + os.path.basename(filename) + '.')
+    os.close(fd)
+    try:
+        cb_write(tmp_filename)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+
+
+def refresh_citation_dataset(args: argparse.Namespace, filenames: List[str]):
+    """
+    Updates the dataset at args.csv_df_filename in place, re-parsing only the files whose content changed
+    since the last refresh. The manifest next to the dataset maps every file to its mtime, size, content hash
+    and the range of rows it owns in the dataset.
+    """
+    import json
+    import pandas as pd
+
+    output = args.csv_df_filename
+    fmt = CitationDataset.output_format(output, args.format)
+
+    manifest = load_citation_manifest(output, fmt)
+    old_df = None
+    if manifest is not None:
+        try:
+            old_df = CitationDataset.read(output, fmt)
+        except Exception as e:
+            log_warn(f'Cannot read {output}, rebuilding it: {e}')
+            manifest = None
+    old_files = manifest['files'] if manifest else {}
+
+    files = {}
+    changed = []
+    for filename in filenames:
+        st = os.stat(filename)
+        entry = old_files.get(filename)
+        if entry and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            files[filename] = entry
+            continue
+
+        digest = _file_digest(filename)
+        if entry and entry['hash'] == digest:
+            files[filename] = {**entry, 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+            continue
+
+        files[filename] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'hash': digest}
+        changed.append(filename)
+
+    deleted = [filename for filename in old_files if filename not in files]
+    log_info(f'{len(changed)} changed, {len(deleted)} deleted, {len(files) - len(changed)} unchanged')
+
+    parsed = {}
+    errored = []
+    for filename, (_, columns, ok) in zip(changed, iter_file_results(changed, args)):
+        parsed[filename] = columns
+        if not ok:
+            errored.append(filename)
+
+    if manifest is None or changed or deleted:
+        # Stitch the rows of unchanged files to the re-parsed ones, keeping files in path order
+        pieces = []
+        n_rows = 0
+        for filename in filenames:
+            if filename in parsed:
+                dataset = CitationDataset()
+                if parsed[filename] is not None:
+                    dataset.extend(parsed[filename])
+                piece = pd.DataFrame(dataset.columns, columns=CitationDataset.COLUMNS)
+            else:
+                piece = old_df.iloc[files[filename]['start']:files[filename]['stop']]
+
+            files[filename]['start'] = n_rows
+            n_rows += len(piece)
+            files[filename]['stop'] = n_rows
+            if len(piece) != 0:
+                pieces.append(piece)
+
+        if pieces:
+            df = CitationDataset.categorize(pd.concat(pieces, ignore_index=True))
+        else:
+            df = CitationDataset().to_dataframe()
+
+        _replace_file(output, lambda tmp_filename: write_citation_dataset(df, tmp_filename, fmt))
+
+    # Their rows are kept like a full rebuild would, but they are parsed again on the next refresh
+    for filename in errored:
+        del files[filename]
+
+    st = os.stat(output)
+    manifest = {
+        'version': CITATION_MANIFEST_VERSION,
+        'format': fmt,
+        'dataset': {'mtime_ns': st.st_mtime_ns, 'size': st.st_size},
+        'files': files,
+    }
+
+    def _write_manifest(tmp_filename):
+        with open(tmp_filename, 'w') as f:
+            json.dump(manifest, f)
+
+    _replace_file(citation_manifest_filename(output), _write_manifest)
+
+
+def files_with_citations(directory: str, filenames: List[str]) -> List[str]:
+    """
+    The filenames that ttm-indexd knows to have citation lines, in order. Only those give
+    group-task-notelog-reference entries or parse-citation-dataset rows. All of filenames when no daemon
+    indexes directory.
+    """
+    status = ntp.query_note_index('status')
+    if not status:
+        return filenames
+
+    root = status[0]['root']
+    directory = os.path.abspath(directory)
+    if directory != root and not directory.startswith(root + os.sep):
+        return filenames
+
+    citations = ntp.query_note_index('cite')
+    if citations is None:
+        return filenames
+
+    cited = {location['filename'] for location in citations}
+    return [filename for filename in filenames if os.path.abspath(filename) in cited]
+
+
+def main(args: argparse.Namespace):
+    log_debug('==================================================================================')
+    log_debug(f'args: {args}')
+
+    # Sorted, so that serial and parallel runs print files in the same order
+    filenames = ntp.list_note_files(args.directory)
+
+    if args.subcommand == 'parse-citation-dataset' and args.incremental:
+        refresh_citation_dataset(args, filenames)
+        return
+
+    # The incremental refresh keeps a manifest of every file, so it still goes through all of them
+    if args.subcommand in ['group-task-notelog-reference', 'parse-citation-dataset']:
+        filenames = files_with_citations(args.directory, filenames)
+
+    # Some commands may want to accumulate a dataset across multiple files
+    dataset = CitationDataset()
+
+    try:
+        for out, columns, _ in iter_file_results(filenames, args):
+            if out:
+                # Flushed per file so that a reader like fzf can show entries while the rest are parsed
+                sys.stdout.write(out)
+                sys.stdout.flush()
+
+            if columns is not None:
+                dataset.extend(columns)
+    except BrokenPipeError:
+        # The reader went away, e.g. fzf exited before we were done. Silence the flush at interpreter exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
     
-    if df_tot is not None:
-        df_tot.to_csv(args.csv_df_filename)
+    if args.subcommand == 'parse-citation-dataset':
+        write_citation_dataset(dataset.to_dataframe(), args.csv_df_filename, args.format)
 
 
 def cmdline_args():
@@ -469,6 +757,12 @@ def cmdline_args():
                    help="Location to search in")
     p.add_argument('-v', '--verbose', action='count', default=0,
                    help="Increase verbosity level (use -v, -vv, or -vvv)")
+    p.add_argument('--no-cache', action='store_true',
+                   help="Do not use the note parse cache")
+    p.add_argument('-j', '--jobs', type=int, default=1,
+                   help="Number of processes to parse files with (default: %(default)s)")
+    p.add_argument('--read0', action='store_true',
+                   help="Terminate entries with NUL instead of an /ENTRY line, escaping their newlines (for fzf --read0)")
                    
     subparsers = p.add_subparsers(dest='subcommand')
     subparsers.required = True
@@ -487,6 +781,12 @@ def cmdline_args():
                                help='Parses a table of citations from the files in the directory given')
     sp.add_argument("csv_df_filename",
                     help="Where to save the output dataset")
+    sp.add_argument("--format", choices=CitationDataset.FORMATS, default=None,
+                    help="Output format, by default taken from the file extension and otherwise csv. "
+                         "parquet and feather need pyarrow.")
+    sp.add_argument("--incremental", action="store_true",
+                    help="Update the dataset in place, re-parsing only files changed since the last --incremental "
+                         "run. Keeps a manifest next to the dataset.")
 
     return(p.parse_args())
 
@@ -515,9 +815,182 @@ def _main():
 
     args = cmdline_args()
     g_args = args
+    if args.no_cache:
+        ntp.disable_note_cache()
     main(args)
 
-class UnitTests(unittest.TestCase):
+class UnitTests(ttm.TestCase):
+    @staticmethod
+    def write_test_vault(directory: str, n_files: int):
+        os.makedirs(os.path.join(directory, 'projects'), exist_ok=True)
+        for i in range(n_files):
+            with open(os.path.join(directory, 'projects', f'P-{i:02}'), 'w') as f:
+                f.write(f'P[240624-W26M-10{i:02}]- Project {i} (tags: #1a2b3c{i:02}, )\n'
+                        f'\t- 240624-W26M 10:00 - (-) Objective A{i} (tags: #2b3c4d{i:02}, )\n'
+                        f'\t\t- 240624-W26M 10:05 - A log line with words\n'
+                        f'\t\t                      and a continuation\n'
+                        f'\t\t- 240624-W26M 10:06 - [^T1]: Task cite /T::goal_of/ #abcdef{i:02}\n'
+                        f'\t\t- 240624-W26M 10:07 - Uses [^T1] in a log\n'
+                        f'\t\t- 240624-W26M 10:08 - Section\n'
+                        f'\t- 240624-W26M 10:10 - (A) Objective B{i} (tags: #3c4d5e{i:02}, )\n'
+                        f'\t\t- 240624-W26M 10:11 - [^T2]: (-) /T::blocks/ multi\n'
+                        f'\t\t- 240624-W26M 10:12 - Refers to [^T2] and [^P::T1]\n'
+                        f'\t- 240624-W26M 10:20 - (-) Objective C{i}\n')
+
+    def run_processor(self, directory: str, *argv, **env) -> bytes:
+        import subprocess
+
+        env = dict(os.environ, TTM_CACHE_DIR=os.path.join(directory, '.cache'), **env)
+        return subprocess.run([sys.executable, __file__, os.path.join(directory, 'projects')] + list(argv),
+                              env=env, check=True, stdout=subprocess.PIPE).stdout
+
+    def test_jobs_output_is_identical_to_serial(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.write_test_vault(tmp_dir, 24)
+            for subcommand in [['group-task-notelog'], ['group-task-notelog', '--clustered'],
+                               ['group-task-notelog-reference']]:
+                serial = self.run_processor(tmp_dir, '--jobs', '1', *subcommand)
+                self.assertIn(b'/ENTRY\n', serial)
+                self.assertEqual(self.run_processor(tmp_dir, '--jobs', '4', *subcommand), serial)
+                self.assertEqual(self.run_processor(tmp_dir, '--jobs', '4', '--read0', *subcommand),
+                                 self.run_processor(tmp_dir, '--jobs', '1', '--read0', *subcommand))
+
+    def test_read0_records_are_the_entries_escaped(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.write_test_vault(tmp_dir, 3)
+            for subcommand in [['group-task-notelog'], ['group-task-notelog', '--clustered']]:
+                entries = self.run_processor(tmp_dir, *subcommand).decode()
+                records = self.run_processor(tmp_dir, '--read0', *subcommand).decode()
+
+                # One NUL terminated record per entry, on a single line
+                self.assertTrue(records.endswith('\0'))
+                records = records[:-1].split('\0')
+                self.assertEqual(len(records), entries.count('/ENTRY\n'))
+                for record in records:
+                    self.assertNotIn('\n', record)
+
+                self.assertEqual([record.replace('\\n', '\n') + '\n' for record in records],
+                                 entries.split('/ENTRY\n')[:-1])
+                # Some entries span several lines
+                self.assertTrue(any('\\n' in record for record in records))
+
+    def test_indexd_skips_the_files_without_citations(self):
+        import subprocess
+        import tempfile
+        import time
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.write_test_vault(tmp_dir, 3)
+            with open(os.path.join(tmp_dir, 'projects', 'P-none'), 'w') as f:
+                f.write('- 240624-W26M 10:00 - (-) No citations here (tags: #4d5e6f70, )\n')
+
+            socket_path = os.path.join(tmp_dir, 'indexd.sock')
+            daemon = subprocess.Popen([sys.executable, ttm.script_filename('tmlib.notes-indexd.py'),
+                                       '--socket', socket_path, 'serve', os.path.join(tmp_dir, 'projects')])
+            try:
+                query = [sys.executable, ttm.script_filename('tmlib.notes-indexd.py'), '--socket', socket_path,
+                         'query', 'status']
+                for _ in range(100):
+                    if subprocess.run(query, env=dict(os.environ, TTM_NO_INDEXD=''),
+                                      stdout=subprocess.DEVNULL).returncode == 0:
+                        break
+                    time.sleep(0.05)
+
+                cache_dir = os.path.join(tmp_dir, '.cache', 'notes')
+                indexed = self.run_processor(tmp_dir, 'group-task-notelog-reference',
+                                             TTM_NO_INDEXD='', TTM_INDEXD_SOCKET=socket_path)
+                self.assertEqual(len(os.listdir(cache_dir)), 3)
+            finally:
+                daemon.terminate()
+                daemon.wait()
+
+            parsed = self.run_processor(tmp_dir, 'group-task-notelog-reference', TTM_NO_INDEXD='1')
+            self.assertEqual(len(os.listdir(cache_dir)), 4)
+            self.assertIn(b'/ENTRY\n', indexed)
+            self.assertEqual(indexed, parsed)
+
+    def test_incremental_refresh_matches_full_rebuild(self):
+        import tempfile
+
+        global collect_citation_dataset
+        collect = collect_citation_dataset
+        collected = []
+        failing = set()
+
+        def collect_counted(filename, dataset):
+            collected.append(os.path.basename(filename))
+            collect(filename, dataset)
+            if os.path.basename(filename) in failing:
+                raise ValueError('parser bug')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.write_test_vault(tmp_dir, 6)
+            projects = os.path.join(tmp_dir, 'projects')
+            output = os.path.join(tmp_dir, 'dataset.csv')
+            saved_env = dict(os.environ)
+            os.environ['TTM_CACHE_DIR'] = os.path.join(tmp_dir, '.cache')
+            collect_citation_dataset = collect_counted
+            try:
+                def refresh():
+                    collected.clear()
+                    args = argparse.Namespace(directory=projects, csv_df_filename=output, format=None, jobs=1,
+                                              verbose=0, read0=False, subcommand='parse-citation-dataset',
+                                              clustered=False, incremental=True)
+                    refresh_citation_dataset(args, ntp.list_note_files(projects))
+
+                    # What a full rebuild writes from scratch
+                    rebuilt = os.path.join(tmp_dir, 'rebuilt.csv')
+                    main(argparse.Namespace(**{**vars(args), 'csv_df_filename': rebuilt, 'incremental': False}))
+                    with open(output) as f_output, open(rebuilt) as f_rebuilt:
+                        self.assertEqual(f_output.read(), f_rebuilt.read())
+                    return sorted(collected[:len(collected) - len(ntp.list_note_files(projects))])
+
+                def append(name, text):
+                    with open(os.path.join(projects, name), 'a') as f:
+                        f.write(text)
+
+                self.assertEqual(len(refresh()), 6)
+                self.assertEqual(refresh(), [])
+
+                # Edit: the citation is in the dataset, and only that file is parsed again
+                with open(os.path.join(projects, 'P-02')) as f:
+                    text = f.read()
+                with open(os.path.join(projects, 'P-02'), 'w') as f:
+                    f.write(text.replace('(-) Objective C2', '(-) Objective C2 (tags: #4d5e6f02, )\n'
+                                         '\t\t- 240624-W26M 10:21 - [^T3]: Added cite /T::goal_of/ #abcdefff\n'
+                                         '\t- 240624-W26M 10:30 - (-) Objective D2'))
+                self.assertEqual(refresh(), ['P-02'])
+                with open(output) as f:
+                    self.assertIn('Added cite', f.read())
+
+                # Add a file between others, and one at the end
+                self.write_test_vault(os.path.join(tmp_dir, 'new'), 8)
+                os.rename(os.path.join(tmp_dir, 'new', 'projects', 'P-07'), os.path.join(projects, 'P-07'))
+                os.rename(os.path.join(tmp_dir, 'new', 'projects', 'P-03'), os.path.join(projects, 'P-03b'))
+                self.assertEqual(refresh(), ['P-03b', 'P-07'])
+
+                # Delete
+                os.remove(os.path.join(projects, 'P-00'))
+                os.remove(os.path.join(projects, 'P-03b'))
+                self.assertEqual(refresh(), [])
+
+                # A file that fails to parse is parsed again on every refresh, until it parses
+                failing.add('P-04')
+                append('P-04', '\n')
+                self.assertEqual(refresh(), ['P-04'])
+                self.assertEqual(refresh(), ['P-04'])
+                failing.clear()
+                self.assertEqual(refresh(), ['P-04'])
+                self.assertEqual(refresh(), [])
+            finally:
+                collect_citation_dataset = collect
+                os.environ.clear()
+                os.environ.update(saved_env)
+
     def test_manual_can_parse_citation_dataset(self):
         # Input some file here to test. The below is not guaranteed to exit on your system.
         filename = '/root/notes/projects/TTM1-ttm_dev'
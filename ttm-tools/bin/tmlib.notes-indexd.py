@@ -0,0 +1,614 @@
+#!/bin/python3
+"""
+ttm-indexd: keeps the parsed items of every note file in memory and answers lookups over a Unix socket.
+
+The notes directory is watched with inotify (or polled where inotify is not available), so the index follows
+edits without re-reading the vault. Queries are one JSON object per line, {"op": ..., "arg": ...}, answered
+with {"ok": true, "result": [...]} where each result is a location {"filename", "lineno", "text", ...}.
+
+    uuid <uuid>          lines tagged with #<uuid>
+    notelink <token>     lines mentioning the note token, e.g. P[240624-W26M-1234]
+    cite [<code>]        citation lines defining a cite code, e.g. [^T1], or every citation line
+    line <file>:<lineno> the line, with the uuid: KV of its item (e.g. the task a citation points to) if it has one
+    children <uuid>      objectives directly below the objective tagged with #<uuid>
+    status               number of indexed files and the watched root
+"""
+
+import os
+import sys
+import re
+import json
+import time
+import ctypes
+import ctypes.util
+import socket
+import struct
+import selectors
+from typing import List, Optional, Tuple, Dict
+import argparse
+
+import ttm
+
+log_file = '/tmp/note-indexd.log'
+log_echo_stdout = False
+
+def log_any(s, status, verbose_level):
+    from datetime import datetime as dtdt
+
+    if g_args.verbose < verbose_level:
+        return
+
+    with open(log_file, 'a') as f:
+        s = str(dtdt.today()) + f' {status} - ' + s
+        f.write(s + '\n')
+        if log_echo_stdout:
+            print(s)
+
+
+def log_error(s): return log_any(s, 'ERROR', verbose_level=0)
+def log_info(s): return log_any(s, 'INFO', verbose_level=1)
+def log_warn(s): return log_any(s, 'WARN', verbose_level=1)
+def log_debug(s): return log_any(s, 'DEBUG', verbose_level=2)
+def log_trace(s): return log_any(s, 'TRACE', verbose_level=3)
+
+note_parser = ttm.note_parser
+ntp = note_parser
+
+_P_NOTE_TOKEN = re.compile(ntp.RE_NOTE_TOKEN)
+
+
+class FileIndex:
+    """
+    What the daemon knows about one note file. Keys map to the linenos they appear on.
+    """
+    __slots__ = ('mtime_ns', 'size', 'lines', 'outline', 'uuids', 'notelinks', 'cites', 'kv_uuids')
+
+    def __init__(self, filename: str):
+        st = os.stat(filename)
+        with open(filename, 'r') as f:
+            lines = f.readlines()
+
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.lines = lines
+
+        # With the log lines, so that uuids tagged on `_` log lines are found too
+        parsed_items = ntp.process_note_file_lines(lines, incl_logs=True, incl_refs=True)
+        outline_items = [(lineno, item) for lineno, item in parsed_items
+                         if item.item_type in [ntp.ItemType.ENTRY_DEFINITION_LINE, ntp.ItemType.OBJECTIVE_LINE]]
+        self.outline = ntp.build_outline_index(outline_items)
+
+        self.uuids: Dict[str, List[int]] = {}
+        self.cites: Dict[str, List[int]] = {}
+        self.kv_uuids: Dict[int, str] = {}
+        for lineno, item in parsed_items:
+            if item.item_type == ntp.ItemType.CITATION_LINE:
+                self.cites.setdefault(item.cite_code.value, []).append(lineno)
+            else:
+                for key, value in item.tags:
+                    if key == 'uuid':
+                        self.uuids.setdefault(value, []).append(lineno)
+
+            # As cli-goto-uuid parses the file, without the log lines
+            if item.item_type != ntp.ItemType.LOG_LINE:
+                uuid = ntp.get_kv(item, 'uuid')
+                if uuid:
+                    self.kv_uuids[lineno] = uuid
+
+        self.notelinks: Dict[str, List[int]] = {}
+        for i, line in enumerate(lines):
+            if 'P[' not in line:
+                continue
+            for token in set(_P_NOTE_TOKEN.findall(line)):
+                self.notelinks.setdefault(token, []).append(i+1)
+
+    def is_current(self, st: os.stat_result) -> bool:
+        return self.mtime_ns == st.st_mtime_ns and self.size == st.st_size
+
+
+class NoteIndex:
+    """
+    In-memory index over every note file below root. Each key maps to {filename: [lineno, ...]} so that a file
+    can be dropped or replaced without rebuilding the rest.
+    """
+    KINDS = ['uuids', 'notelinks', 'cites']
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.files: Dict[str, FileIndex] = {}
+        self.keys: Dict[str, Dict[str, Dict[str, List[int]]]] = {kind: {} for kind in self.KINDS}
+
+    @staticmethod
+    def is_note_path(path: str) -> bool:
+        # Skips git internals and editor swap/backup files
+        name = os.path.basename(path)
+        return '.git' not in path.split(os.sep) and not name.startswith('.') and not name.endswith('~')
+
+    def walk(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if self.is_note_path(os.path.join(dirpath, d))]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if self.is_note_path(path):
+                    yield path
+
+    def build(self):
+        for path in self.walk():
+            self.update_file(path)
+        log_info(f'Indexed {len(self.files)} files below {self.root}')
+
+    def rescan(self):
+        """Polling fallback: picks up changes by comparing stats of every file."""
+        seen = set()
+        for path in self.walk():
+            seen.add(path)
+            self.update_file(path)
+        for path in list(self.files):
+            if path not in seen:
+                self.remove_file(path)
+
+    def update_file(self, path: str):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.remove_file(path)
+            return
+
+        if path in self.files and self.files[path].is_current(st):
+            return
+
+        self.remove_file(path)
+        try:
+            file_index = FileIndex(path)
+        except (UnicodeDecodeError, IsADirectoryError, FileNotFoundError, PermissionError):
+            return
+        except Exception as e:
+            log_error(f'Failed to index {path}: {e}')
+            return
+
+        self.files[path] = file_index
+        for kind in self.KINDS:
+            for key, linenos in getattr(file_index, kind).items():
+                self.keys[kind].setdefault(key, {})[path] = linenos
+        log_debug(f'Indexed {path}')
+
+    def remove_file(self, path: str):
+        file_index = self.files.pop(path, None)
+        if file_index is None:
+            return
+
+        for kind in self.KINDS:
+            for key in getattr(file_index, kind):
+                by_file = self.keys[kind].get(key)
+                if by_file is None:
+                    continue
+                by_file.pop(path, None)
+                if not by_file:
+                    del self.keys[kind][key]
+        log_debug(f'Dropped {path}')
+
+    def remove_tree(self, path: str):
+        prefix = path.rstrip(os.sep) + os.sep
+        for filename in [f for f in self.files if f.startswith(prefix)]:
+            self.remove_file(filename)
+
+    def _location(self, filename: str, lineno: int, **extra) -> Dict:
+        text = self.files[filename].lines[lineno-1].rstrip('\n')
+        return {'filename': filename, 'lineno': lineno, 'text': text, **extra}
+
+    def lookup(self, kind: str, key: str) -> List[Dict]:
+        result = []
+        for filename in sorted(self.keys[kind].get(key, {})):
+            for lineno in self.keys[kind][key][filename]:
+                result.append(self._location(filename, lineno))
+        return result
+
+    def lookup_all(self, kind: str) -> List[Dict]:
+        located = [(filename, lineno) for by_file in self.keys[kind].values()
+                   for filename, linenos in by_file.items() for lineno in linenos]
+        return [self._location(filename, lineno) for filename, lineno in sorted(located)]
+
+    def line(self, arg: str) -> List[Dict]:
+        filename, _, lineno = arg.rpartition(':')
+        path = os.path.abspath(filename)
+        if not path.startswith(self.root + os.sep) or not self.is_note_path(path):
+            raise ValueError(f'{filename} is not below {self.root}')
+
+        # The query may come before the inotify event of the last write to the file
+        self.update_file(path)
+        if path not in self.files:
+            raise ValueError(f'{filename} is not indexed')
+
+        file_index = self.files[path]
+        lineno = int(lineno)
+        if not 1 <= lineno <= len(file_index.lines):
+            return []
+        uuid = file_index.kv_uuids.get(lineno)
+        return [self._location(path, lineno, **({'uuid': uuid} if uuid else {}))]
+
+    def children(self, uuid: str) -> List[Dict]:
+        result = []
+        for filename in sorted(self.keys['uuids'].get(uuid, {})):
+            outline = self.files[filename].outline
+            for lineno in self.keys['uuids'][uuid][filename]:
+                for child_lineno, child in outline.children(lineno):
+                    result.append(self._location(filename, child_lineno, uuid=ntp.get_tag(child, 'uuid')))
+        return result
+
+    def query(self, op: str, arg: str) -> List[Dict]:
+        if op == 'uuid':
+            return self.lookup('uuids', arg)
+        if op == 'notelink':
+            return self.lookup('notelinks', arg)
+        if op == 'cite':
+            return self.lookup('cites', arg) if arg else self.lookup_all('cites')
+        if op == 'line':
+            return self.line(arg)
+        if op == 'children':
+            return self.children(arg)
+        if op == 'status':
+            return [{'root': self.root, 'files': len(self.files)}]
+        raise ValueError(f'unknown op {op}')
+
+
+class Inotify:
+    """
+    Minimal recursive inotify watcher through libc, so the daemon needs nothing outside the standard library.
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths: Dict[int, str] = {}
+
+    def watch(self, path: str):
+        wd = self._add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            log_warn(f'Cannot watch {path}: {os.strerror(err)}')
+            return
+        self.paths[wd] = path
+
+    def watch_tree(self, root: str, is_note_path):
+        for dirpath, dirnames, _ in os.walk(root):
+            dirnames[:] = [d for d in dirnames if is_note_path(os.path.join(dirpath, d))]
+            self.watch(dirpath)
+
+    def read_events(self) -> List[Tuple[int, str]]:
+        """Returns the pending (mask, path) events, with IN_Q_OVERFLOW reported as (mask, '')."""
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset+name_len].rstrip(b'\0'))
+            offset += name_len
+
+            if mask & self.IN_Q_OVERFLOW:
+                events.append((mask, ''))
+                continue
+            if mask & self.IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+
+            directory = self.paths.get(wd)
+            if directory is None:
+                continue
+            events.append((mask, os.path.join(directory, name) if name else directory))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class IndexServer:
+    def __init__(self, index: NoteIndex, socket_path: str, poll_interval: Optional[float] = None):
+        self.index = index
+        self.socket_path = socket_path
+        self.poll_interval = poll_interval
+        self.inotify: Optional[Inotify] = None
+        self.dirty = set()
+
+    def _open_socket(self) -> socket.socket:
+        # A socket file left by a daemon that died is stale; one that accepts connections is not ours to take.
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError(f'ttm-indexd is already running on {self.socket_path}')
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.socket_path)
+            finally:
+                probe.close()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(16)
+        server.setblocking(False)
+        return server
+
+    def handle_request(self, data: bytes) -> Dict:
+        try:
+            request = json.loads(data)
+            self.flush()
+            return {'ok': True, 'result': self.index.query(request['op'], request.get('arg', ''))}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def _serve_client(self, conn: socket.socket):
+        conn.settimeout(2.0)
+        try:
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            conn.sendall((json.dumps(self.handle_request(data)) + '\n').encode())
+        except OSError as e:
+            log_warn(f'Client connection failed: {e}')
+        finally:
+            conn.close()
+
+    def _handle_fs_events(self):
+        for mask, path in self.inotify.read_events():
+            if path == '':
+                log_warn('inotify queue overflowed, rescanning')
+                self.index.rescan()
+                continue
+            if not self.index.is_note_path(path):
+                continue
+
+            if mask & Inotify.IN_ISDIR:
+                if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    self.inotify.watch_tree(path, self.index.is_note_path)
+                    for filename in self.index.walk():
+                        if filename.startswith(path + os.sep):
+                            self.dirty.add(filename)
+                elif mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                    self.index.remove_tree(path)
+            elif mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                self.dirty.discard(path)
+                self.index.remove_file(path)
+            elif mask & (Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_CREATE):
+                self.dirty.add(path)
+
+    def flush(self):
+        """Re-indexes files changed since the last flush. Queries flush first so they never see stale data."""
+        while self.dirty:
+            self.index.update_file(self.dirty.pop())
+
+    def serve_forever(self):
+        server = self._open_socket()
+
+        if self.poll_interval is None:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                log_warn(f'inotify unavailable ({e}), polling every 2s instead')
+                self.poll_interval = 2.0
+
+        # Watch before the initial build so that edits made while building are not lost.
+        if self.inotify:
+            self.inotify.watch_tree(self.index.root, self.index.is_note_path)
+        self.index.build()
+
+        sel = selectors.DefaultSelector()
+        sel.register(server, selectors.EVENT_READ, 'accept')
+        if self.inotify:
+            sel.register(self.inotify.fd, selectors.EVENT_READ, 'inotify')
+
+        log_info(f'Serving {self.index.root} on {self.socket_path}')
+        last_poll = time.monotonic()
+        try:
+            while True:
+                # Changes are batched briefly: editors tend to write a file in several steps.
+                timeout = 0.2 if self.dirty else self.poll_interval
+                events = sel.select(timeout)
+                for key, _ in events:
+                    if key.data == 'accept':
+                        try:
+                            conn, _ = server.accept()
+                        except BlockingIOError:
+                            continue
+                        conn.setblocking(True)
+                        self._serve_client(conn)
+                    elif key.data == 'inotify':
+                        self._handle_fs_events()
+
+                if not events:
+                    self.flush()
+
+                if self.poll_interval is not None and time.monotonic() - last_poll >= self.poll_interval:
+                    self.index.rescan()
+                    last_poll = time.monotonic()
+        finally:
+            sel.close()
+            server.close()
+            if self.inotify:
+                self.inotify.close()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+
+def main(args: argparse.Namespace):
+    log_debug('==================================================================================')
+    log_debug(f'args: {args}')
+
+    if args.subcommand == 'serve':
+        import signal
+        # Exit through the finally clauses so the socket file is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        server = IndexServer(NoteIndex(args.root), args.socket, poll_interval=args.poll)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        except RuntimeError as e:
+            print(f'error: {e}', file=sys.stderr)
+            exit(1)
+
+    if args.subcommand == 'query':
+        os.environ['TTM_INDEXD_SOCKET'] = args.socket
+        result = ntp.query_note_index(args.op, args.arg)
+        if result is None:
+            # No daemon, callers fall back to searching themselves
+            exit(2)
+
+        for location in result:
+            if args.vimgrep:
+                print(f'{location["filename"]}:{location["lineno"]}:1:{location["text"]}')
+            else:
+                print(json.dumps(location))
+
+
+def cmdline_args():
+    # Make parser object
+    p = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    p.add_argument('-v', '--verbose', action='count', default=0,
+                   help="Increase verbosity level (use -v, -vv, or -vvv)")
+    p.add_argument('--socket', default=ntp.note_index_socket_path(),
+                   help="Unix socket to serve or query on (default: %(default)s)")
+
+    subparsers = p.add_subparsers(dest='subcommand')
+    subparsers.required = True
+
+    sp = subparsers.add_parser('serve',
+                               help='Index the notes directory and answer queries until interrupted')
+    sp.add_argument('root', nargs='?', default=os.environ.get('TTM_NOTES_DIR', os.path.expanduser('~/notes')),
+                    help='Notes directory to index (default: %(default)s)')
+    sp.add_argument('--poll', type=float, default=None,
+                    help='Poll for changes every POLL seconds instead of using inotify')
+
+    sp = subparsers.add_parser('query',
+                               help='Query a running daemon. Exits with 2 if there is none.')
+    sp.add_argument('op', choices=['uuid', 'notelink', 'cite', 'line', 'children', 'status'],
+                    help='What to look up')
+    sp.add_argument('arg', nargs='?', default='',
+                    help='uuid, note token, cite code or file:lineno to look up')
+    sp.add_argument('--vimgrep', action='store_true',
+                    help='Print locations as filename:lineno:col:text for vim -q')
+
+    return(p.parse_args())
+
+
+def _main():
+    if sys.version_info<(3,5,0):
+        sys.stderr.write("You need python 3.5 or later to run this script\n")
+        sys.exit(1)
+
+    global g_args
+    # if you have unittest as part of the script, you can forward to it this way
+    if len(sys.argv) >= 2 and sys.argv[1] == 'unittest':
+        import unittest
+        sys.argv[0] += ' unittest'
+        sys.argv.remove('unittest')
+
+        class Args:
+            def __init__(self):
+                self.verbose = 2
+        g_args = Args()
+
+        log_debug('Running unit tests')
+
+        unittest.main()
+        exit(0)
+
+    args = cmdline_args()
+    g_args = args
+    main(args)
+
+class UnitTests(ttm.TestCase):
+    def test_index_follows_file_changes(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, 'projects'))
+            filename = os.path.join(root, 'projects', 'TTM1-ttm_dev')
+            with open(filename, 'w') as f:
+                f.write('\n'.join([
+                    'P[240624-W26M-1234]- TaskGraph project (tags: #1a2b3c4d, )',
+                    '- 240624-W26M 10:00 - (-) Render tasks (tags: #.1, #abcdef12, )',
+                    '    - 240624-W26M 10:05 - (!) Extend note-parser (tags: #.2, #12345678, )',
+                    '    - 240624-W26M 10:06 - [^T1]: Cited task #12345678',
+                    '- 240624-W26M 10:10 - (-) See P[240624-W26M-1234]',
+                    '    _ 240624-W26M 10:12 - A log line (tags: #abcdef99, )',
+                ]) + '\n')
+
+            index = NoteIndex(root)
+            index.build()
+
+            self.assertEqual([(r['filename'], r['lineno']) for r in index.query('uuid', 'abcdef12')], [(filename, 2)])
+            self.assertEqual([r['lineno'] for r in index.query('notelink', 'P[240624-W26M-1234]')], [1, 5])
+            self.assertEqual([r['lineno'] for r in index.query('cite', '[^T1]')], [4])
+            self.assertEqual([r['lineno'] for r in index.query('uuid', 'abcdef99')], [6])
+            self.assertEqual([(r['lineno'], r['uuid']) for r in index.query('children', 'abcdef12')], [(3, '12345678')])
+            self.assertEqual([r['lineno'] for r in index.query('cite', '')], [4])
+            self.assertEqual([r.get('uuid') for r in index.query('line', f'{filename}:4')], ['12345678'])
+            self.assertEqual([r.get('uuid') for r in index.query('line', f'{filename}:2')], [None])
+            self.assertEqual(index.query('line', f'{filename}:99'), [])
+            with self.assertRaises(ValueError):
+                index.query('line', f'{os.path.dirname(root)}/elsewhere:1')
+
+            with open(filename, 'a') as f:
+                f.write('- 240624-W26M 11:00 - (-) New objective (tags: #.2, #feedbeef, )\n')
+            os.utime(filename, ns=(time.time_ns(), time.time_ns() + 10**9))
+            index.rescan()
+            self.assertEqual([r['lineno'] for r in index.query('uuid', 'feedbeef')], [7])
+
+            os.remove(filename)
+            index.rescan()
+            self.assertEqual(index.query('uuid', 'abcdef12'), [])
+            self.assertEqual(index.keys, {kind: {} for kind in NoteIndex.KINDS})
+
+    def test_server_handles_requests(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, 'notes'), 'w') as f:
+                f.write('- 240624-W26M 10:00 - (-) Render tasks (tags: #.1, #abcdef12, )\n')
+
+            server = IndexServer(NoteIndex(root), os.path.join(root, '.sock'))
+            server.index.build()
+
+            response = server.handle_request(json.dumps({'op': 'uuid', 'arg': 'abcdef12'}).encode())
+            self.assertTrue(response['ok'])
+            self.assertEqual(response['result'][0]['lineno'], 1)
+
+            response = server.handle_request(json.dumps({'op': 'bogus'}).encode())
+            self.assertFalse(response['ok'])
+
+
+if __name__ == '__main__':
+    _main()
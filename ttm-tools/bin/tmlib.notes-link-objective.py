@@ -4,16 +4,12 @@ import os
 import sys
 import subprocess
 import re
-import fileinput
-import importlib.util
 from importlib import import_module
 from enum import Enum, auto
 from typing import List, Optional, Tuple
-import unittest
 import argparse
-import pipe
-import tempfile
-import shutil
+
+import ttm
 
 log_file = '/tmp/note-link-objective.log'
 log_echo_stdout = False
@@ -37,16 +33,12 @@ def log_warn(s): return log_any(s, 'WARN', verbose_level=1)
 def log_debug(s): return log_any(s, 'DEBUG', verbose_level=2)
 def log_trace(s): return log_any(s, 'TRACE', verbose_level=3)
 
-spec=importlib.util.spec_from_file_location("note_parser","/root/.local/bin/tmlib.note-parser.py")
-note_parser = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(note_parser)
-ntp = note_parser
-
-spec=importlib.util.spec_from_file_location("note_parser","/root/.local/bin/tmlib.notes-register-objective.py")
-notes_register_objective = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(notes_register_objective)
+notes_register_objective = ttm.register_objective
 nro = notes_register_objective
 
+note_parser = ttm.note_parser
+ntp = note_parser
+
 prn_error = log_error
 prn_warn = log_warn
 
@@ -74,7 +66,7 @@ def _add_or_increment_refd(item):
             if tag.startswith('refd='):
                 refd_tag = tag
             pass
-    else:
+    elif tags_s is not None:
         if tags_s.startswith('refd='):
             refd_tag = tags_s
     
@@ -202,39 +194,69 @@ def _compute_tab_level(item):
     return extra_tab
 
 
-def duplicate_file_into_temp(filename):
-    temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w', dir=os.path.dirname(filename))
-
-    # Write the content to a temporary file
-    with open(temp_file.name, 'w') as write_fp:
-        with open(filename, 'r') as read_fp:
-            write_fp.write(read_fp.read())
-    
-    return temp_file.name
+class LinkBatch:
+    """
+    State shared by the links of one run: every note file is parsed once, all edits go into one
+    EditTransaction written at commit(), and new references to the same sink are numbered after each other.
+    Items are updated in place (registration tags, refd counts), so later links see the earlier ones.
+    """
+    def __init__(self):
+        self.parsed = {}            # filename -> parsed items, with refs
+        self.tx = ntp.EditTransaction()
+        self.last_numbers = {}      # (sink filename, sink lineno) -> number of the last reference queued
+        self.linked = set()         # (source filename, source lineno, sink filename, sink lineno) queued
+
+    def parsed_items(self, filename):
+        if filename not in self.parsed:
+            self.parsed[filename] = ntp.process_note_file(filename, incl_refs=True)
+        return self.parsed[filename]
+
+    def commit(self):
+        self.tx.commit()
+        self.parsed = {}
+        self.last_numbers = {}
+        self.linked = set()
+
+
+def link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, cb_ref_builder, batch=None) -> bool:
+    """
+    Links the source objective to the sink objective, registering either if needed. With a batch, the edits
+    are queued in it and written by batch.commit(), otherwise they are written right away. A link that the sink
+    already has, or that the batch already queued, is left as is. On failure nothing but the registrations
+    is queued.
+    """
+    if batch is not None:
+        return _queue_link(source_filename_lineno, sink_filename_lineno, ttm_timedate, cb_ref_builder, batch)
+
+    # Registering creates the tasks right away, so the registration edits are written even if the link fails
+    batch = LinkBatch()
+    ok = _queue_link(source_filename_lineno, sink_filename_lineno, ttm_timedate, cb_ref_builder, batch)
+    batch.commit()
+    if ok:
+        log_info(f'Successfully modified source and sink files')
+    return ok
 
 
-def link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, cb_ref_builder):
-    source_filename = source_filename_lineno.split(':')[0]
+def _queue_link(source_filename_lineno, sink_filename_lineno, ttm_timedate, cb_ref_builder, batch) -> bool:
+    # One spelling per file, the batch keys its parses and edits by filename
+    source_filename = os.path.normpath(source_filename_lineno.split(':')[0])
     source_lineno = source_filename_lineno.split(':')[1]
-    sink_filename = sink_filename_lineno.split(':')[0]
+    sink_filename = os.path.normpath(sink_filename_lineno.split(':')[0])
     sink_lineno = sink_filename_lineno.split(':')[1]
 
     source_lineno_n = _try_parse_int(source_lineno)
     sink_lineno_n = _try_parse_int(sink_lineno)
     if not source_lineno_n:
         log_error(f'Failed to parse sink lineno: {source_filename}:{source_lineno}')
-        return
+        return False
     if not sink_lineno_n:
         log_error(f'Failed to parse sink lineno: {sink_filename}:{sink_lineno}')
-        return
+        return False
 
-    source_parsed_items = ntp.process_note_file(source_filename, incl_refs=True)
+    source_parsed_items = batch.parsed_items(source_filename)
     cur_source_item = ntp.find_item_at_lineno(source_parsed_items, source_lineno_n)
 
-    if sink_filename == source_filename:
-        sink_parsed_items = source_parsed_items
-    else:
-        sink_parsed_items = ntp.process_note_file(sink_filename, incl_refs=True)
+    sink_parsed_items = batch.parsed_items(sink_filename)
     cur_sink_item = ntp.find_item_at_lineno(sink_parsed_items, sink_lineno_n)
 
     # log_debug(f'SOURCE {source_lineno} {cur_source_item}')
@@ -243,30 +265,46 @@ def link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, c
     # First, ensure that we really have valid objectives for sink and source
     if cur_source_item is None:
         log_error(f'Invalid source objective line (None) for {source_filename}:{source_lineno}')
-        return
+        return False
     if cur_sink_item is None:
         log_error(f'Invalid sink objective line (None) for {sink_filename}:{sink_lineno}')
-        return
+        return False
     if cur_source_item.item_type != ntp.ItemType.OBJECTIVE_LINE:
         log_error(f'Invalid source objective line ({cur_source_item.item_type}) for {source_filename}:{source_lineno}')
-        return
+        return False
     if cur_sink_item.item_type != ntp.ItemType.OBJECTIVE_LINE:
         log_error(f'Invalid sink objective line ({cur_sink_item.item_type}) for {sink_filename}:{sink_lineno}')
-        return
+        return False
+
+    link_key = (source_filename, source_lineno_n, sink_filename, sink_lineno_n)
+    if link_key in batch.linked:
+        log_warn(f'Already linked {source_filename_lineno} to {sink_filename_lineno} in this batch')
+        return True
+
+    # Registering creates tasks that cannot be taken back, so what can fail the link is checked before
+    if cur_source_item.get_part(ntp.ItemType.TAGS) and _add_or_increment_refd(cur_source_item)[0] != 'OK':
+        log_error(f'Invalid refd detected for source objective line at {source_filename_lineno}')
+        return False
+
+    # Ensure that both tasks are registered, or register them. Registering tags the parsed items in place and
+    # queues the new lines in tx, so we go on with the items we have and write everything at once.
+    tx = batch.tx
+    for role, filename, lineno_n, parsed_items, item in [
+            ('source', source_filename, source_lineno_n, source_parsed_items, cur_source_item),
+            ('sink', sink_filename, sink_lineno_n, sink_parsed_items, cur_sink_item)]:
+        if ntp.get_tag(item, 'uuid') != '':
+            continue
+        log_warn(f'Warn: Cannot link unregistered {role} objective line. Will register {filename}:{lineno_n}')
+        index = ntp.build_outline_index(parsed_items)
+        linenos = nro.find_unregistered_objectives(filename, parsed_items, index, lineno_n, lineno_n)
+        if lineno_n not in nro.register_objectives(filename, index, linenos, tx):
+            log_error(f'Failed to register {role} objective line {filename}:{lineno_n}')
+            return False
 
-    # Ensure that both tasks are registered, or register them.
     sink_uuid = ntp.get_tag(cur_sink_item, 'uuid')
     source_uuid = ntp.get_tag(cur_source_item, 'uuid')
-    if source_uuid == '':
-        log_warn(f'Warn: Cannot link unregistered source objective line. Will register {source_filename}:{source_lineno}')
-        nro.register_objective(source_filename, source_lineno_n)
-        return link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, cb_ref_builder)
-    if sink_uuid == '':
-        log_warn(f'Warn: Cannot link unregistered sink objective line. Will register {sink_filename}:{sink_lineno}')
-        nro.register_objective(sink_filename, sink_lineno_n)
-        return link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, cb_ref_builder)
-
-    # Now Retrieve the source and sink item notelogs 
+
+    # Now Retrieve the source and sink item notelogs
     sink_ref_lineno_items = _process_refs_for_item_at_lineno(sink_lineno_n, sink_parsed_items)
 
     # Check if sink already refers to the task in question, or find its last numbered task reference
@@ -295,6 +333,11 @@ def link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, c
             last_nontask_lineno_ref = (lineno, ref_item)
             continue
 
+        if ntp.get_kv(ref_item, 'uuid') == source_uuid:
+            log_warn(f'Sink {sink_filename_lineno} already refers to {source_filename_lineno} at line {lineno}')
+            batch.linked.add(link_key)
+            return True
+
         if category_n is not None:
             if last_number is None:
                 last_number = category_n
@@ -306,6 +349,11 @@ def link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, c
                 pass
         
         last_sink_task_lineno_ref = (lineno, ref_item)
+
+    # References queued earlier in this batch are not in the parsed items yet
+    queued_number = batch.last_numbers.get((sink_filename, sink_lineno_n))
+    if queued_number is not None and (last_number is None or queued_number > last_number):
+        last_number = queued_number
     
     # Now let's figure out the item to pin the new content to
     pin_before = True
@@ -355,7 +403,7 @@ def link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, c
 
     if new_sink_item_pinned_to is None:
         log_error('Failed to find a spot to place new reference')
-        return
+        return False
 
     # log_debug(f'previous source item: {cur_source_item}')
 
@@ -367,7 +415,13 @@ def link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, c
             log_error(f'source objective line has no tags at {source_filename_lineno}')
         if ec_s == 'INVALID_REFD':
             log_error(f'Invalid refd detected for source objective line at {source_filename_lineno}')
-    
+        return False
+
+    err_msg, new_line = cb_ref_builder(cur_source_item, source_uuid, new_sink_item_pinned_to, last_number, ttm_timedate)
+    if err_msg != 'OK':
+        log_error(f'Could not process file modifications: {err_msg}')
+        return False
+
     new_source_item_parts = cur_source_item.parts
 
     for part in new_source_item_parts:
@@ -381,96 +435,136 @@ def link_objective(source_filename_lineno, sink_filename_lineno, ttm_timedate, c
 
     # log_debug(f'new source item: {new_source_item}')
 
-    # Inplace modify the files with the new content. The prints in this loop are directed into the file.
-    try:
-        # Create temporary files in case our solution here fails and destroys the files!
-        tmp_source_filename = duplicate_file_into_temp(source_filename)
-        tmp_sink_filename = duplicate_file_into_temp(sink_filename)
-
-        # For the source task, only modify the task definition
-        for line in fileinput.input(source_filename, inplace=True):
-            if line == cur_source_item.value:
-                print(ntp.build_objective_line_item(new_source_item) + '\n', end='')
-            else:
-                print(line, end='')
-
-        # For the sink task, add a new citation
-        lineno = 0
-        for line in fileinput.input(sink_filename, inplace=True):
-            lineno += 1
-            if lineno == new_sink_item_lineno_pinned_to or \
-               str(lineno) == new_sink_item_lineno_pinned_to:
-                err_msg, new_line = cb_ref_builder(cur_source_item, source_uuid, new_sink_item_pinned_to, last_number, ttm_timedate)
-                if err_msg != 'OK':
-                    raise Exception(f'Could not process file modifications: {err_msg}')
-
-                if pin_before:
-                    print(extra_tab + new_line + '\n', end='')
-                    print(line, end='')
-                else:
-                    print(line, end='')
-                    print(extra_tab + new_line + '\n', end='')
-            else:
-                print(line, end='')
-        
-        log_info(f'Successfully modified source and sink files')
-        os.remove(tmp_source_filename)
-        os.remove(tmp_sink_filename)
-    except Exception:
-        log_error('An exception occured, corrupting the files we are modifying! Reverting back from backup.')
-        shutil.move(tmp_source_filename, source_filename)
-        shutil.move(tmp_sink_filename, sink_filename)
-        raise 
+    # For the source task, only modify the task definition. For the sink task, add a new citation.
+    # Both files are written once, at commit, with only the registrations if the link fails before.
+    tx.replace(source_filename, source_lineno_n, ntp.build_objective_line_item(new_source_item),
+               expected=cur_source_item.value)
+    if pin_before:
+        tx.insert_before(sink_filename, new_sink_item_lineno_pinned_to, extra_tab + new_line)
+    else:
+        tx.insert_after(sink_filename, new_sink_item_lineno_pinned_to, extra_tab + new_line)
+    batch.last_numbers[(sink_filename, sink_lineno_n)] = (last_number or 0) + 1
+    batch.linked.add(link_key)
+    return True
+
+
+# subcommand -> (whether the link goes from sink to source, reference line builder)
+LINK_KINDS = {
+    'link-task': (False, build_normal_task_link_ref_line),
+    'link-goal-of': (True, build_goal_of_link_ref_line),
+    'link-has-goal': (False, build_has_goal_link_ref_line),
+}
+
+
+def link_batch(pairs, ttm_timedate, default_kind='link-task') -> bool:
+    """
+    Links every (source, sink[, kind]) of pairs with one parse and one write per file. Line numbers refer to
+    the files as they are before the batch. A pair that fails is skipped, the others are still written.
+    """
+    batch = LinkBatch()
+    ok = True
+    for pair in pairs:
+        source, sink = pair[0], pair[1]
+        kind = pair[2] if len(pair) > 2 else default_kind
+        if kind not in LINK_KINDS:
+            log_error(f'Unknown link kind {kind} for {source} {sink}')
+            ok = False
+            continue
+        reverse, cb_ref_builder = LINK_KINDS[kind]
+        if reverse:
+            source, sink = sink, source
+        if not link_objective(source, sink, ttm_timedate, cb_ref_builder, batch=batch):
+            log_error(f'Failed to link {source} {sink}')
+            ok = False
+    batch.commit()
+    log_info(f'Successfully linked {len(pairs)} pairs' if ok else f'Linked {len(pairs)} pairs with errors')
+    return ok
+
+
+def read_link_pairs(lines) -> List[List[str]]:
+    """'SOURCE:LINENO SINK:LINENO [KIND]' per line, skipping blank lines and # comments."""
+    pairs = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 0 or fields[0].startswith('#'):
+            continue
+        if len(fields) not in [2, 3]:
+            log_error(f'Invalid link line: {line.rstrip()}')
+            continue
+        pairs.append(fields)
+    return pairs
 
 
 def main(args: argparse.Namespace):
     log_debug(f'===========================================================')
     log_debug(f'Running App {args}')
 
-    if args.subcommand == 'link-task':
-        link_objective(args.source_filename_lineno, args.sink_filename_lineno, args.ttm_timedate, 
-                       build_normal_task_link_ref_line)
-    if args.subcommand == 'link-goal-of':
-        link_objective(args.sink_filename_lineno, args.source_filename_lineno, args.ttm_timedate, 
-                       build_goal_of_link_ref_line)
-    if args.subcommand == 'link-has-goal':
-        link_objective(args.source_filename_lineno, args.sink_filename_lineno, args.ttm_timedate, 
-                       build_has_goal_link_ref_line)
+    if args.subcommand == 'link-batch':
+        if len(args.pairs) % 2 != 0:
+            log_error('link-batch needs SOURCE SINK pairs')
+            return False
+        if args.pairs:
+            pairs = [args.pairs[i:i+2] for i in range(0, len(args.pairs), 2)]
+        else:
+            pairs = read_link_pairs(sys.stdin)
+        return link_batch(pairs, args.ttm_timedate, args.kind)
+
+    reverse, cb_ref_builder = LINK_KINDS[args.subcommand]
+    if reverse:
+        return link_objective(args.sink_filename_lineno, args.source_filename_lineno, args.ttm_timedate,
+                              cb_ref_builder)
+    return link_objective(args.source_filename_lineno, args.sink_filename_lineno, args.ttm_timedate,
+                          cb_ref_builder)
 
 
 def cmdline_args():
     # Make parser object
     p = argparse.ArgumentParser(description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter)
-    
-    p.add_argument('ttm_timedate',
-                   help='Current timedate in TTM format. See GetWeekRelativeCustomDateString in ttm.vim.')
-    p.add_argument('source_filename_lineno',
-                   help='Source task filename:lineno')
-    p.add_argument('sink_filename_lineno',
-                   help='Sink task filename:lineno')
+
     p.add_argument('-v', '--verbose', action='count', default=0,
                    help="Increase verbosity level (use -v, -vv, or -vvv)")
-                   
+    p.add_argument('--no-cache', action='store_true',
+                   help="Do not use the note parse cache")
+
+    # Also accepted in the historical order: TTM_TIMEDATE SOURCE SINK SUBCOMMAND, see _reorder_legacy_args
     subparsers = p.add_subparsers(dest='subcommand')
     subparsers.required = True
 
     sp = subparsers.add_parser('unittest', 
                     help='run the unit tests instead of main')
 
-    sp = subparsers.add_parser('link-task', 
-                    help='Creates a link from source to sink task')
-
-    sp = subparsers.add_parser('link-goal-of', 
-                    help='')
-
-    sp = subparsers.add_parser('link-has-goal', 
-                    help='Creates a has-goal reference in sink')
-
-    sp = subparsers.add_parser('link-goal-of', 
-                    help='Creates a goal-of reference in source')
-
-    return(p.parse_args())
+    for subcommand, help in [('link-task', 'Creates a link from source to sink task'),
+                             ('link-has-goal', 'Creates a has-goal reference in sink'),
+                             ('link-goal-of', 'Creates a goal-of reference in source')]:
+        sp = subparsers.add_parser(subcommand, help=help)
+        sp.add_argument('ttm_timedate',
+                        help='Current timedate in TTM format. See GetWeekRelativeCustomDateString in ttm.vim.')
+        sp.add_argument('source_filename_lineno',
+                        help='Source task filename:lineno')
+        sp.add_argument('sink_filename_lineno',
+                        help='Sink task filename:lineno')
+
+    sp = subparsers.add_parser('link-batch',
+                    help='Creates many links, parsing and writing each file once')
+    sp.add_argument('ttm_timedate',
+                    help='Current timedate in TTM format. See GetWeekRelativeCustomDateString in ttm.vim.')
+    sp.add_argument('pairs', nargs='*', metavar='SOURCE SINK',
+                    help='filename:lineno pairs. Without any, reads "SOURCE SINK [KIND]" lines from stdin')
+    sp.add_argument('-k', '--kind', choices=list(LINK_KINDS.keys()), default='link-task',
+                    help='Kind of the links without their own KIND (default: link-task)')
+
+    return(p.parse_args(_reorder_legacy_args(sys.argv[1:])))
+
+
+def _reorder_legacy_args(argv):
+    """TTM_TIMEDATE SOURCE SINK SUBCOMMAND [options] -> [options] SUBCOMMAND TTM_TIMEDATE SOURCE SINK."""
+    positional = [i for i, arg in enumerate(argv) if not arg.startswith('-')]
+    if len(positional) == 4 and argv[positional[3]] in LINK_KINDS:
+        timedate, source, sink, subcommand = [argv[i] for i in positional]
+        options = [arg for i, arg in enumerate(argv) if i not in positional]
+        return options + [subcommand, timedate, source, sink]
+    return argv
 
 
 def _main():
@@ -497,11 +591,112 @@ def _main():
 
     args = cmdline_args()
     g_args = args
-    main(args)
-
-
-class UnitTests(unittest.TestCase):
-    pass
+    if args.no_cache:
+        ntp.disable_note_cache()
+    sys.exit(0 if main(args) else 1)
+
+
+class UnitTests(ttm.TestCase):
+    def test_read_link_pairs(self):
+        lines = ['# goal links\n', 'a.md:3 b.md:5\n', '\n', 'a.md:4 b.md:5 link-has-goal\n', 'a.md:4\n']
+        self.assertEqual(read_link_pairs(lines),
+                         [['a.md:3', 'b.md:5'], ['a.md:4', 'b.md:5', 'link-has-goal']])
+
+    def test_reorder_legacy_args(self):
+        self.assertEqual(_reorder_legacy_args(['-v', 'T', 'a.md:3', 'b.md:5', 'link-task']),
+                         ['-v', 'link-task', 'T', 'a.md:3', 'b.md:5'])
+        self.assertEqual(_reorder_legacy_args(['link-batch', 'T', 'a.md:3', 'b.md:5']),
+                         ['link-batch', 'T', 'a.md:3', 'b.md:5'])
+
+    def test_link_batch_skips_duplicates_and_failed_pairs(self):
+        import tempfile
+
+        prev_cache_dir = os.environ.get('TTM_CACHE_DIR')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.environ['TTM_CACHE_DIR'] = os.path.join(tmp_dir, '.cache')
+            try:
+                note = os.path.join(tmp_dir, 'n.md')
+                with open(note, 'w') as f:
+                    f.write('P[240624-W26M-1000]- Project (tags: #1a2b3c00, )\n'
+                            '\t- 240624-W26M 10:00 - (-) Objective A (tags: #2b3c4d00, )\n'
+                            '\t\t- 240624-W26M 10:05 - A log line\n'
+                            '\t- 240624-W26M 10:10 - (A) Objective B (tags: #3c4d5e00, )\n'
+                            '\t- 240624-W26M 10:20 - (-) Objective C (tags: #4d5e6f00, #refd=x, )\n'
+                            '\t- 240624-W26M 10:30 - (-) Objective D (tags: #5e6f7a00, )\n')
+                pairs = [[f'{note}:{source}', f'{note}:{sink}'] for source, sink in
+                         [(4, 2), (6, 2), (4, 2), (3, 2), (5, 2), (4, 2)]]
+                self.assertFalse(link_batch(pairs, '240701-W27M 11:00'))
+                with open(note) as f:
+                    linked = f.read()
+                self.assertEqual(linked.splitlines()[1:6],
+                                 ['\t- 240624-W26M 10:00 - (-) Objective A (tags: #2b3c4d00, )',
+                                  '\t\t- 240701-W27M 11:00 - [^T1]: Objective B #3c4d5e00',
+                                  '\t\t- 240701-W27M 11:00 - [^T2]: Objective D #5e6f7a00',
+                                  '\t\t- 240624-W26M 10:05 - A log line',
+                                  '\t- 240624-W26M 10:10 - (A) Objective B (tags: #3c4d5e00, #refd=1, )'])
+                self.assertIn('Objective C (tags: #4d5e6f00, #refd=x, )', linked)
+                self.assertIn('Objective D (tags: #5e6f7a00, #refd=1, )', linked)
+
+                # Links the sink already has are not made again, B and D are now on lines 6 and 8
+                self.assertTrue(link_batch([[f'{note}:6', f'{note}:2'], [f'{note}:8', f'{note}:2']],
+                                           '240701-W27M 11:00'))
+                with open(note) as f:
+                    self.assertEqual(f.read(), linked)
+            finally:
+                if prev_cache_dir is None:
+                    os.environ.pop('TTM_CACHE_DIR', None)
+                else:
+                    os.environ['TTM_CACHE_DIR'] = prev_cache_dir
+
+    def test_failed_link_still_writes_the_registrations(self):
+        import tempfile
+
+        twc = ttm.tw_client
+        prev_cache_dir = os.environ.get('TTM_CACHE_DIR')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.environ['TTM_CACHE_DIR'] = os.path.join(tmp_dir, '.cache')
+            backend = twc.FakeTaskBackend(os.path.join(tmp_dir, 'tasks.json'))
+            twc.set_backend(backend)
+            try:
+                self.assertTrue(twc.import_tasks([{'uuid': '2b3c4d00-1111-4222-8333-444455556666',
+                                                   'status': 'pending', 'description': 'Objective A'}]))
+                note = os.path.join(tmp_dir, 'n.md')
+                with open(note, 'w') as f:
+                    f.write('P[240624-W26M-1000]- Project (tags: #1a2b3c00, )\n'
+                            '\t- 240624-W26M 10:00 - (-) Objective A (tags: #2b3c4d00, )\n'
+                            '\t\t- 240624-W26M 10:05 - (-) Child (tags: #refd=x, )\n'
+                            '\t\t- 240624-W26M 10:06 - (-) Other child\n')
+                with open(note) as f:
+                    lines = f.read()
+
+                # An invalid refd fails the link before the source is registered
+                self.assertFalse(link_objective(f'{note}:3', f'{note}:2', '240701-W27M 11:00',
+                                                build_normal_task_link_ref_line))
+                self.assertEqual(len(backend.tasks()), 1)
+                with open(note) as f:
+                    self.assertEqual(f.read(), lines)
+
+                # A link failing after the registration keeps the note in line with the new task
+                failing_builder = lambda *args: ('Cannot build the reference', '')
+                self.assertFalse(link_objective(f'{note}:4', f'{note}:2', '240701-W27M 11:00', failing_builder))
+                self.assertEqual(len(backend.tasks()), 2)
+                with open(note) as f:
+                    other_child = f.read().splitlines()[3]
+                uuid = ntp.get_tag(ntp.process_note_file_lines([other_child + '\n'])[0][1], 'uuid')
+                self.assertEqual(twc.export_tasks([uuid])[uuid]['description'], '2b3c4d00.01 Other child')
+
+                # Linking it again does not register it twice
+                self.assertTrue(link_objective(f'{note}:4', f'{note}:2', '240701-W27M 11:00',
+                                               build_normal_task_link_ref_line))
+                self.assertEqual(len(backend.tasks()), 2)
+                with open(note) as f:
+                    self.assertIn(f'[^T1]: Other child #{uuid}', f.read())
+            finally:
+                twc.set_backend(None)
+                if prev_cache_dir is None:
+                    os.environ.pop('TTM_CACHE_DIR', None)
+                else:
+                    os.environ['TTM_CACHE_DIR'] = prev_cache_dir
 
 
 if __name__ == '__main__':
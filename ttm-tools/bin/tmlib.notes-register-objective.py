@@ -4,36 +4,188 @@ import os
 import sys
 import subprocess
 import re
-import fileinput
-import shutil
-import importlib.util
+import copy
+import uuid as uuidlib
+import argparse
 from importlib import import_module
 from enum import Enum, auto
 from typing import List, Optional, Tuple
 
-spec=importlib.util.spec_from_file_location("note_parser","/root/.local/bin/tmlib.note-parser.py")
-note_parser = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(note_parser)
+import ttm
+
+note_parser = ttm.note_parser
 ntp = note_parser
 #print(ntp.find_parent_item, ntp.Item)
 
+tw_client = ttm.tw_client
+twc = tw_client
+
 prn_error = print
 prn_warn = print
 
-def duplicate_file_into_temp(filename):
-    import tempfile
-    temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w', dir=os.path.dirname(filename))
+def add_objective_tags(cur_item, childno, new_uuid):
+    cur_item_tags = cur_item.get_part(ntp.ItemType.TAGS)
+    new_tags = [ntp.Item(ntp.ItemType.KV, {'childno': childno}, []), ntp.Item(ntp.ItemType.KV, {'uuid': new_uuid})]
+    if not cur_item_tags:
+        cur_item_tags = ntp.Item(ntp.ItemType.TAGS, '', new_tags)
+        cur_item.parts.append(cur_item_tags)
+    else:
+        for tag in new_tags:
+            cur_item_tags.parts.append(tag)
+
+# ==============================================================================
+# Registration
+# ==============================================================================
+# Registers objectives in batches. Does in Python what tmlib.cli-vit-new-objective and
+# system_rename_objective do per item (duplicate the parent task, link parent and child through
+# children/childof, number the child), then creates all tasks with one `task import`. The parsed items are
+# tagged in place, so callers keep working on them without parsing the file again.
+
+# Attributes of the parent that a new objective does not inherit
+OBJECTIVE_CLEARED_FIELDS = ['id', 'urgency', 'uuid', 'entry', 'modified', 'start', 'end', 'children',
+                            'gpri', 'ppri', 'blkput', 'blkputcum', 'scheduled', 'due', 'mask', 'imask', 'parent']
+
+def find_unregistered_objectives(filename, parsed_items, index, first_lineno=None, last_lineno=None) -> List[int]:
+    """
+    Linenos of the unregistered objective lines between first_lineno and last_lineno, plus their
+    unregistered ancestors, parents first. Branches that do not lead up to a registered item are skipped.
+    """
+    linenos = set()
+    for lineno, item in parsed_items:
+        if item.item_type != ntp.ItemType.OBJECTIVE_LINE or ntp.get_tag(item, 'uuid') != '':
+            continue
+        if (first_lineno is not None and lineno < first_lineno) or (last_lineno is not None and lineno > last_lineno):
+            continue
+
+        branch = [lineno]
+        for parent_lineno, parent_item in index.branch(lineno):
+            if ntp.get_tag(parent_item, 'uuid') != '':
+                break
+            if parent_item.item_type != ntp.ItemType.OBJECTIVE_LINE:
+                branch = []
+                break
+            branch.append(parent_lineno)
+        else:
+            branch = []
+
+        if len(branch) == 0:
+            prn_error(f'error: {filename}:{lineno}: no registered parent to register against')
+        linenos.update(branch)
+
+    # Parents come before their children in the file
+    return sorted(linenos)
+
+def short_uuid(uuid) -> str:
+    return uuid.split('-')[0]
+
+def plan_objectives(index, linenos, snapshot) -> Tuple[List[dict], dict]:
+    """
+    Task changes that register the objectives at linenos, in order. Returns (the created and modified tasks,
+    {lineno: (childno, short uuid)}).
+    """
+    tasks = {}          # short uuid -> task dict, the parents we modify and the objectives we create
+    registered = {}     # lineno -> (childno, short uuid)
 
-    # Write the content to a temporary file
-    with open(temp_file.name, 'w') as write_fp:
-        with open(filename, 'r') as read_fp:
-            write_fp.write(read_fp.read())
-    
-    return temp_file.name
+    def is_task(uuid):
+        return uuid in tasks or (re.fullmatch('[0-9a-f]{8}', uuid) is not None and snapshot.find(uuid) is not None)
+
+    def find_task(uuid):
+        if uuid not in tasks:
+            if not is_task(uuid):
+                return None
+            tasks[uuid] = copy.deepcopy(snapshot.find(uuid))
+        return tasks[uuid]
+
+    now = twc.timestamp()
+    for lineno in linenos:
+        item = index.item_at(lineno)
+        parent_lineno, parent_item = index.parent(lineno)
+        parent_uuid = ntp.get_tag(parent_item, 'uuid') or registered.get(parent_lineno, ('', ''))[1]
+        parent = find_task(parent_uuid) if parent_uuid != '' else None
+        if parent is None:
+            prn_error(f'error: no task {parent_uuid} for the parent of line {lineno}')
+            continue
+
+        desc_part = item.get_part(ntp.ItemType.KV, key='desc')
+        if not desc_part:
+            prn_error(f'error: Failed to get desc of {lineno}')
+            continue
+
+        new_uuid = str(uuidlib.uuid4())
+        while is_task(short_uuid(new_uuid)):
+            new_uuid = str(uuidlib.uuid4())
+        new_short_uuid = short_uuid(new_uuid)
+
+        # A parent gets its uuid as description prefix to show it has children
+        desc_uuid = twc.get_field(parent, 'description').split(' ')[0].split('.')[0]
+        if not is_task(desc_uuid):
+            parent['description'] = f'{parent_uuid} {twc.get_field(parent, "description")}'
+
+        children = twc.get_field(parent, 'children') + f'{new_short_uuid},'
+        parent['children'] = children
+        parent['modified'] = now
+        childno = f'{len([c for c in children.split(",") if c != ""]):02d}'
+        ancestors = twc.get_field(parent, 'childof') + f'{parent_uuid},'
+
+        new_task = {k: v for k, v in parent.items() if k not in OBJECTIVE_CLEARED_FIELDS}
+        new_task.update({
+            'uuid': new_uuid,
+            'status': 'pending',
+            'entry': now,
+            'modified': now,
+            'description': f'{parent_uuid}.{childno} {desc_part.value["desc"]}',
+            'childof': ancestors,
+            'childdepth': len([a for a in ancestors.split(',') if a != '']),
+            'tags': twc.get_tags(parent) + [tag for tag in ['inv', 'obj'] if tag not in twc.get_tags(parent)],
+        })
+        tasks[new_short_uuid] = new_task
+        registered[lineno] = (childno, new_short_uuid)
+
+    return list(tasks.values()), registered
+
+def register_objectives(filename, index, linenos, tx, dry_run=False) -> dict:
+    """
+    Registers the objectives of filename at linenos, ordered parents first (see find_unregistered_objectives).
+    Tags their parsed items in place and queues their new lines in tx. Returns {lineno: new short uuid},
+    empty if the tasks could not be created.
+    """
+    if len(linenos) == 0:
+        return {}
+
+    snapshot = twc.load_snapshot()
+    if snapshot is None:
+        prn_error('error: Could not read the tasks')
+        return {}
+    tasks, registered = plan_objectives(index, linenos, snapshot)
+
+    # The tasks cannot be taken back once imported, so first check that the note edits, the ones queued before
+    # and the ones to come, still apply to the file
+    check_tx = ntp.EditTransaction()
+    for lineno in registered:
+        check_tx.replace(filename, lineno, index.item_at(lineno).value, expected=index.item_at(lineno).value)
+    try:
+        tx.check()
+        check_tx.check()
+    except Exception as e:
+        prn_error(f'error: {e}')
+        return {}
+
+    if not dry_run and not twc.import_tasks(tasks):
+        prn_error('error: Failed to create the objectives')
+        return {}
+
+    for lineno, (childno, new_uuid) in registered.items():
+        item = index.item_at(lineno)
+        expected = item.value
+        add_objective_tags(item, childno, new_uuid)
+        tx.replace(filename, lineno, ntp.build_objective_line_item(item), expected=expected)
+    return {lineno: new_uuid for lineno, (_, new_uuid) in registered.items()}
 
 def register_objective(filename, lineno) -> str:
+    """Registers the objective at lineno, and its unregistered parents. Returns its new uuid."""
     parsed_items = ntp.process_note_file(filename)
-    cur_item = ntp.find_item_at_lineno(parsed_items, lineno)
+    index = ntp.build_outline_index(parsed_items)
+    cur_item = index.item_at(lineno)
 
     cur_item_uuid = ntp.get_tag(cur_item, 'uuid')
     if cur_item_uuid != '':
@@ -41,65 +193,199 @@ def register_objective(filename, lineno) -> str:
         prn_warn(f'item at lineno {lineno} is already registered with uuid {cur_item_uuid}')
         return ''
 
-    parent_lineno, parent_item = ntp.find_parent_item(parsed_items, lineno)
-    parent_item_uuid = ntp.get_tag(parent_item, 'uuid')
-    if parent_item_uuid == '':
-        # We also need to register the parent
-        #print(f'Registering parent of {lineno} at {parent_lineno}')
-        parent_item_uuid = register_objective(filename, parent_lineno)
-    if parent_item_uuid == '':
-        prn_error(f'error: Failed to register parent of {lineno} at {parent_lineno}')
+    tx = ntp.EditTransaction()
+    linenos = find_unregistered_objectives(filename, parsed_items, index, lineno, lineno)
+    registered = register_objectives(filename, index, linenos, tx)
+    if lineno not in registered:
+        prn_error(f'error: Failed to register {filename}:{lineno}')
         return ''
+    tx.commit()
+    return registered[lineno]
 
-    cur_item_desc_part = cur_item.get_part(ntp.ItemType.KV, key='desc')
-    if not cur_item_desc_part:
-        prn_error(f'error: Failed to get desc of {lineno}')
-        return ''
-    cur_item_desc = cur_item_desc_part.value['desc']
+def register_all_objectives(filename, first_lineno=None, last_lineno=None, dry_run=False) -> List[str]:
+    """Registers the unregistered objectives of filename (between the linenos). Returns the new uuids."""
+    parsed_items = ntp.process_note_file(filename)
+    index = ntp.build_outline_index(parsed_items)
+    linenos = find_unregistered_objectives(filename, parsed_items, index, first_lineno, last_lineno)
 
-    # Register this item as an objective against parent_item_uuid
-    new_uuid = ntp.system_create_objective(parent_item_uuid)
-    if new_uuid == '':
-        return ''
+    tx = ntp.EditTransaction()
+    registered = register_objectives(filename, index, linenos, tx, dry_run=dry_run)
+    for lineno, new_uuid in registered.items():
+        print(f'{filename}:{lineno}: {new_uuid} {ntp.build_objective_line_item(index.item_at(lineno))}')
 
-    # Rename the description based on the current item
-    new_desc = ntp.system_rename_objective(new_uuid, cur_item_desc)
-    if new_desc == '':
-        return ''
+    if not dry_run:
+        tx.commit()
+    return list(registered.values())
 
-    # Modify the current line to reflect the new changes. 
-    new_childno = new_desc.split(' ')[0].split('.')[1]
-    #print('new_childno', new_childno)
-    cur_item_tags = cur_item.get_part(ntp.ItemType.TAGS)
-    new_tags = [ntp.Item(ntp.ItemType.KV, {'childno': new_childno}, []), ntp.Item(ntp.ItemType.KV, {'uuid': new_uuid})]
-    if not cur_item_tags:
-        cur_item_tags = ntp.Item(ntp.ItemType.TAGS, '', new_tags)
-        cur_item.parts.append(cur_item_tags)
-    else:
-        for tag in new_tags:
-            cur_item_tags.parts.append(tag)
-    #print('modified', cur_item)
-    #print('modified_built', build_objective_line_item(cur_item))
+def cmdline_args(argv):
+    p = argparse.ArgumentParser(description='Registers objectives of note files in Taskwarrior. '
+                                            'Also callable as: tmlib.notes-register-objective.py FILENAME LINENO')
+    p.add_argument('-n', '--dry-run', action='store_true',
+                   help="Print the new tags without creating tasks or changing the file")
 
-    # Inplace modify the file with the new content. The prints in this loop are directed into the file.
-    try:
-        # Create temporary file in case our solution here fails and destroys the file!
-        tmp_filename = duplicate_file_into_temp(filename)
+    subparsers = p.add_subparsers(dest='subcommand')
+    subparsers.required = True
+
+    sp = subparsers.add_parser('register-all',
+                               help='Register every unregistered objective of a note file, parents first')
+    sp.add_argument('filename',
+                    help='Note file')
+    sp.add_argument('first_lineno', nargs='?', type=int,
+                    help='Only register objectives from this line on')
+    sp.add_argument('last_lineno', nargs='?', type=int,
+                    help='Only register objectives up to this line')
+
+    return p.parse_args(argv)
+
+class UnitTests(ttm.TestCase):
+    PARENT_UUID = '2b3c4d00-1111-4222-8333-444455556666'
+
+    def setUp(self):
+        import tempfile
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.prev_cache_dir = os.environ.get('TTM_CACHE_DIR')
+        os.environ['TTM_CACHE_DIR'] = os.path.join(self.tmp_dir.name, '.cache')
+        self.backend = twc.FakeTaskBackend(os.path.join(self.tmp_dir.name, 'tasks.json'))
+        twc.set_backend(self.backend)
+
+        # A registered objective that is itself the child of another one
+        self.assertTrue(twc.import_tasks([{
+            'uuid': self.PARENT_UUID, 'status': 'pending', 'description': 'Objective A', 'project': 'work',
+            'tags': ['obj'], 'childof': '9f8e7d6c,', 'childdepth': 1, 'gcode': 'g1', 'scheduled': 'today',
+            'due': 'eow', 'gpri': '3', 'blkput': '2', 'entry': '20240624T100000Z',
+        }]))
+
+        self.filename = os.path.join(self.tmp_dir.name, 'TTM1-notes')
+        with open(self.filename, 'w') as f:
+            f.write('P[240624-W26M-1000]- Project (tags: #1a2b3c00, )\n'
+                    '\t- 240624-W26M 10:00 - (-) Objective A (tags: #.1, #2b3c4d00, )\n'
+                    '\t\t- 240624-W26M 10:05 - (-) Child A1\n'
+                    '\t\t\t- 240624-W26M 10:06 - (-) Grandchild A1a\n'
+                    '\t\t\t\t- 240624-W26M 10:07 - A log line\n'
+                    '\t\t- 240624-W26M 10:08 - (-) Child A2\n'
+                    '\t- 240624-W26M 10:10 - (-) Objective B\n')
+
+    def tearDown(self):
+        twc.set_backend(None)
+        self.backend.remove_shim_dir()
+        if self.prev_cache_dir is None:
+            del os.environ['TTM_CACHE_DIR']
+        else:
+            os.environ['TTM_CACHE_DIR'] = self.prev_cache_dir
+        self.tmp_dir.cleanup()
 
-        for line in fileinput.input(filename, inplace=True):
-            if line == cur_item.value:
-                print(ntp.build_objective_line_item(cur_item) + '\n', end='')
-            else:
-                print(line, end='')
+    def register_all(self, **kwargs):
+        import contextlib
+        import io
 
-        os.remove(tmp_filename)
-    except Exception:
-        shutil.move(tmp_filename, filename)
-        raise 
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            uuids = register_all_objectives(self.filename, **kwargs)
+        return uuids, stdout.getvalue()
+
+    def items_by_desc(self):
+        return {ntp.get_kv(item, 'desc'): item for _, item in ntp.process_note_file(self.filename)
+                if item.item_type == ntp.ItemType.OBJECTIVE_LINE}
+
+    def test_register_all_objectives_creates_the_child_tasks(self):
+        with open(self.filename) as f:
+            lines = f.read()
+        uuids, stdout = self.register_all(dry_run=True)
+        self.assertEqual(len(uuids), 3)
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), lines)
+        self.assertEqual(len(self.backend.tasks()), 1)
+
+        uuids, stdout = self.register_all()
+        # Objective B's parent is not a task
+        self.assertIn('error: no task 1a2b3c00 for the parent of line 7', stdout)
+
+        items = self.items_by_desc()
+        self.assertEqual(ntp.get_tag(items['Objective B'], 'uuid'), '')
+        a1, a1a, a2 = [ntp.get_tag(items[desc], 'uuid') for desc in ['Child A1', 'Grandchild A1a', 'Child A2']]
+        self.assertEqual(uuids, [a1, a1a, a2])
+        self.assertEqual([ntp.get_tag(items[desc], 'childno') for desc in ['Child A1', 'Grandchild A1a', 'Child A2']],
+                         ['.01', '.01', '.02'])
+
+        tasks = twc.export_tasks(['2b3c4d00', a1, a1a, a2])
+        parent = tasks['2b3c4d00']
+        self.assertEqual(parent['description'], '2b3c4d00 Objective A')
+        self.assertEqual(parent['children'], f'{a1},{a2},')
+        self.assertEqual(parent['scheduled'], 'today')
+
+        self.assertEqual(tasks[a1]['description'], '2b3c4d00.01 Child A1')
+        self.assertEqual(tasks[a1]['children'], f'{a1a},')
+        self.assertEqual(tasks[a1a]['description'], f'{a1}.01 Grandchild A1a')
+        self.assertEqual(tasks[a2]['description'], '2b3c4d00.02 Child A2')
+        self.assertEqual([(tasks[uuid]['childof'], tasks[uuid]['childdepth']) for uuid in [a1, a1a, a2]],
+                         [('9f8e7d6c,2b3c4d00,', 2), (f'9f8e7d6c,2b3c4d00,{a1},', 3), ('9f8e7d6c,2b3c4d00,', 2)])
+
+        for uuid in [a1, a1a, a2]:
+            self.assertEqual((tasks[uuid]['project'], tasks[uuid]['gcode'], tasks[uuid]['status']),
+                             ('work', 'g1', 'pending'))
+            self.assertEqual(tasks[uuid]['tags'], ['obj', 'inv'])
+            for field in ['scheduled', 'due', 'gpri', 'blkput']:
+                self.assertNotIn(field, tasks[uuid])
+            self.assertNotEqual(tasks[uuid]['entry'], '20240624T100000Z')
+            self.assertTrue(tasks[uuid]['uuid'].startswith(uuid))
+
+        # Nothing is left to register but Objective B
+        self.assertEqual(self.register_all()[0], [])
+
+    def test_plan_objectives_numbers_after_the_existing_children(self):
+        self.register_all(first_lineno=3, last_lineno=3)
+        a1 = ntp.get_tag(self.items_by_desc()['Child A1'], 'uuid')
+
+        parsed_items = ntp.process_note_file(self.filename)
+        index = ntp.build_outline_index(parsed_items)
+        linenos = find_unregistered_objectives(self.filename, parsed_items, index, 6, 6)
+        self.assertEqual(linenos, [6])
+        tasks, registered = plan_objectives(index, linenos, twc.load_snapshot())
+
+        childno, a2 = registered[6]
+        self.assertEqual(childno, '02')
+        tasks = {task['uuid'][:8]: task for task in tasks}
+        self.assertEqual(sorted(tasks), sorted(['2b3c4d00', a2]))
+        # The parent already has its uuid as description prefix
+        self.assertEqual(tasks['2b3c4d00']['description'], '2b3c4d00 Objective A')
+        self.assertEqual(tasks['2b3c4d00']['children'], f'{a1},{a2},')
+        self.assertEqual(tasks[a2]['description'], '2b3c4d00.02 Child A2')
+
+    def test_no_tasks_are_created_for_a_changed_file(self):
+        import contextlib
+        import io
+
+        parsed_items = ntp.process_note_file(self.filename)
+        index = ntp.build_outline_index(parsed_items)
+        linenos = find_unregistered_objectives(self.filename, parsed_items, index, 3, 3)
+        with open(self.filename) as f:
+            lines = f.readlines()
+        lines[2] = lines[2].replace('Child A1', 'Renamed child')
+        with open(self.filename, 'w') as f:
+            f.writelines(lines)
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.assertEqual(register_objectives(self.filename, index, linenos, ntp.EditTransaction()), {})
+        self.assertIn('changed since it was parsed', stdout.getvalue())
+        self.assertEqual(len(self.backend.tasks()), 1)
 
-    return new_uuid
 
 if __name__ == '__main__':
-    filename = sys.argv[1]
-    lineno = int(sys.argv[2])
+    if len(sys.argv) >= 2 and sys.argv[1] == 'unittest':
+        import unittest
+        sys.argv[0] += ' unittest'
+        sys.argv.remove('unittest')
+        unittest.main()
+        exit(0)
+
+    argv = ntp.strip_no_cache_arg(sys.argv)
+    if len(argv) >= 2 and argv[1] in ['register-all', '-n', '--dry-run', '-h', '--help']:
+        args = cmdline_args(argv[1:])
+        register_all_objectives(args.filename, args.first_lineno, args.last_lineno, dry_run=args.dry_run)
+        exit(0)
+
+    filename = argv[1]
+    lineno = int(argv[2])
     register_objective(filename, lineno)
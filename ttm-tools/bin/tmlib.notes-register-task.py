@@ -4,40 +4,26 @@ import sys
 import os
 import subprocess
 import re
-import fileinput
-import shutil
-import importlib.util
 from importlib import import_module
 from enum import Enum, auto
 from typing import List, Optional, Tuple
 
-spec=importlib.util.spec_from_file_location("note_parser","/root/.local/bin/tmlib.note-parser.py")
-note_parser = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(note_parser)
+import ttm
+
+note_parser = ttm.note_parser
 ntp = note_parser
 #print(ntp.find_parent_item, ntp.Item)
 
-spec=importlib.util.spec_from_file_location("reg_objective","/root/.local/bin/tmlib.notes-register-objective.py")
-reg_objective = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(reg_objective)
+reg_objective = ttm.register_objective
 rgo = reg_objective
 
+tw_client = ttm.tw_client
+twc = tw_client
+
 prn_error = print
 prn_warn = print
 prn_info = print
 
-def duplicate_file_into_temp(filename):
-    import tempfile
-    temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w', dir=os.path.dirname(filename))
-
-    # Write the content to a temporary file
-    with open(temp_file.name, 'w') as write_fp:
-        with open(filename, 'r') as read_fp:
-            write_fp.write(read_fp.read())
-    
-    return temp_file.name
-
-
 def register_task(filename, lineno) -> str:
     parsed_items = ntp.process_note_file(filename)
     cur_item = ntp.find_item_at_lineno(parsed_items, lineno)
@@ -91,34 +77,24 @@ def register_task(filename, lineno) -> str:
     #print('extra_tags', extra_tags)
 
 
-    context = ntp.system_cmd("task 2>&1 | perl -wne '/Context .(.*). set.*/i and print $1' 2>/dev/null")
-    if context == '':
-        context = 'none'
-
-    # Create new task
-    ntp.system_cmd('task context none')
-    stdout = ntp.system_cmd(f'task add +tT {extra_tags.strip()} gc:{gcode} proj:{proj} {desc}')
-    ntp.system_cmd(f'task context {context}')
-
-    # Parse out Task relative id
-    new_rel_id = -1
-    p = re.compile('Created task (\d+).')
-    for line in stdout.split('\n'):
-        m = p.match(line)
-        if m:
-            new_rel_id = m.groups()[0]
-            break
-    if new_rel_id == -1:
-        prn_error('error: Could not parse relative id')
+    context = twc.get_context()
+    if context is None:
+        prn_error('error: Could not read the task context')
         return ''
 
-    # Retrieve UUID from relative id
-    new_uuid = ntp.system_cmd(f'task _get {new_rel_id}.uuid').split('-')[0]
+    # Create new task, outside of the context so that it does not pick up the context's tags
+    twc.set_context('none')
+    new_uuid = twc.add_task(['+tT'] + extra_tags.split() +
+                            [f'gc:{gcode}', f'proj:{proj}', f'description:{desc.strip()}'])
+    twc.set_context(context)
+    if new_uuid is None:
+        prn_error('error: Could not create the task')
+        return ''
+    new_uuid = new_uuid.split('-')[0]
     print(new_uuid)
 
     # Modify its notelinks
-    ntp.system_cmd(f'task modify {new_uuid} notelinks:{note_token}')
-    #result = subprocess.run(['task', 'modify', f'{uuid}', f'sch:today'], stdout=subprocess.PIPE)
+    twc.modify_task(new_uuid, [f'notelinks:{note_token}'])
 
     # Modify the current line to reflect the new changes. 
     new_tags = [ntp.Item(ntp.ItemType.KV, {'uuid': new_uuid})]
@@ -131,26 +107,14 @@ def register_task(filename, lineno) -> str:
     #print('modified', cur_item)
     #print('modified_built', ntp.build_note_def_line_item(cur_item))
 
-    # Inplace modify the file with the new content. The prints in this loop are directed into the file.
-    try:
-        # Create temporary file in case our solution here fails and destroys the file!
-        tmp_filename = duplicate_file_into_temp(filename)
-
-        for line in fileinput.input(filename, inplace=True):
-            if line == cur_item.value:
-                print(ntp.build_note_def_line_item(cur_item) + '\n', end='')
-            else:
-                print(line, end='')
-
-        os.remove(tmp_filename)
-    except Exception:
-        shutil.move(tmp_filename, filename)
-        raise 
-
+    tx = ntp.EditTransaction()
+    tx.replace(filename, lineno, ntp.build_note_def_line_item(cur_item), expected=cur_item.value)
+    tx.commit()
 
     return cur_item_uuid
 
 if __name__ == '__main__':
-    filename = sys.argv[1]
-    lineno = int(sys.argv[2])
+    argv = ntp.strip_no_cache_arg(sys.argv)
+    filename = argv[1]
+    lineno = int(argv[2])
     register_task(filename, lineno)
@@ -5,43 +5,32 @@ import os
 import subprocess
 import re
 import fileinput
-import importlib.util
 from importlib import import_module
 from enum import Enum, auto
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Dict
+import argparse
 
-spec=importlib.util.spec_from_file_location("note_parser","/root/.local/bin/tmlib.note-parser.py")
-note_parser = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(note_parser)
+import ttm
+
+note_parser = ttm.note_parser
 ntp = note_parser
 #print(ntp.find_parent_item, ntp.Item)
 
-spec=importlib.util.spec_from_file_location("reg_objective","/root/.local/bin/tmlib.notes-register-objective.py")
-reg_objective = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(reg_objective)
+reg_objective = ttm.register_objective
 rgo = reg_objective
 
+tw_client = ttm.tw_client
+twc = tw_client
+
 prn_error = print
 prn_warn = print
 prn_info = print
 
-def sync_task(filename, lineno) -> str:
-    parsed_items = ntp.process_note_file(filename)
-    cur_item = ntp.find_item_at_lineno(parsed_items, lineno)
-    if not cur_item:
-        prn_error(f'Failed to find item at lineno {lineno}')
-        return ''
-
-    print(cur_item)
-
-    cur_item_uuid = ntp.get_tag(cur_item, 'uuid')
-    if cur_item_uuid == '':
-        # Nothing to do here
-        prn_info('Task is not registered')
-        return ''
-
-    print(cur_item_uuid)
-
+def compute_task_changes(filename, cur_item, tw_task) -> Optional[List[str]]:
+    """
+    Modifications that bring the exported tw_task in line with cur_item of the note file filename, for a
+    single task modify. Returns None if filename does not say whether this is in proj, areas, or resources.
+    """
     # Get the task information from notes
     desc = cur_item.get_part(ntp.ItemType.KV, key='desc').value['desc'].strip()
     status = cur_item.get_part(ntp.ItemType.KV, key='status')
@@ -74,7 +63,7 @@ def sync_task(filename, lineno) -> str:
     # The task may be in the projects, areas, or resources folder. These determine the tags for context. project is default visiblity.
     if basename == filename:
         prn_error('Please specify the path for whether this is in proj, areas, or resources.')
-        return ''
+        return None
     dirname = os.path.basename(filename.replace(basename, '')[:-1])
     extra_tags = ''
     if dirname == 'areas':
@@ -82,12 +71,11 @@ def sync_task(filename, lineno) -> str:
     if dirname == 'resources':
         extra_tags += '+inv +res'
 
-    # Get Task Information from TaskWarrior
-    tw_desc = ntp.system_cmd(f'task _get {cur_item_uuid}.description')
-    tw_status = ntp.system_cmd(f'task _get {cur_item_uuid}.status')
-    tw_tags = ntp.system_cmd(f'task _get {cur_item_uuid}.tags').split(',')
-    tw_proj = ntp.system_cmd(f'task _get {cur_item_uuid}.project')
-    tw_gcode = ntp.system_cmd(f'task _get {cur_item_uuid}.gcode')
+    tw_desc = twc.get_field(tw_task, 'description')
+    tw_status = twc.get_field(tw_task, 'status')
+    tw_tags = twc.get_tags(tw_task)
+    tw_proj = twc.get_field(tw_task, 'project')
+    tw_gcode = twc.get_field(tw_task, 'gcode')
 
     # Check presence of desc prefix
     #print('tw_desc', tw_desc)
@@ -101,30 +89,35 @@ def sync_task(filename, lineno) -> str:
     #print('tw_desc', tw_desc)
     #print('tw_desc_prefix', tw_desc_prefix)
 
+    # All changes are collected and applied with a single task modify. Tag changes are collected in the order
+    # of the rules below and reduced to their net effect.
+    changes = []
+    tag_ops = []
+
     # Sync Description
     if desc != tw_desc:
         new_desc = tw_desc_prefix + ' ' + desc
         new_desc = new_desc.strip()
         #print('new_desc', new_desc)
         prn_info(f'Syncing desc: {desc} -> {new_desc}')
-        ntp.system_cmd(f'task modify {cur_item_uuid} description:"{new_desc}"')
+        changes.append(f'description:{new_desc}')
 
     # Sync Status
     if status == '-' and tw_status != 'pending':
         prn_info(f'Syncing status: {tw_status} -> pending')
-        ntp.system_cmd(f'task modify {cur_item_uuid} status:pending')
+        changes.append('status:pending')
     if status == '!' and tw_status != 'completed':
         prn_info(f'Syncing status: {tw_status }-> completed')
-        ntp.system_cmd(f'task modify {cur_item_uuid} status:completed')
+        changes.append('status:completed')
     if status == 'X' and tw_status != 'deleted':
         prn_info(f'Syncing status: {tw_status }-> deleted')
-        ntp.system_cmd(f'task modify {cur_item_uuid} status:deleted')
+        changes.append('status:deleted')
     if status == 'A' and 'ar' not in tw_tags:
         prn_info(f'Syncing status: archived')
-        ntp.system_cmd(f'task modify {cur_item_uuid} +ar')
+        tag_ops += ['+ar']
     if status != 'A' and 'ar' in tw_tags:
         prn_info(f'Syncing status: unarchived')
-        ntp.system_cmd(f'task modify {cur_item_uuid} -ar')
+        tag_ops += ['-ar']
 
     has_gcode = False
     for tag in tags.parts:
@@ -135,36 +128,257 @@ def sync_task(filename, lineno) -> str:
     # Sync Project and gcode
     if gcode != tw_gcode:
         prn_info(f'Syncing gcode: {tw_gcode} -> {gcode}')
-        ntp.system_cmd(f'task modify {cur_item_uuid} gcode:{gcode}')
+        changes.append(f'gcode:{gcode}')
     if proj != tw_proj:
         prn_info(f'Syncing proj: {tw_proj} -> {proj}')
-        ntp.system_cmd(f'task modify {cur_item_uuid} project:{proj}')
+        changes.append(f'project:{proj}')
 
     # If gcode is in the note tags, add +inv +gcode. This is for a task that represents 
     # the entire project and should have its own context.
     if has_gcode and ('inv' not in tw_tags or 'gcode' not in tw_tags):
         prn_info(f'Syncing gcode task')
-        ntp.system_cmd(f'task modify {cur_item_uuid} +inv +gcode -area -res')
+        tag_ops += ['+inv', '+gcode', '-area', '-res']
     if not has_gcode and ('gcode' in tw_tags):
-        ntp.system_cmd(f'task modify {cur_item_uuid} -gcode')
+        tag_ops += ['-gcode']
     if dirname != 'area' and dirname != 'resources' and not has_gcode and 'inv' in tw_tags:
-        ntp.system_cmd(f'task modify {cur_item_uuid} -inv')
+        tag_ops += ['-inv']
 
     if dirname != 'area' and dirname != 'resources' and ('area' in tw_tags or 'res' in tw_tags):
-        ntp.system_cmd(f'task modify {cur_item_uuid} -area -res -inv -gcode')
+        tag_ops += ['-area', '-res', '-inv', '-gcode']
     if dirname != 'areas' and 'area' in tw_tags:
-        ntp.system_cmd(f'task modify {cur_item_uuid} -area')
+        tag_ops += ['-area']
     if dirname != 'resources' and 'res' in tw_tags:
-        ntp.system_cmd(f'task modify {cur_item_uuid} -res')
+        tag_ops += ['-res']
 
     if not has_gcode and dirname == 'areas' and 'area' not in tw_tags:
-        ntp.system_cmd(f'task modify {cur_item_uuid} +inv +area')
+        tag_ops += ['+inv', '+area']
     if not has_gcode and dirname == 'resources' and 'res' not in tw_tags:
-        ntp.system_cmd(f'task modify {cur_item_uuid} +inv +res')
+        tag_ops += ['+inv', '+res']
+
+    return changes + twc.tag_changes(tw_tags, tag_ops)
+
+
+def sync_task(filename, lineno) -> str:
+    parsed_items = ntp.process_note_file(filename)
+    cur_item = ntp.find_item_at_lineno(parsed_items, lineno)
+    if not cur_item:
+        prn_error(f'Failed to find item at lineno {lineno}')
+        return ''
+
+    print(cur_item)
+
+    cur_item_uuid = ntp.get_tag(cur_item, 'uuid')
+    if cur_item_uuid == '':
+        # Nothing to do here
+        prn_info('Task is not registered')
+        return ''
+
+    print(cur_item_uuid)
+
+    # Get Task Information from TaskWarrior
+    tw_task = twc.export_tasks([cur_item_uuid])
+    if tw_task is None or cur_item_uuid not in tw_task:
+        prn_error(f'Failed to export task {cur_item_uuid}')
+        return ''
+    tw_task = tw_task[cur_item_uuid]
+
+    changes = compute_task_changes(filename, cur_item, tw_task)
+    if changes is None:
+        return ''
+
+    if not twc.modify_task(cur_item_uuid, changes):
+        prn_error(f'Failed to modify task {cur_item_uuid}')
+        return ''
 
     return cur_item_uuid
 
+
+def find_registered_items(filename) -> List[Tuple[int, ntp.Item, str]]:
+    """(lineno, item, uuid) of every entry and objective of filename that is registered as a task."""
+    registered = []
+    for lineno, item in ntp.process_note_file(filename):
+        if item.item_type not in [ntp.ItemType.ENTRY_DEFINITION_LINE, ntp.ItemType.OBJECTIVE_LINE]:
+            continue
+
+        uuid = ntp.get_tag(item, 'uuid')
+        if uuid != '':
+            registered.append((lineno, item, uuid))
+    return registered
+
+
+def sync_files(filenames: List[str], dry_run=False) -> bool:
+    """
+    Syncs every registered task of filenames: one task export for all of them, then one task modify per
+    distinct set of changes. Prints a summary and returns whether every task could be synced.
+    """
+    registered = []
+    for filename in filenames:
+        try:
+            registered += [(filename, lineno, item, uuid) for lineno, item, uuid in find_registered_items(filename)]
+        except UnicodeDecodeError:
+            continue
+
+    tw_tasks = twc.export_tasks(uuid for _, _, _, uuid in registered)
+    if tw_tasks is None:
+        prn_error('Failed to export tasks')
+        return False
+
+    # Tasks with identical changes (e.g. only a status change) share one task modify
+    batches: Dict[Tuple[str, ...], List[str]] = {}
+    seen = set()
+    n_missing = 0
+    n_skipped = 0
+    for filename, lineno, item, uuid in registered:
+        if uuid in seen:
+            prn_warn(f'{filename}:{lineno}: {uuid} is registered more than once, syncing the first only')
+            n_skipped += 1
+            continue
+        seen.add(uuid)
+
+        if uuid not in tw_tasks:
+            prn_warn(f'{filename}:{lineno}: task {uuid} does not exist')
+            n_missing += 1
+            continue
+
+        prn_info(f'{filename}:{lineno}: {uuid}')
+        changes = compute_task_changes(filename, item, tw_tasks[uuid])
+        if changes is None:
+            n_skipped += 1
+            continue
+        if changes:
+            batches.setdefault(tuple(changes), []).append(uuid)
+
+    n_failed = 0
+    if not dry_run:
+        for changes, uuids in batches.items():
+            if not twc.modify_tasks(uuids, list(changes)):
+                prn_error(f'Failed to modify tasks {" ".join(uuids)}')
+                n_failed += len(uuids)
+
+    n_changed = sum(len(uuids) for uuids in batches.values())
+    prn_info(f'{len(seen)} tasks checked in {len(filenames)} files: {n_changed - n_failed} '
+             f'{"to update" if dry_run else "updated"}, {n_failed} failed, {n_missing} missing, {n_skipped} skipped')
+    return n_failed == 0 and n_missing == 0
+
+
+def cmdline_args(argv):
+    # Make parser object
+    p = argparse.ArgumentParser(description='Syncs registered tasks of note files to Taskwarrior. '
+                                            'Also callable as: tmlib.notes-sync-task.py FILENAME LINENO',
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    p.add_argument('-n', '--dry-run', action='store_true',
+                   help="Print the changes without applying them")
+
+    subparsers = p.add_subparsers(dest='subcommand')
+    subparsers.required = True
+
+    sp = subparsers.add_parser('sync-file',
+                               help='Sync every registered task of the note files')
+    sp.add_argument('filenames', nargs='+',
+                    help='Note files to sync')
+
+    sp = subparsers.add_parser('sync-dir',
+                               help='Sync every registered task of the note files below a directory')
+    sp.add_argument('directory',
+                    help='Directory to search in')
+
+    return p.parse_args(argv)
+
+
+class UnitTests(ttm.TestCase):
+    def test_sync_files_batches_identical_changes(self):
+        import contextlib
+        import io
+        import tempfile
+
+        prev_cache_dir = os.environ.get('TTM_CACHE_DIR')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.environ['TTM_CACHE_DIR'] = os.path.join(tmp_dir, '.cache')
+            backend = twc.FakeTaskBackend(os.path.join(tmp_dir, 'tasks.json'))
+            twc.set_backend(backend)
+
+            modifies = []
+            fake_run = backend.run
+            def run(args):
+                if 'modify' in args:
+                    modifies.append(args)
+                return fake_run(args)
+            backend.run = run
+
+            def sync(filenames, dry_run=False):
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    ok = sync_files(filenames, dry_run=dry_run)
+                return ok, out.getvalue().splitlines()[-1]
+
+            try:
+                self.assertTrue(twc.import_tasks([
+                    {'uuid': f'{uuid}-1111-4222-8333-444455556666', 'status': 'pending', 'description': desc,
+                     'project': 'ttm_dev', 'gcode': 'TTM1'}
+                    for uuid, desc in [('2b3c4d01', 'Objective A'), ('2b3c4d02', 'Objective B'),
+                                       ('2b3c4d03', 'Old description'), ('2b3c4d05', 'Objective F')]]))
+                os.makedirs(os.path.join(tmp_dir, 'projects'))
+                note = os.path.join(tmp_dir, 'projects', 'TTM1-ttm_dev')
+                with open(note, 'w') as f:
+                    f.write('P[240624-W26M-1000]- Project\n'
+                            '\t- 240624-W26M 10:00 - (!) Objective A (tags: #2b3c4d01, )\n'
+                            '\t- 240624-W26M 10:01 - (!) Objective B (tags: #2b3c4d02, )\n'
+                            '\t- 240624-W26M 10:02 - (-) Objective C (tags: #2b3c4d03, )\n'
+                            '\t- 240624-W26M 10:03 - (!) Objective A again (tags: #2b3c4d01, )\n'
+                            '\t- 240624-W26M 10:04 - (-) Objective E (tags: #2b3c4d04, )\n'
+                            '\t- 240624-W26M 10:05 - (-) Objective F (tags: #2b3c4d05, )\n')
+                tasks = backend.tasks()
+
+                # A dry run only reports
+                self.assertEqual(sync([note], dry_run=True),
+                                 (False, '5 tasks checked in 1 files: 3 to update, 0 failed, 1 missing, 1 skipped'))
+                self.assertEqual(modifies, [])
+                self.assertEqual(backend.tasks(), tasks)
+
+                # The two completed objectives share a modify, the first registration of 2b3c4d01 wins
+                self.assertEqual(sync([note]),
+                                 (False, '5 tasks checked in 1 files: 3 updated, 0 failed, 1 missing, 1 skipped'))
+                self.assertEqual(sorted(args[args.index('modify'):] for args in modifies),
+                                 [['modify', 'description:Objective C'], ['modify', 'status:completed']])
+                self.assertIn('2b3c4d01', [args for args in modifies if 'status:completed' in args][0])
+                self.assertIn('2b3c4d02', [args for args in modifies if 'status:completed' in args][0])
+                exported = twc.export_tasks(['2b3c4d01', '2b3c4d02', '2b3c4d03', '2b3c4d05'])
+                self.assertEqual([exported[uuid]['status'] for uuid in ['2b3c4d01', '2b3c4d02', '2b3c4d03']],
+                                 ['completed', 'completed', 'pending'])
+                self.assertEqual(exported['2b3c4d03']['description'], 'Objective C')
+
+                # Once in sync, nothing is modified
+                modifies.clear()
+                self.assertEqual(sync([note]),
+                                 (False, '5 tasks checked in 1 files: 0 updated, 0 failed, 1 missing, 1 skipped'))
+                self.assertEqual(modifies, [])
+            finally:
+                twc.set_backend(None)
+                if prev_cache_dir is None:
+                    os.environ.pop('TTM_CACHE_DIR', None)
+                else:
+                    os.environ['TTM_CACHE_DIR'] = prev_cache_dir
+
+
 if __name__ == '__main__':
-    filename = sys.argv[1]
-    lineno = int(sys.argv[2])
+    # if you have unittest as part of the script, you can forward to it this way
+    if len(sys.argv) >= 2 and sys.argv[1] == 'unittest':
+        import unittest
+        sys.argv[0] += ' unittest'
+        sys.argv.remove('unittest')
+        unittest.main()
+        exit(0)
+
+    argv = ntp.strip_no_cache_arg(sys.argv)
+    if len(argv) >= 2 and argv[1] in ['sync-file', 'sync-dir', '-n', '--dry-run', '-h', '--help']:
+        args = cmdline_args(argv[1:])
+        if args.subcommand == 'sync-file':
+            filenames = args.filenames
+        else:
+            filenames = ntp.list_note_files(args.directory)
+        exit(0 if sync_files(filenames, dry_run=args.dry_run) else 1)
+
+    filename = argv[1]
+    lineno = int(argv[2])
     sync_task(filename, lineno)
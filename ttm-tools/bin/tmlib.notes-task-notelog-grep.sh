@@ -1,11 +1,7 @@
 #!/bin/bash
 
-# Preprocess the entries and save to a temporary file
-python3 /root/.local/bin/tmlib.notes-citations-processor.py "$(pwd)" $@ \
-  | awk 'BEGIN{RS="/ENTRY"; ORS="\0"} {gsub(/\n/, "\\n"); print}' > /tmp/preprocessed_entries.txt
-
-# Run fzf with the preprocessed entries
-selected=$(cat /tmp/preprocessed_entries.txt \
+# Stream the NUL-delimited entries straight into fzf, which shows them as files are parsed
+selected=$($HOME/.local/bin/ttm-run notes-citations-processor "$(pwd)" --jobs "$(nproc)" --read0 $@ \
   | fzf --preview="sh ~/.local/bin/tmlib.notes-task-notelog-grep-preview.sh {} {q}" \
         --read0 --multi --preview-window=up:60% \
 )
@@ -31,11 +27,6 @@ while IFS= read -r entry; do
   filename=$(echo "$last_line" | cut -d':' -f1 | tr -d '\n')
   other_content=$(echo "$last_line" | cut -d':' -f2- | tr -d '\n')
 
-  # Check if filename starts with \n and remove it if present
-  if [[ "$filename" == \\n* ]]; then
-    filename=$(echo "$filename" | sed 's/^\\n//')
-  fi
-
   lineno=$(echo "$last_line" | cut -d':' -f2 | tr -d '\n')
 
   # Check if filename and lineno are extracted
@@ -0,0 +1,886 @@
+#!/bin/python3
+"""
+Small Taskwarrior client. Reads any number of tasks with one `task export` and applies all changes to a task
+with one `task modify`, so that Taskwarrior's startup is paid once per call rather than once per field.
+
+Read-only lookups can skip Taskwarrior: read_value() and `tmlib.tw-get` answer `task _get` from a cached
+export of every task while the task data files are unchanged. Once they change, `tmlib.tw-get` exports the tasks
+again, while read_value() runs `task _get` until the next export.
+
+All calls go through a task backend, the task binary or an in-memory stand-in for tests and benchmarks.
+`tmlib.tw-client.py fake-task ARGS` runs the stand-in selected by TTM_TASK_BACKEND=fake:<file.json> as if it
+was task.
+"""
+
+import os
+import re
+import sys
+import json
+import shlex
+import atexit
+import shutil
+import hashlib
+import datetime
+import tempfile
+import subprocess
+from abc import ABC, abstractmethod
+from typing import List, Optional, Dict, Iterable, Tuple
+
+import ttm
+
+log_file = '/tmp/tw-client.log'
+verbose = 2
+log_echo_stdout = False
+
+def log_any(s, status, verbose_level):
+    from datetime import datetime as dtdt
+
+    if verbose < verbose_level:
+        return
+
+    with open(log_file, 'a') as f:
+        s = str(dtdt.today()) + f' {status} - ' + s
+        f.write(s + '\n')
+        if log_echo_stdout:
+            print(s)
+
+
+def log_error(s): return log_any(s, 'ERROR', verbose_level=0)
+def log_info(s): return log_any(s, 'INFO', verbose_level=1)
+def log_warn(s): return log_any(s, 'WARN', verbose_level=1)
+def log_debug(s): return log_any(s, 'DEBUG', verbose_level=2)
+def log_trace(s): return log_any(s, 'TRACE', verbose_level=3)
+
+
+TASK_BIN = 'task'
+
+# Taskwarrior reads uuids from the command line, keep each call well below the argument limits
+EXPORT_CHUNK_SIZE = 200
+
+# Reads must see every task, whatever context is active, and only print the JSON
+EXPORT_RC = ['rc.verbose=nothing', 'rc.context=none', 'rc.json.array=on']
+
+# undo.data grows with every change, which catches changes within the mtime granularity
+TASK_DATA_FILES = ['pending.data', 'completed.data', 'undo.data', 'taskchampion.sqlite3']
+
+SNAPSHOT_VERSION = 1
+
+
+# ==============================================================================
+# Task backends
+# ==============================================================================
+# Every Taskwarrior call of the tools goes through a backend. TTM_TASK_BACKEND selects it:
+#   unset or 'task'      - the task binary (TASK_BIN)
+#   'fake:<file.json>'   - FakeTaskBackend keeping its tasks in <file.json>
+# It is an environment variable so that it holds for every loaded copy of this module and for the helper
+# scripts we run, which reach the fake backend through a `task` shim (see FakeTaskBackend.run_script).
+
+class TaskBackend(ABC):
+    @abstractmethod
+    def run(self, args: List[str]) -> Tuple[int, str, str]:
+        """Runs task with args. Returns (returncode, stdout, stderr)."""
+
+    @abstractmethod
+    def run_script(self, argv: List[str]) -> Tuple[int, str]:
+        """Runs a helper script that calls task itself. Returns (returncode, stdout)."""
+
+    @abstractmethod
+    def data_files(self) -> List[str]:
+        """Files holding the tasks: any change to the tasks changes the stat of one of them."""
+
+
+class TaskwarriorBackend(TaskBackend):
+    def __init__(self, task_bin: str = TASK_BIN):
+        self.task_bin = task_bin
+
+    def run(self, args: List[str]) -> Tuple[int, str, str]:
+        result = subprocess.run([self.task_bin] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return result.returncode, result.stdout.decode(), result.stderr.decode()
+
+    def run_script(self, argv: List[str]) -> Tuple[int, str]:
+        result = subprocess.run(argv, stdout=subprocess.PIPE)
+        return result.returncode, result.stdout.decode()
+
+    def data_files(self) -> List[str]:
+        data_dir = task_data_dir()
+        # Taskwarrior 2 keeps the tasks in *.data files, Taskwarrior 3 in a sqlite database
+        return [os.path.join(data_dir, name) for name in TASK_DATA_FILES]
+
+
+class FakeTaskBackend(TaskBackend):
+    """
+    Pure Python stand-in for Taskwarrior, for tests and benchmarks of the Python side. Mimics the commands
+    and output the tools rely on: add, modify, dupl, _get, export, import and context. Filters are ids, uuids
+    (or their prefix), +tag/-tag and attribute:value. Attribute names may be abbreviated like Taskwarrior
+    allows. Values are stored as given: dates like 'today+1h' are not evaluated. rc.* overrides are ignored.
+
+    The tasks are kept in db_filename (a temporary file if not given) and re-read on every call, so that
+    several loaded copies of this module and subprocesses share them.
+    """
+    COMMANDS = ['add', 'modify', 'dupl', '_get', 'export', 'import', 'context']
+    ATTRIBUTES = [
+        'description', 'status', 'project', 'priority', 'due', 'scheduled', 'wait', 'until', 'start', 'end',
+        'entry', 'modified', 'depends', 'recur', 'tags', 'uuid', 'id',
+        # UDAs from the taskrc
+        'blkest', 'blkestcum', 'blkestf', 'blkfilt', 'blkput', 'blkputcum', 'blkputf', 'blkputman', 'blkrem',
+        'blksiz', 'childdepth', 'childof', 'children', 'desort', 'durunit', 'endsch', 'etag', 'expdur', 'gcode',
+        'gpri', 'issuelinks', 'linkedto', 'notelinks', 'notes', 'ppri', 'size', 'state',
+    ]
+
+    def __init__(self, db_filename: Optional[str] = None):
+        if db_filename is None:
+            fd, db_filename = tempfile.mkstemp(prefix='ttm-fake-task-', suffix='.json')
+            os.close(fd)
+            os.unlink(db_filename)
+        self.db_filename = db_filename
+        self.shim_dir = None
+
+    # --------------------------------------------------------------------------
+    def load(self) -> Dict:
+        try:
+            with open(self.db_filename) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'tasks': [], 'next_uuid': 1, 'context': ''}
+
+    def save(self, db: Dict):
+        tmp_filename = self.db_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(db, f, indent=1)
+        os.replace(tmp_filename, self.db_filename)
+
+    def tasks(self) -> List[Dict]:
+        return self.load()['tasks']
+
+    def data_files(self) -> List[str]:
+        return [self.db_filename]
+
+    # --------------------------------------------------------------------------
+    def run(self, args: List[str]) -> Tuple[int, str, str]:
+        args = [arg for arg in args if not re.match(r'rc:|rc\.[^=:]+[=:]', arg)]
+        commands = [i for i, arg in enumerate(args) if arg in self.COMMANDS]
+        if len(commands) == 0:
+            return 1, '', f'fake task: unsupported command line {args}\n'
+        filter_args, command, cmd_args = args[:commands[0]], args[commands[0]], args[commands[0]+1:]
+
+        # `task modify <uuid> ...` is also accepted for `task <uuid> modify ...`
+        if command in ['modify', 'dupl'] and len(filter_args) == 0:
+            while len(cmd_args) > 0 and self._is_task_ref(cmd_args[0]):
+                filter_args.append(cmd_args.pop(0))
+
+        db = self.load()
+        try:
+            code, stdout = getattr(self, '_cmd_' + command.lstrip('_'))(db, filter_args, cmd_args)
+        except ValueError as e:
+            return 2, '', f'fake task: {e}\n'
+        if command in ['add', 'modify', 'dupl', 'import', 'context']:
+            self.save(db)
+        return code, stdout, ''
+
+    def run_script(self, argv: List[str]) -> Tuple[int, str]:
+        if self.shim_dir is None:
+            self.shim_dir = tempfile.mkdtemp(prefix='ttm-fake-task-bin-')
+            # Removed when the process that made it exits, not when a forked child does
+            atexit.register(self.remove_shim_dir, os.getpid())
+            shim = os.path.join(self.shim_dir, 'task')
+            with open(shim, 'w') as f:
+                f.write(f'#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))}'
+                        ' fake-task "$@"\n')
+            os.chmod(shim, 0o755)
+
+        env = dict(os.environ)
+        env['PATH'] = self.shim_dir + os.pathsep + env.get('PATH', '')
+        env['TTM_TASK_BACKEND'] = 'fake:' + self.db_filename
+        result = subprocess.run(argv, stdout=subprocess.PIPE, env=env)
+        return result.returncode, result.stdout.decode()
+
+    def remove_shim_dir(self, pid: Optional[int] = None):
+        """Removes the `task` shim of run_script, if pid is None or this process."""
+        if self.shim_dir is None or (pid is not None and pid != os.getpid()):
+            return
+        shutil.rmtree(self.shim_dir, ignore_errors=True)
+        self.shim_dir = None
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def _is_task_ref(arg: str) -> bool:
+        return re.fullmatch(r'\d+|[0-9a-f]{8}(-[0-9a-f-]{0,28})?', arg) is not None
+
+    def _attribute(self, name: str) -> Optional[str]:
+        if name in self.ATTRIBUTES:
+            return name
+        matches = [attr for attr in self.ATTRIBUTES if len(name) >= 2 and attr.startswith(name)]
+        return matches[0] if len(matches) == 1 else None
+
+    def _find(self, db: Dict, ref: str) -> Optional[Dict]:
+        for task in db['tasks']:
+            if ref.isdigit() and task['id'] == int(ref) and task['id'] != 0:
+                return task
+            if not ref.isdigit() and task['uuid'].startswith(ref):
+                return task
+        return None
+
+    def _filter(self, db: Dict, filter_args: List[str]) -> List[Dict]:
+        refs = [arg for arg in filter_args if self._is_task_ref(arg)]
+        tasks = db['tasks']
+        if len(refs) > 0:
+            tasks = [task for task in (self._find(db, ref) for ref in refs) if task is not None]
+            tasks = list({task['uuid']: task for task in tasks}.values())
+
+        for arg in filter_args:
+            if arg in refs:
+                continue
+            if arg.startswith('+') or arg.startswith('-'):
+                tasks = [task for task in tasks if (arg[1:] in task.get('tags', [])) == arg.startswith('+')]
+                continue
+            name, sep, value = arg.partition(':')
+            attr = self._attribute(name)
+            if not sep or attr is None:
+                raise ValueError(f'unsupported filter {arg}')
+            tasks = [task for task in tasks if get_field(task, attr) == value]
+        return tasks
+
+    def _apply(self, task: Dict, mods: List[str]):
+        words = []
+        for mod in mods:
+            if len(mod) > 1 and mod[0] in '+-' and ' ' not in mod:
+                tags = task.setdefault('tags', [])
+                if mod[0] == '+' and mod[1:] not in tags:
+                    tags.append(mod[1:])
+                if mod[0] == '-' and mod[1:] in tags:
+                    tags.remove(mod[1:])
+                if len(tags) == 0:
+                    del task['tags']
+                continue
+
+            name, sep, value = mod.partition(':')
+            attr = self._attribute(name) if sep else None
+            if attr is None:
+                words.append(mod)
+                continue
+            if attr in ['uuid', 'id', 'entry', 'modified']:
+                raise ValueError(f'{attr} is read-only')
+            # Taskwarrior strips the quotes the shell scripts put around values
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+                value = value[1:-1]
+            if value == '':
+                task.pop(attr, None)
+            elif attr == 'tags':
+                task['tags'] = value.split(',')
+            else:
+                task[attr] = value
+
+        if len(words) > 0:
+            task['description'] = ' '.join(words)
+        if task.get('status') in ['completed', 'deleted']:
+            task['id'] = 0
+        task['modified'] = timestamp()
+
+    def _new_task(self, db: Dict, uuid: Optional[str] = None) -> Dict:
+        if uuid is None:
+            digest = hashlib.sha256(str(db['next_uuid']).encode()).hexdigest()
+            db['next_uuid'] += 1
+            uuid = f'{digest[:8]}-{digest[8:12]}-4{digest[13:16]}-8{digest[17:20]}-{digest[20:32]}'
+        ids = [task['id'] for task in db['tasks']]
+        task = {'id': max(ids, default=0) + 1, 'uuid': uuid, 'status': 'pending', 'entry': timestamp()}
+        db['tasks'].append(task)
+        return task
+
+    # --------------------------------------------------------------------------
+    def _cmd_add(self, db: Dict, filter_args: List[str], cmd_args: List[str]) -> Tuple[int, str]:
+        task = self._new_task(db)
+        self._apply(task, cmd_args)
+        if task.get('description', '') == '':
+            db['tasks'].remove(task)
+            raise ValueError('additional text must be provided')
+        return 0, f'Created task {task["id"]}.\n'
+
+    def _cmd_modify(self, db: Dict, filter_args: List[str], cmd_args: List[str]) -> Tuple[int, str]:
+        if len(filter_args) == 0:
+            raise ValueError('command line contains no filter')
+        tasks = self._filter(db, filter_args)
+        stdout = ''
+        for task in tasks:
+            self._apply(task, cmd_args)
+            stdout += f"Modifying task {task['id']} '{task.get('description', '')}'.\n"
+        stdout += f"Modified {len(tasks)} task{'' if len(tasks) == 1 else 's'}.\n"
+        return 0 if len(tasks) > 0 else 1, stdout
+
+    def _cmd_dupl(self, db: Dict, filter_args: List[str], cmd_args: List[str]) -> Tuple[int, str]:
+        tasks = self._filter(db, filter_args)
+        stdout = ''
+        for task in tasks:
+            new_task = self._new_task(db)
+            new_task.update({k: v for k, v in task.items() if k not in ['id', 'uuid', 'entry', 'modified']})
+            new_task['status'] = 'pending'
+            self._apply(new_task, cmd_args)
+            stdout += f"Duplicated task {task['id']} '{task.get('description', '')}'.\n"
+            stdout += f"Created task {new_task['id']}.\n"
+        stdout += f"Duplicated {len(tasks)} task{'' if len(tasks) == 1 else 's'}.\n"
+        return 0 if len(tasks) > 0 else 1, stdout
+
+    def _cmd_get(self, db: Dict, filter_args: List[str], cmd_args: List[str]) -> Tuple[int, str]:
+        values = []
+        for ref in cmd_args:
+            if ref == 'rc.context':
+                values.append(db['context'])
+                continue
+            task_ref, _, name = ref.rpartition('.')
+            attr = self._attribute(name)
+            task = self._find(db, task_ref) if self._is_task_ref(task_ref) else None
+            values.append(get_field(task, attr) if task is not None and attr is not None else '')
+        return 0, ' '.join(values) + '\n'
+
+    def _cmd_export(self, db: Dict, filter_args: List[str], cmd_args: List[str]) -> Tuple[int, str]:
+        return 0, json.dumps(self._filter(db, filter_args)) + '\n'
+
+    def _cmd_import(self, db: Dict, filter_args: List[str], cmd_args: List[str]) -> Tuple[int, str]:
+        count = 0
+        for filename in cmd_args:
+            with open(filename) as f:
+                imported = json.load(f)
+            for task in imported if type(imported) is list else [imported]:
+                task = {k: v for k, v in task.items() if k not in ['id', 'urgency']}
+                existing = self._find(db, task['uuid'])
+                if existing is None:
+                    existing = self._new_task(db, task['uuid'])
+                for k in list(existing.keys()):
+                    if k not in ['id', 'entry']:
+                        del existing[k]
+                existing.update(task)
+                if existing.get('status') in ['completed', 'deleted']:
+                    existing['id'] = 0
+                count += 1
+        return 0, f"Imported {count} task{'' if count == 1 else 's'}.\n"
+
+    def _cmd_context(self, db: Dict, filter_args: List[str], cmd_args: List[str]) -> Tuple[int, str]:
+        if len(cmd_args) == 0 or cmd_args[0] == 'show':
+            if db['context'] == '':
+                return 0, 'No context is currently applied.\n'
+            return 0, f"Context '{db['context']}' is currently applied.\n"
+        if cmd_args[0] == 'none':
+            db['context'] = ''
+            return 0, 'Context unset.\n'
+        db['context'] = cmd_args[0]
+        return 0, f"Context '{cmd_args[0]}' set. Use 'task context none' to remove.\n"
+
+
+def backend_from_env() -> TaskBackend:
+    spec = os.environ.get('TTM_TASK_BACKEND', 'task')
+    if spec.startswith('fake:'):
+        return FakeTaskBackend(spec[len('fake:'):])
+    if spec != 'task':
+        log_warn(f'Unknown TTM_TASK_BACKEND {spec}, using task')
+    return TaskwarriorBackend()
+
+
+_backend = None
+
+def get_backend() -> TaskBackend:
+    global _backend
+    if _backend is None:
+        _backend = backend_from_env()
+    return _backend
+
+
+def set_backend(backend: Optional[TaskBackend]):
+    """Uses backend for this copy of the module, None goes back to TTM_TASK_BACKEND."""
+    global _backend
+    _backend = backend
+
+
+def run_task(args: List[str]) -> Optional[str]:
+    """Runs task with args (no shell involved). Returns stdout, or None if task failed."""
+    log_debug(f'task {args}')
+    returncode, stdout, stderr = get_backend().run(args)
+    if returncode != 0:
+        log_error(f'task {args} failed with {returncode}: {stderr.strip()}')
+        return None
+    return stdout
+
+
+def run_script(argv: List[str]) -> Optional[str]:
+    """Runs a helper script that calls task itself, against the same backend. Returns stdout, or None."""
+    log_debug(f'{argv}')
+    returncode, stdout = get_backend().run_script(argv)
+    if returncode != 0:
+        log_error(f'{argv} failed with {returncode}')
+        return None
+    return stdout
+
+
+def get_value(ref: str) -> Optional[str]:
+    """`task _get ref`, e.g. get_value('1a2b3c4d.description'). None if task failed."""
+    stdout = run_task(['rc.verbose=nothing', '_get', ref])
+    return None if stdout is None else stdout.rstrip('\n')
+
+
+def get_context() -> Optional[str]:
+    """Name of the active context, '' when none is. None if task failed."""
+    return get_value('rc.context')
+
+
+def set_context(context: str) -> bool:
+    """Activates context, '' or 'none' deactivates it."""
+    return run_task(['rc.verbose=nothing', 'context', context or 'none']) is not None
+
+
+def add_task(args: List[str]) -> Optional[str]:
+    """
+    `task add args` (e.g. ['+tag', 'proj:x', 'description:some text']). Returns the uuid of the new task,
+    or None if task failed.
+    """
+    stdout = run_task(['rc.verbose=new-id', 'add'] + args)
+    if stdout is None:
+        return None
+    m = re.search(r'Created task (\d+)\.', stdout)
+    if not m:
+        log_error(f'Could not parse the id of the new task from {stdout!r}')
+        return None
+    return get_value(f'{m.groups()[0]}.uuid') or None
+
+
+def export_tasks(uuids: Iterable[str]) -> Optional[Dict[str, Dict]]:
+    """
+    Exports the tasks for uuids (full or short 8 character uuids). Returns the exported tasks keyed by the uuid
+    they were asked for, missing uuids have no key. Returns None if task failed.
+    """
+    uuids = list(dict.fromkeys(uuids))
+    tasks = {}
+
+    for i in range(0, len(uuids), EXPORT_CHUNK_SIZE):
+        chunk = uuids[i:i+EXPORT_CHUNK_SIZE]
+        stdout = run_task(EXPORT_RC + chunk + ['export'])
+        if stdout is None:
+            return None
+
+        try:
+            exported = json.loads(stdout) if stdout.strip() else []
+        except ValueError as e:
+            log_error(f'Could not parse task export: {e}')
+            return None
+
+        for task in exported:
+            for uuid in chunk:
+                if task.get('uuid', '').startswith(uuid):
+                    tasks[uuid] = task
+
+    return tasks
+
+
+def get_field(task: Dict, name: str) -> str:
+    """Field of an exported task, as `task _get` would print it: '' when unset, lists joined with commas."""
+    value = task.get(name, '')
+    if type(value) is list:
+        return ','.join(str(v) for v in value)
+    return str(value)
+
+
+def get_tags(task: Dict) -> List[str]:
+    return list(task.get('tags', []))
+
+
+def tag_changes(tags: List[str], ops: List[str]) -> List[str]:
+    """
+    Net effect of applying the +tag/-tag ops in order to tags, as modification arguments for one
+    `task modify`.
+    """
+    result = list(tags)
+    for op in ops:
+        tag = op[1:]
+        if op.startswith('+') and tag not in result:
+            result.append(tag)
+        if op.startswith('-') and tag in result:
+            result.remove(tag)
+
+    added = ['+' + tag for tag in result if tag not in tags]
+    removed = ['-' + tag for tag in tags if tag not in result]
+    return added + removed
+
+
+def modify_tasks(uuids: List[str], changes: List[str]) -> bool:
+    """
+    Applies the same changes (e.g. ['description:some text', 'status:completed', '+tag', '-tag']) to every
+    task of uuids with one `task modify` per chunk of uuids. Every change is one argument, so values need no
+    quoting.
+    """
+    if len(changes) == 0:
+        return True
+
+    ok = True
+    for i in range(0, len(uuids), EXPORT_CHUNK_SIZE):
+        chunk = uuids[i:i+EXPORT_CHUNK_SIZE]
+        # Modifying several tasks at once asks for confirmation, which we have nobody to give
+        rc = ['rc.confirmation=off', 'rc.bulk=0'] if len(chunk) > 1 else []
+        ok = run_task(rc + chunk + ['modify'] + changes) is not None and ok
+    return ok
+
+
+def modify_task(uuid: str, changes: List[str]) -> bool:
+    return modify_tasks([uuid], changes)
+
+
+def import_tasks(tasks: List[Dict]) -> bool:
+    """
+    Creates or replaces tasks (full task dicts as exported, with their uuid) with one `task import`.
+    A task with the uuid of an existing task replaces it, so give every attribute it should keep.
+    """
+    if len(tasks) == 0:
+        return True
+
+    tasks = [{k: v for k, v in task.items() if k not in ['id', 'urgency']} for task in tasks]
+    fd, tmp_filename = tempfile.mkstemp(prefix='ttm-task-import-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tasks, f)
+        return run_task(['rc.verbose=nothing', 'import', tmp_filename]) is not None
+    finally:
+        os.unlink(tmp_filename)
+
+
+def timestamp() -> str:
+    """Now, as Taskwarrior exports dates."""
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+# ==============================================================================
+# Export snapshot
+# ==============================================================================
+# Read-only lookups are answered from a `task export` of every task, cached in the ttm cache directory and
+# exported again only when the task data files changed. A lookup then costs reading one JSON file instead of
+# a Taskwarrior startup.
+
+def task_data_dir() -> str:
+    """data.location of Taskwarrior: $TASKDATA, else the taskrc's data.location, else ~/.task."""
+    if os.environ.get('TASKDATA'):
+        return os.path.expanduser(os.environ['TASKDATA'])
+
+    taskrc = os.path.expanduser(os.environ.get('TASKRC', '~/.taskrc'))
+    data_dir = '~/.task'
+    try:
+        with open(taskrc) as f:
+            for line in f:
+                m = re.match(r'\s*data\.location\s*=\s*(\S+)', line)
+                if m:
+                    data_dir = m.groups()[0]
+    except OSError:
+        pass
+    return os.path.expanduser(data_dir)
+
+
+def snapshot_cache_dir() -> str:
+    return os.environ.get('TTM_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ttm'))
+
+
+def _data_stat(filenames: List[str]) -> List:
+    stat = []
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+            stat.append([filename, st.st_ino, st.st_mtime_ns, st.st_size])
+        except FileNotFoundError:
+            stat.append([filename, None, None, None])
+    return stat
+
+
+def format_value(value) -> str:
+    """Value of an exported attribute, as `task _get` would print it."""
+    if type(value) is list:
+        return ','.join(str(v) for v in value)
+    if type(value) is str and re.fullmatch(r'\d{8}T\d{6}Z', value):
+        # Exported dates are UTC, _get prints them in local time
+        date = datetime.datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=datetime.timezone.utc)
+        return date.astimezone().strftime('%Y-%m-%dT%H:%M:%S')
+    return str(value)
+
+
+class TaskSnapshot:
+    """
+    Every task of the backend keyed by uuid, from one `task export`. Read-only: it goes stale as soon as the
+    tasks change, use load_snapshot() to get an up to date one.
+    """
+    def __init__(self, tasks: List[Dict], data_stat: List):
+        self.data_stat = data_stat
+        self.tasks = {task['uuid']: task for task in tasks}
+        self.by_id = {task['id']: task for task in tasks if task.get('id', 0) != 0}
+        self.by_short_uuid = {uuid[:8]: task for uuid, task in self.tasks.items()}
+
+    def find(self, ref: str) -> Optional[Dict]:
+        """Task for an id, a full uuid or a uuid prefix of at least 8 characters."""
+        if ref.isdigit():
+            return self.by_id.get(int(ref))
+        task = self.tasks.get(ref) or self.by_short_uuid.get(ref[:8])
+        if task is not None and task['uuid'].startswith(ref):
+            return task
+        return None
+
+    def get(self, ref: str) -> Optional[str]:
+        """
+        `task _get ref` for ref = <id or uuid>.<attribute>: '' for a missing task or attribute. None when the
+        snapshot cannot answer, e.g. rc.* references.
+        """
+        task_ref, _, name = ref.rpartition('.')
+        if task_ref == '' or task_ref.startswith('rc') or not re.fullmatch(r'\d+|[0-9a-f-]{8,36}', task_ref):
+            return None
+        task = self.find(task_ref)
+        if task is None:
+            return ''
+        return format_value(task.get(name, ''))
+
+
+_snapshot = None
+
+def load_snapshot(export: bool = True) -> Optional[TaskSnapshot]:
+    """
+    Up to date snapshot of the tasks of the current backend: the one in memory or in the cache directory if
+    the data files did not change since, else a new export. None if task failed, or if there is no up to date
+    snapshot and export is False.
+    """
+    global _snapshot
+    backend = get_backend()
+    data_files = backend.data_files()
+    data_stat = _data_stat(data_files)
+    if _snapshot is not None and _snapshot.data_stat == data_stat:
+        return _snapshot
+
+    key = hashlib.sha1('\0'.join(data_files).encode()).hexdigest()[:16]
+    cache_filename = os.path.join(snapshot_cache_dir(), f'tw-snapshot-{key}.json')
+    try:
+        with open(cache_filename) as f:
+            cached = json.load(f)
+        if cached.get('version') == SNAPSHOT_VERSION and cached.get('data_stat') == data_stat:
+            _snapshot = TaskSnapshot(cached['tasks'], data_stat)
+            return _snapshot
+    except (OSError, ValueError):
+        pass
+    if not export:
+        return None
+
+    # The stat is taken before exporting, a change during the export only makes the next load export again
+    stdout = run_task(EXPORT_RC + ['export'])
+    if stdout is None:
+        return None
+    try:
+        tasks = json.loads(stdout) if stdout.strip() else []
+    except ValueError as e:
+        log_error(f'Could not parse task export: {e}')
+        return None
+
+    try:
+        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(cache_filename), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'data_stat': data_stat, 'tasks': tasks}, f)
+        os.replace(tmp_filename, cache_filename)
+    except OSError as e:
+        log_warn(f'Could not write {cache_filename}: {e}')
+
+    _snapshot = TaskSnapshot(tasks, data_stat)
+    return _snapshot
+
+
+def read_value(ref: str) -> Optional[str]:
+    """
+    Read-only `task _get ref` answered from the snapshot, falling back to task for what it cannot answer. A
+    stale snapshot is not exported again here: one `task _get` is much cheaper than exporting every task.
+    None if task failed.
+    """
+    return _snapshot_value(load_snapshot(export=False), ref)
+
+
+def read_values(refs: List[str]) -> List[Optional[str]]:
+    """
+    read_value() of each of refs, for `tmlib.tw-get`. A stale snapshot is exported again first: one export
+    instead of a `task _get` per ref, and the lookups that follow find the snapshot up to date.
+    """
+    snapshot = load_snapshot()
+    return [_snapshot_value(snapshot, ref) for ref in refs]
+
+
+def _snapshot_value(snapshot: Optional[TaskSnapshot], ref: str) -> Optional[str]:
+    value = snapshot.get(ref) if snapshot is not None else None
+    return value if value is not None else get_value(ref)
+
+
+class UnitTests(ttm.TestCase):
+    def test_tag_changes_are_the_net_effect_of_ops(self):
+        self.assertEqual(tag_changes(['inv', 'area'], ['+inv', '+gcode', '-area', '-res']), ['+gcode', '-area'])
+        self.assertEqual(tag_changes(['area'], ['+inv', '-inv', '-area', '+area']), [])
+        self.assertEqual(tag_changes([], []), [])
+
+    def test_fields_of_exported_task(self):
+        task = {'uuid': '1a2b3c4d-0000-0000-0000-000000000000', 'description': 'x', 'tags': ['inv', 'gcode']}
+        self.assertEqual(get_field(task, 'tags'), 'inv,gcode')
+        self.assertEqual(get_field(task, 'project'), '')
+        self.assertEqual(get_tags({}), [])
+
+    def test_fake_backend_add_modify_get_export(self):
+        backend = FakeTaskBackend()
+        set_backend(backend)
+        try:
+            uuid = add_task(['+tT', 'gc:abc', 'proj:work', 'description:Read: the intro'])
+            self.assertIsNotNone(uuid)
+            short_uuid = uuid.split('-')[0]
+            self.assertEqual(get_value(f'{short_uuid}.description'), 'Read: the intro')
+            self.assertEqual(get_value('1.project'), 'work')
+            self.assertEqual(get_value('99.uuid'), '')
+
+            self.assertTrue(modify_task(short_uuid, ['sch:today+1h', '+inv', '-tT', 'gc:']))
+            self.assertEqual(run_task(['modify', short_uuid, 'notelinks:"x.md"']).splitlines()[-1], 'Modified 1 task.')
+            task = export_tasks([short_uuid])[short_uuid]
+            self.assertEqual(task['scheduled'], 'today+1h')
+            self.assertEqual(task['tags'], ['inv'])
+            self.assertEqual(task['notelinks'], 'x.md')
+            self.assertNotIn('gcode', task)
+
+            stdout = run_task([short_uuid, 'dupl'])
+            self.assertIn("Duplicated task 1 'Read: the intro'.\nCreated task 2.", stdout)
+            self.assertEqual(len(export_tasks([get_value('2.uuid')])), 1)
+            self.assertIsNone(run_task(['next']))
+        finally:
+            set_backend(None)
+            os.unlink(backend.db_filename)
+
+    def test_fake_backend_import_creates_and_replaces(self):
+        backend = FakeTaskBackend()
+        set_backend(backend)
+        try:
+            uuid = add_task(['gc:abc', 'description:parent'])
+            parent = export_tasks([uuid])[uuid]
+            parent['children'] = '2c624232,'
+            del parent['gcode']
+            child = {'uuid': '2c624232-cdd2-4f2a-8b6f-5e1d0fbd4b1e', 'description': 'child', 'status': 'pending'}
+            self.assertTrue(import_tasks([parent, child]))
+
+            tasks = export_tasks([uuid, '2c624232'])
+            self.assertEqual(tasks[uuid]['children'], '2c624232,')
+            self.assertNotIn('gcode', tasks[uuid])
+            self.assertEqual(tasks['2c624232']['id'], 2)
+            self.assertEqual(get_value('2.description'), 'child')
+        finally:
+            set_backend(None)
+            os.unlink(backend.db_filename)
+
+    def test_fake_backend_context(self):
+        backend = FakeTaskBackend()
+        set_backend(backend)
+        try:
+            self.assertEqual(get_context(), '')
+            self.assertTrue(set_context('work'))
+            self.assertEqual(get_context(), 'work')
+            self.assertTrue(set_context(''))
+            self.assertEqual(get_context(), '')
+        finally:
+            set_backend(None)
+            os.unlink(backend.db_filename)
+
+    def test_fake_backend_runs_scripts_through_a_shim(self):
+        with self.assertRaises(TypeError):
+            TaskBackend()
+        backend = FakeTaskBackend()
+        try:
+            backend.run(['add', 'description:it\'s a "quoted" task'])
+            self.assertEqual(backend.run_script(['sh', '-c', 'task _get 1.description']),
+                             (0, 'it\'s a "quoted" task\n'))
+            shim_dir = backend.shim_dir
+            self.assertTrue(os.path.isfile(os.path.join(shim_dir, 'task')))
+            backend.remove_shim_dir(os.getpid() + 1)
+            self.assertTrue(os.path.isdir(shim_dir))
+            backend.remove_shim_dir()
+            self.assertFalse(os.path.exists(shim_dir))
+            self.assertIsNone(backend.shim_dir)
+        finally:
+            backend.remove_shim_dir()
+            os.unlink(backend.db_filename)
+
+    def test_snapshot_answers_get_until_the_tasks_change(self):
+        backend = FakeTaskBackend()
+        set_backend(backend)
+        prev_cache_dir = os.environ.get('TTM_CACHE_DIR')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.environ['TTM_CACHE_DIR'] = tmp_dir
+            try:
+                uuid = add_task(['gc:abc', 'endsch:20240624T100000Z', 'description:Read the intro'])
+                snapshot = load_snapshot()
+                self.assertEqual(snapshot.get(f'{uuid[:8]}.description'), 'Read the intro')
+                self.assertEqual(snapshot.get('1.gcode'), 'abc')
+                self.assertEqual(snapshot.get(f'{uuid}.etag'), '')
+                self.assertEqual(snapshot.get('ffffffff.uuid'), '')
+                self.assertIsNone(snapshot.get('rc.context'))
+                self.assertEqual(snapshot.get(f'{uuid[:8]}.endsch'), format_value('20240624T100000Z'))
+                self.assertEqual(len(os.listdir(tmp_dir)), 1)
+
+                # Unchanged data files: the same snapshot, also for another process reading the cache file
+                self.assertIs(load_snapshot(), snapshot)
+                global _snapshot
+                _snapshot = None
+                self.assertEqual(load_snapshot().tasks, snapshot.tasks)
+
+                # Changed data files: lookups ask task until the snapshot is exported again
+                modify_task(uuid[:8], ['gc:xyz'])
+                self.assertIsNone(load_snapshot(export=False))
+                exports = []
+                def run(args, backend_run=backend.run):
+                    if 'export' in args:
+                        exports.append(args)
+                    return backend_run(args)
+                backend.run = run
+
+                self.assertEqual(read_value(f'{uuid[:8]}.gcode'), 'xyz')
+                self.assertEqual(read_value('rc.context'), '')
+                self.assertEqual(exports, [])
+
+                # tw-get exports once for all its refs, and leaves an up to date snapshot
+                self.assertEqual(read_values([f'{uuid[:8]}.gcode', '1.description', 'rc.context']),
+                                 ['xyz', 'Read the intro', ''])
+                self.assertEqual(len(exports), 1)
+                self.assertEqual(load_snapshot(export=False).get(f'{uuid[:8]}.gcode'), 'xyz')
+                self.assertEqual(read_values([f'{uuid[:8]}.gcode']), ['xyz'])
+                self.assertEqual(len(exports), 1)
+            finally:
+                set_backend(None)
+                os.unlink(backend.db_filename)
+                if prev_cache_dir is None:
+                    del os.environ['TTM_CACHE_DIR']
+                else:
+                    os.environ['TTM_CACHE_DIR'] = prev_cache_dir
+
+
+def _fake_task_main(args: List[str]) -> int:
+    backend = get_backend()
+    if not isinstance(backend, FakeTaskBackend):
+        print('fake-task: TTM_TASK_BACKEND=fake:<file.json> is not set', file=sys.stderr)
+        return 2
+    returncode, stdout, stderr = backend.run(args)
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return returncode
+
+
+def _get_main(args: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='tmlib.tw-get',
+                                     description='task _get REF... answered from a cached export of the tasks')
+    parser.add_argument('refs', nargs='+', metavar='REF', help='<id or uuid>.<attribute>, e.g. 1a2b3c4d.notelinks')
+    parser.add_argument('-l', '--lines', action='store_true',
+                        help='print one value per line instead of space separated like task _get')
+    args = parser.parse_args(args)
+
+    values = read_values(args.refs)
+    if None in values:
+        return 1
+    print(('\n' if args.lines else ' ').join(values))
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'unittest':
+        import unittest
+        sys.argv[0] += ' unittest'
+        sys.argv.remove('unittest')
+        unittest.main()
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'fake-task':
+        sys.exit(_fake_task_main(sys.argv[2:]))
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'get':
+        sys.exit(_get_main(sys.argv[2:]))
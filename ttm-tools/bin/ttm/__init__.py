@@ -0,0 +1,54 @@
+"""
+Shared loading of the tmlib.* tools.
+
+The tools are tmlib.<name>.py scripts next to this package. ttm.<module> loads one of them on first use and keeps
+it in sys.modules, so every tool in a process shares a single copy of it (and of its classes, e.g. ItemType), and
+its bytecode is cached in __pycache__. Tools import ttm from the directory they are run from, so nothing depends on
+where the tools are installed.
+"""
+import os
+import sys
+import importlib.util
+
+BIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ttm.<attribute> -> script in BIN_DIR
+MODULES = {
+    'note_parser': 'tmlib.note-parser.py',
+    'register_objective': 'tmlib.notes-register-objective.py',
+    'tw_client': 'tmlib.tw-client.py',
+}
+
+
+def script_filename(script: str) -> str:
+    return os.path.join(BIN_DIR, script)
+
+
+def load_script(module_name: str, filename: str):
+    """Executes filename as module_name, from its cached bytecode when that is up to date."""
+    spec = importlib.util.spec_from_file_location(module_name, filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+def load(name: str):
+    module = sys.modules.get(f'ttm.{name}')
+    if module is None:
+        module = load_script(f'ttm.{name}', script_filename(MODULES[name]))
+    return module
+
+
+def __getattr__(name):
+    if name in MODULES:
+        return load(name)
+    if name == 'TestCase':
+        # The base of the UnitTests classes of the tools, so that `python -m unittest` and pytest collect them too
+        import unittest
+        return unittest.TestCase
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
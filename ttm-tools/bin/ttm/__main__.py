@@ -0,0 +1,103 @@
+"""
+Runs a tmlib tool: ttm-run COMMAND [ARGS...] is the same as tmlib.COMMAND.py [ARGS...], with the tool itself
+run from cached bytecode as well. When ttm-server is running, the command is run by it instead.
+
+  ttm-run list                      Lists the commands
+  ttm-run bench [-n N] [COMMAND...] Times the startup (imports) of every command, or of the ones given
+"""
+import os
+import sys
+
+import ttm
+
+
+def commands():
+    """command -> script, for every tmlib.<command>.py next to the package."""
+    result = {}
+    for script in sorted(os.listdir(ttm.BIN_DIR)):
+        if script.startswith('tmlib.') and script.endswith('.py'):
+            result[script[len('tmlib.'):-len('.py')]] = script
+    return result
+
+
+def run_command(script: str, argv):
+    filename = ttm.script_filename(script)
+    sys.argv = [filename] + list(argv)
+    ttm.load_script('__main__', filename)
+
+
+def _time_python(code: str, n: int) -> float:
+    """Median wall time in ms of n fresh interpreters running code."""
+    import statistics
+    import subprocess
+    import time
+
+    env = dict(os.environ, PYTHONPATH=ttm.BIN_DIR)
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def bench(argv):
+    """
+    Loads every command n times in a fresh interpreter, without running its main, and prints the median time
+    spent over a bare interpreter start. That is what each keystroke-triggered tool pays before doing any work.
+    """
+    import argparse
+
+    p = argparse.ArgumentParser(prog='ttm-run bench', description=bench.__doc__)
+    p.add_argument('-n', '--runs', type=int, default=5,
+                   help='Interpreter starts per command (default: %(default)s)')
+    p.add_argument('commands', nargs='*',
+                   help='Commands to time (default: all)')
+    args = p.parse_args(argv)
+
+    available = commands()
+    for command in args.commands:
+        if command not in available:
+            sys.exit(f'Unknown command {command}')
+
+    # The first start of each compiles the bytecode, keep it out of the timings
+    baseline = _time_python('pass', args.runs + 1)
+    print(f'{"python startup":32} {baseline:8.1f} ms')
+    for command in args.commands or available:
+        code = f'import ttm; ttm.load_script("ttm_bench", ttm.script_filename({available[command]!r}))'
+        try:
+            _time_python(code, 1)
+            elapsed = _time_python(code, args.runs)
+        except Exception as e:
+            print(f'{command:32} {"failed":>8}    ({e})')
+            continue
+        print(f'{command:32} {elapsed:8.1f} ms  (+{elapsed - baseline:.1f} ms imports)')
+
+
+def main(argv):
+    if len(argv) == 0 or argv[0] in ['-h', '--help']:
+        print(__doc__.strip())
+        return
+
+    command, argv = argv[0], argv[1:]
+    if command == 'list':
+        print('\n'.join(commands()))
+        return
+    if command == 'bench':
+        bench(argv)
+        return
+
+    available = commands()
+    if command not in available:
+        sys.exit(f'Unknown command {command}, see ttm-run list')
+
+    from ttm import server
+    status = server.forward([command] + argv)
+    if status is not None:
+        sys.exit(status)
+    run_command(available[command], argv)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
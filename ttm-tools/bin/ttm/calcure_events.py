@@ -0,0 +1,189 @@
+"""
+Calcure events: the events.csv that calcure shows, and the expected.csv of planned events.
+
+An events.csv line is `id,year,month,day,"HHMM:HHMM TAG [GCODE UUID PROJECT DESC...]",repeat,repeat_mode,priority`.
+Lines are parsed with the csv module in one pass, so a description may hold commas and quotes, into slotted
+CalcureCsvEvent records. iter_events streams the events of a file, and read_line reads a file only up to the line
+asked for.
+"""
+import csv
+import datetime
+import itertools
+from typing import Iterator, List, Optional, Tuple
+
+import ttm
+
+
+class CalcureEventError(Exception):
+    pass
+
+
+class CalcureCsvEvent:
+    __slots__ = ['year', 'month', 'day', 'start', 'end', 'tag', 'desc', 'repeat_amt', 'repeat_mode', 'priority',
+                 'gcode', 'uuid', 'project', 'item_desc']
+
+    def __init__(self, year, month, day, start, end, tag, desc, repeat_amt, repeat_mode, priority,
+                 gcode=None, uuid=None, project=None, item_desc=None):
+        self.year = year
+        self.month = month
+        self.day = day
+        self.start = start
+        self.end = end
+        self.tag = tag
+        self.desc = desc
+        self.repeat_amt = repeat_amt
+        self.repeat_mode = repeat_mode
+        self.priority = priority
+        self.gcode = gcode
+        self.uuid = uuid
+        self.project = project
+        self.item_desc = item_desc
+
+    @staticmethod
+    def parse(csv_line: str) -> 'CalcureCsvEvent':
+        return CalcureCsvEvent.from_row(next(csv.reader([csv_line]), []))
+
+    @staticmethod
+    def from_row(row: List[str]) -> 'CalcureCsvEvent':
+        if len(row) != 8:
+            raise CalcureEventError(f'Calcure event csv line must have 8 comma-seperated tokens. Line: {row}')
+        _id, year, month, day, desc, repeat_amt, repeat_mode, priority = row
+
+        # process out start-end from description. Required.
+        if len(desc) < len('0000:0000 ') or desc[4] != ':':
+            raise CalcureEventError(f'Description must start with time stamp like 0000:0000. Desc: {desc}')
+        start = desc[:4]
+        end = desc[5:9]
+
+        # Every item should have a unique tag. One split gives the tag and the fields that may follow it.
+        desc_remaining_tokens = desc[10:].split(' ', 4)
+        if len(desc_remaining_tokens) < 2 or len(desc_remaining_tokens[0]) != 4:
+            raise CalcureEventError(f'Description must start with a 4 character tag like EVNT. Desc: {desc[10:]}')
+        tag = desc_remaining_tokens[0]
+
+        # Try to parse extra information from the description if possible: gcode, UUID, project, item_desc (remaining)
+        gcode = None
+        uuid = None
+        project = None
+        item_desc = None
+        if len(desc_remaining_tokens) == 5:
+            _, gcode, uuid, project, item_desc = desc_remaining_tokens
+
+            # Since this is a variable length field, assumme some default padding
+            project = project.ljust(len('some_long_project_name'))
+            item_desc = item_desc.strip()
+
+        return CalcureCsvEvent(year, month, day, start, end, tag, desc[15:], repeat_amt, repeat_mode,
+                               priority.strip(), gcode, uuid, project, item_desc)
+
+    def display(self, event_id: int) -> str:
+        """The csv line of the event, without the line end."""
+        desc = f'{self.start}:{self.end} {self.tag} {self.desc}'.replace('"', '""')
+        return f'{event_id},{self.year},{self.month},{self.day},"{desc}",{self.repeat_amt},{self.repeat_mode},{self.priority}'
+
+    def sort_key(self) -> Tuple[int, int]:
+        """(date ordinal, start minute of the day), the order events are kept in."""
+        return (datetime.date(int(self.year), int(self.month), int(self.day)).toordinal(),
+                int(self.start[:2]) * 60 + int(self.start[2:]))
+
+
+def iter_events(filename: str) -> Iterator[CalcureCsvEvent]:
+    """The events of an events.csv, parsed as the file is read. Blank lines are skipped."""
+    with open(filename, 'r', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) > 0:
+                yield CalcureCsvEvent.from_row(row)
+
+
+def read_line(filename: str, lineno: int) -> Optional[str]:
+    """Line lineno (1-based) of filename, reading no further than it, or None if the file is shorter."""
+    if lineno < 1:
+        return None
+    with open(filename, 'r') as f:
+        return next(itertools.islice(f, lineno - 1, lineno), None)
+
+
+EXPECTED_FIELDS = ['status', 'yyyy', 'mm', 'dd', 'weekcode', 'interval', 'scope', 'color', 'type', 'priority',
+                   'gcode', 'uuid', 'proj', 'desc']
+
+
+def get_uuid_from_expected_csv(filename: str, lineno: int) -> Optional[str]:
+    line = read_line(filename, lineno)
+    if line is None:
+        return None
+
+    # Don't care about tabbing or anything for this
+    line = line.strip()
+    tokens = line.split(',')
+    if len(tokens) < len(EXPECTED_FIELDS):
+        raise CalcureEventError(f'line does not match expected format: {line}')
+
+    return tokens[EXPECTED_FIELDS.index('uuid')]
+
+
+def get_uuid_from_events_csv(filename: str, lineno: int) -> Optional[str]:
+    line = read_line(filename, lineno)
+    if line is None:
+        return None
+
+    # Don't care about tabbing or anything for this
+    line = line.strip()
+    event = CalcureCsvEvent.parse(line)
+    if event.uuid is None:
+        raise CalcureEventError(f'line does not match expected format for desc: {line}')
+
+    return event.uuid
+
+
+class UnitTests(ttm.TestCase):
+    def test_parse_and_display_round_trip(self):
+        line = '3,2024,6,24,"0900:0100 EVNT g1 1a2b3c4d proj an, event ""quoted""",1,once,important'
+        event = CalcureCsvEvent.parse(line + '\n')
+        self.assertEqual((event.year, event.month, event.day, event.start, event.end, event.tag),
+                         ('2024', '6', '24', '0900', '0100', 'EVNT'))
+        self.assertEqual((event.gcode, event.uuid, event.item_desc), ('g1', '1a2b3c4d', 'an, event "quoted"'))
+        self.assertEqual(event.priority, 'important')
+        self.assertEqual(event.display(3), line)
+        self.assertEqual(event.sort_key(), (datetime.date(2024, 6, 24).toordinal(), 9 * 60))
+
+        event = CalcureCsvEvent.parse('0,2024,6,24,"0900:0100 EVNT untracked",1,once,normal')
+        self.assertIsNone(event.uuid)
+        self.assertEqual(event.desc, 'untracked')
+
+        for line in ['0,2024,6,24,"0900:0100 EVNT x",1,once', '0,2024,6,24,"0900-0100 EVNT x",1,once,normal',
+                     '0,2024,6,24,"0900:0100 EVENT x",1,once,normal']:
+            with self.assertRaises(CalcureEventError):
+                CalcureCsvEvent.parse(line)
+
+    def test_files(self):
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            events_csv = os.path.join(tmp_dir, 'events.csv')
+            with open(events_csv, 'w') as f:
+                f.write('0,2024,6,24,"0900:0100 EVNT g1 1a2b3c4d proj event",1,once,normal\n'
+                        '\n'
+                        '1,2024,6,25,"1000:0020 DTSK untracked",1,once,unimportant\n')
+            self.assertEqual([event.start for event in iter_events(events_csv)], ['0900', '1000'])
+            self.assertEqual(read_line(events_csv, 3), '1,2024,6,25,"1000:0020 DTSK untracked",1,once,unimportant\n')
+            self.assertIsNone(read_line(events_csv, 4))
+            self.assertEqual(get_uuid_from_events_csv(events_csv, 1), '1a2b3c4d')
+            self.assertIsNone(get_uuid_from_events_csv(events_csv, 9))
+            with self.assertRaises(CalcureEventError):
+                get_uuid_from_events_csv(events_csv, 3)
+
+            expected_csv = os.path.join(tmp_dir, 'expected.csv')
+            with open(expected_csv, 'w') as f:
+                f.write('INIT,2024,06,24,W26M,0900:XXXX,1D,CL0,EVNT,NEED,g1,5e6f7a8b,proj,planned\n')
+            self.assertEqual(get_uuid_from_expected_csv(expected_csv, 1), '5e6f7a8b')
+            self.assertIsNone(get_uuid_from_expected_csv(expected_csv, 2))
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) >= 2 and sys.argv[1] == 'unittest':
+        import unittest
+        sys.argv[0] += ' unittest'
+        sys.argv.remove('unittest')
+        unittest.main()
@@ -0,0 +1,431 @@
+"""
+ttm-server: runs tmlib tools in a process that is already warm, so that a command pays neither for an interpreter
+start nor for importing the tools.
+
+The server loads the note parser, register-objective and the Taskwarrior client once and keeps the task snapshot
+loaded. Every request forks a child of it that runs the command like ttm-run does, in the working directory and
+environment of the client and on its stdin, stdout and stderr, which the client passes over the socket. The
+server then answers with the exit status of the command.
+
+ttm-run forwards its command to the server when the socket exists, and runs it itself when there is no server or
+TTM_NO_SERVER is set. A request is one JSON line {"argv": [...], "cwd": ..., "env": {...}} sent along with the
+client's three file descriptors, answered with {"status": <int>}.
+"""
+import os
+import sys
+
+import ttm
+
+log_file = '/tmp/ttm-server.log'
+verbose = 0
+
+def log_any(s, status, verbose_level):
+    from datetime import datetime as dtdt
+
+    if verbose < verbose_level:
+        return
+
+    with open(log_file, 'a') as f:
+        f.write(str(dtdt.today()) + f' {status} - ' + s + '\n')
+
+
+def log_error(s): return log_any(s, 'ERROR', verbose_level=0)
+def log_info(s): return log_any(s, 'INFO', verbose_level=1)
+def log_warn(s): return log_any(s, 'WARN', verbose_level=1)
+def log_debug(s): return log_any(s, 'DEBUG', verbose_level=2)
+
+
+def server_socket_path() -> str:
+    if os.environ.get('TTM_SERVER_SOCKET', '') != '':
+        return os.environ['TTM_SERVER_SOCKET']
+    if os.environ.get('XDG_RUNTIME_DIR', '') != '':
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], f'ttm-server-{os.getuid()}.sock')
+    # /tmp is shared with every local user: the socket goes in a directory only we can use
+    return os.path.join('/tmp', f'ttm-server-{os.getuid()}', 'server.sock')
+
+
+def is_private_dir(dirname: str) -> bool:
+    """True if dirname is a real directory owned by us that no one else can enter."""
+    import stat
+
+    try:
+        st = os.lstat(dirname)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and st.st_mode & 0o077 == 0
+
+
+def is_fallback_socket_path(path: str) -> bool:
+    return os.path.dirname(path) == os.path.join('/tmp', f'ttm-server-{os.getuid()}')
+
+
+def peer_uid(sock) -> int:
+    """The uid of the process at the other end of a connected unix socket, or -1 if it cannot be told."""
+    import socket
+    import struct
+
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return -1
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _pid, uid, _gid = struct.unpack('3i', creds)
+    return uid
+
+
+def _recv_line(conn, data=b'') -> bytes:
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def forward(argv, fds=(0, 1, 2)):
+    """
+    Runs argv (COMMAND [ARGS...]) on a running ttm-server. Returns the exit status of the command, or None if there
+    is no server, in which case the caller runs the command itself.
+    """
+    if os.environ.get('TTM_NO_SERVER', '') != '':
+        return None
+    path = server_socket_path()
+    if not os.path.exists(path):
+        return None
+
+    # The client hands over its environment and its fds, only to a server of our own user
+    if is_fallback_socket_path(path) and not is_private_dir(os.path.dirname(path)):
+        log_warn(f'Not using {path}, its directory is not private')
+        return None
+    try:
+        if os.stat(path).st_uid != os.getuid():
+            log_warn(f'Not using {path}, it is owned by another user')
+            return None
+    except OSError:
+        return None
+
+    import json
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+            if peer_uid(sock) not in [os.getuid(), -1]:
+                log_warn(f'Not using {path}, the server runs as another user')
+                return None
+            request = {'argv': list(argv), 'cwd': os.getcwd(), 'env': dict(os.environ)}
+            socket.send_fds(sock, [(json.dumps(request) + '\n').encode()], list(fds))
+        except OSError:
+            # Nothing was run, a stale socket file or a server going down
+            return None
+
+        # From here on the command may have run, it must not be run again
+        try:
+            response = json.loads(_recv_line(sock))
+            return int(response['status'])
+        except (OSError, ValueError, KeyError, TypeError):
+            sys.stderr.write(f'ttm-server did not report how {argv[0]} exited\n')
+            return 1
+    finally:
+        sock.close()
+
+
+class CommandServer:
+    def __init__(self, socket_path: str, refresh_interval: float = 2.0):
+        self.socket_path = socket_path
+        self.refresh_interval = refresh_interval
+        self.commands = None
+
+    def warm_up(self):
+        """Loads what every command needs, so that forked children start with it."""
+        import argparse, json, subprocess, tempfile     # noqa: F401, imported by most tools
+        from ttm import __main__ as dispatcher
+
+        self.commands = dispatcher.commands()
+        ttm.note_parser
+        ttm.register_objective
+        self.refresh()
+
+    def refresh(self):
+        # Re-exports only when the task data changed, the children are forked with an up to date snapshot
+        try:
+            ttm.tw_client.load_snapshot()
+        except Exception as e:
+            log_warn(f'Cannot load the task snapshot: {e}')
+
+    def _open_socket(self):
+        import socket
+
+        if is_fallback_socket_path(self.socket_path):
+            try:
+                os.mkdir(os.path.dirname(self.socket_path), 0o700)
+            except FileExistsError:
+                pass
+            if not is_private_dir(os.path.dirname(self.socket_path)):
+                raise RuntimeError(f'{os.path.dirname(self.socket_path)} is not a directory private to this user')
+
+        # A socket file left by a server that died is stale; one that accepts connections is not ours to take.
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError(f'ttm-server is already running on {self.socket_path}')
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.socket_path)
+            finally:
+                probe.close()
+
+        # Created 0600 from the start, chmod after bind would leave a window where others can connect
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(16)
+        return server
+
+    def run_child(self, conn, request, fds):
+        """In the forked child: runs the command on the client's fds and reports its exit status. Never returns."""
+        import json
+        import signal
+
+        status = 1
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            # The backend follows TTM_TASK_BACKEND, which is the client's now
+            ttm.tw_client.set_backend(None)
+
+            status = self.run_command(request['argv'])
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                conn.sendall((json.dumps({'status': status}) + '\n').encode())
+            except BaseException:
+                pass
+            os._exit(status)
+
+    def run_command(self, argv) -> int:
+        command, args = argv[0], argv[1:]
+        if command not in self.commands:
+            sys.stderr.write(f'Unknown command {command}, see ttm-run list\n')
+            return 2
+
+        from ttm import __main__ as dispatcher
+        try:
+            dispatcher.run_command(self.commands[command], args)
+        except SystemExit as e:
+            if e.code is None:
+                return 0
+            if isinstance(e.code, int):
+                return e.code
+            sys.stderr.write(f'{e.code}\n')
+            return 1
+        return 0
+
+    def _serve_client(self, conn):
+        import json
+        import socket
+
+        fds = []
+        try:
+            if peer_uid(conn) not in [os.getuid(), -1]:
+                raise ValueError(f'client runs as uid {peer_uid(conn)}')
+            conn.settimeout(2.0)
+            data, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+            request = json.loads(_recv_line(conn, data))
+            if len(fds) != 3:
+                raise ValueError(f'expected 3 file descriptors, got {len(fds)}')
+        except (OSError, ValueError) as e:
+            log_warn(f'Bad request: {e}')
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            return
+        conn.settimeout(None)
+
+        log_debug(f'Running {request["argv"]} in {request["cwd"]}')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self.run_child(conn, request, fds)
+
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+
+    def serve_forever(self):
+        import selectors
+        import time
+
+        server = self._open_socket()
+        self.warm_up()
+
+        sel = selectors.DefaultSelector()
+        sel.register(server, selectors.EVENT_READ)
+        log_info(f'Serving on {self.socket_path}')
+        last_refresh = time.monotonic()
+        try:
+            while True:
+                if sel.select(self.refresh_interval):
+                    conn, _ = server.accept()
+                    self._serve_client(conn)
+
+                # Reap the children that are done
+                try:
+                    while os.waitpid(-1, os.WNOHANG)[0] != 0:
+                        pass
+                except ChildProcessError:
+                    pass
+
+                if time.monotonic() - last_refresh >= self.refresh_interval:
+                    self.refresh()
+                    last_refresh = time.monotonic()
+        finally:
+            sel.close()
+            server.close()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+
+def main(argv):
+    import argparse
+    import signal
+
+    global verbose
+
+    p = argparse.ArgumentParser(prog='ttm-server', description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-v', '--verbose', action='count', default=0,
+                   help="Increase verbosity level (use -v, -vv)")
+    p.add_argument('--socket', default=server_socket_path(),
+                   help="Unix socket to serve on (default: %(default)s)")
+    p.add_argument('--refresh', type=float, default=2.0,
+                   help="Seconds between checks of the task data when idle (default: %(default)s)")
+    args = p.parse_args(argv)
+    verbose = args.verbose
+
+    # Exit through the finally clauses so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        CommandServer(args.socket, args.refresh).serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+class UnitTests(ttm.TestCase):
+    def test_server_runs_commands(self):
+        import subprocess
+        import tempfile
+        import time
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, 'server.sock')
+            env = dict(os.environ, PYTHONPATH=ttm.BIN_DIR, TTM_TASK_BACKEND=f'fake:{tmp_dir}/db.json',
+                       TTM_CACHE_DIR=tmp_dir, TTM_SERVER_SOCKET=socket_path)
+            env.pop('TTM_NO_SERVER', None)
+            server = subprocess.Popen([sys.executable, '-m', 'ttm.server'], env=env)
+            try:
+                for _ in range(100):
+                    if os.path.exists(socket_path):
+                        break
+                    time.sleep(0.05)
+
+                def run(argv, cwd):
+                    with open(os.path.join(tmp_dir, 'out'), 'w+') as out, \
+                         open(os.path.join(tmp_dir, 'err'), 'w+') as err, open(os.devnull) as null:
+                        saved = os.getcwd(), dict(os.environ)
+                        os.chdir(cwd)
+                        os.environ.update(env)
+                        try:
+                            status = forward(argv, (null.fileno(), out.fileno(), err.fileno()))
+                        finally:
+                            os.chdir(saved[0])
+                            os.environ.clear()
+                            os.environ.update(saved[1])
+                        out.seek(0)
+                        err.seek(0)
+                        return status, out.read(), err.read()
+
+                # The command runs in the client's directory and environment, on its stdout
+                status, out, _ = run(['tw-client', 'fake-task', 'add', 'description:x'], tmp_dir)
+                self.assertEqual(status, 0)
+                self.assertIn('Created task 1', out)
+                self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'db.json')))
+
+                # Exit statuses and stderr come back too
+                status, _, err = run(['note-parser'], tmp_dir)
+                self.assertEqual(status, 2)
+                self.assertIn('usage', err)
+
+                status, _, err = run(['no-such-command'], tmp_dir)
+                self.assertEqual(status, 2)
+            finally:
+                server.terminate()
+                server.wait()
+            self.assertFalse(os.path.exists(socket_path))
+
+    def test_client_only_trusts_private_sockets(self):
+        import socket
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chmod(tmp_dir, 0o700)
+            self.assertTrue(is_private_dir(tmp_dir))
+            os.chmod(tmp_dir, 0o755)
+            self.assertFalse(is_private_dir(tmp_dir))
+            os.symlink(tmp_dir, os.path.join(tmp_dir, 'link'))
+            self.assertFalse(is_private_dir(os.path.join(tmp_dir, 'link')))
+
+            saved_env = dict(os.environ)
+            try:
+                os.environ.pop('TTM_NO_SERVER', None)
+                os.environ.pop('TTM_SERVER_SOCKET', None)
+                os.environ.pop('XDG_RUNTIME_DIR', None)
+                self.assertTrue(is_fallback_socket_path(server_socket_path()))
+                self.assertTrue(os.path.dirname(os.path.dirname(server_socket_path())) == '/tmp')
+
+                # A socket planted by another user is not used
+                socket_path = os.path.join(tmp_dir, 'server.sock')
+                os.environ['TTM_SERVER_SOCKET'] = socket_path
+                planted = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                planted.bind(socket_path)
+                planted.listen(1)
+                try:
+                    if os.getuid() != 0:
+                        self.skipTest('needs root to give the socket to another user')
+                    os.chown(socket_path, 65534, 65534)
+                    self.assertIsNone(forward(['list']))
+                finally:
+                    planted.close()
+            finally:
+                os.environ.clear()
+                os.environ.update(saved_env)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'unittest':
+        import unittest
+        sys.argv[0] += ' unittest'
+        sys.argv.remove('unittest')
+        unittest.main()
+    else:
+        sys.exit(main(sys.argv[1:]))
@@ -78,7 +78,9 @@ cpv()
   fi
 }
 
-cpv bin/* $binoutput
+cpv -r bin/* $binoutput
+# The tools load each other through the ttm package, compile them once so no tool pays for it at startup
+python3 -m compileall -q $binoutput/ttm $binoutput/tmlib.*.py
 cpv hooks/* $output/hooks/
 if [ $(echo $args_json | jq -r .all) = true ]; then
   cpv -r taskrc $output/
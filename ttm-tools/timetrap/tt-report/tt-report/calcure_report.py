@@ -42,6 +42,10 @@ class CalcureReport:
     def datetime_s(cls, date):
         return date.strftime('%Y-%m-%d %a')
 
+    @classmethod
+    def date_s(cls, date):
+        return date.strftime('%Y-%m-%d')
+
     @classmethod
     def interval_min(cls, interval_s):
         if len(interval_s) != 4:
@@ -51,7 +55,115 @@ class CalcureReport:
 
         return int(hh) * 60 + int(mm)
     
+    @classmethod
+    def event_date(cls, event):
+        return datetime.datetime(int(event.year), int(event.month), int(event.day))
+
+    @classmethod
+    def first_day(cls, start_date) -> int:
+        # Events are at midnight, so a report starts at the first midnight at or after start_date
+        return start_date.toordinal() + (start_date.time() != datetime.time())
+
+    def compute_day_buckets(self, start_date, days: int, only_remaining: bool, only_done: bool) -> List[dict]:
+        """
+        Minutes per gcode and etag of each of the days days from start_date, from one pass over the events of
+        those days. Buckets keep the order in which they are first seen.
+        """
+        first_day = self.first_day(start_date)
+        events = self.calcure_events_file.events_between(datetime.date.fromordinal(first_day),
+                                                         datetime.date.fromordinal(first_day + days))
+        day_buckets = [{} for _ in range(days)]
+        for event in events:
+            day = self.event_date(event).toordinal() - first_day
+
+            if only_remaining:
+                # filter out events that are finished already
+                if event.priority.strip() == 'unimportant':
+                    continue
+            elif only_done:
+                if event.priority.strip() != 'unimportant':
+                    continue
+
+            etag_intervals = day_buckets[day].setdefault(event.gcode, {})
+            etag_intervals[event.tag] = etag_intervals.get(event.tag, 0) + self.interval_min(event.end)
+
+        return day_buckets
+
     def compute_week_calcure_report(self, week_start_date, only_remaining: bool, only_done: bool):
+        """
+        Minutes per day, gcode and etag for the week starting at week_start_date, with the sums per etag of each
+        day (DSUM) and of the week (WSUM, and per gcode under WEEK). Zero sums are left out.
+        """
+        day_buckets = self.compute_day_buckets(week_start_date, 7, only_remaining=only_remaining,
+                                               only_done=only_done)
+        return self.week_report_from_buckets(week_start_date, day_buckets)
+
+    def week_report_from_buckets(self, week_start_date, day_buckets: List[dict]):
+        datetime_s = self.datetime_s
+
+        result = {}
+        result['WEEK'] = {}
+        result['WEEK']['WSUM'] = {}
+        week_result = result['WEEK']
+
+        # the day and week sums are derived from the buckets
+        for day in range(7):
+            day_date = week_start_date + datetime.timedelta(days=day)
+            day_result = result[datetime_s(day_date)] = {}
+            day_result['DSUM'] = {}
+
+            for gcode, etag_intervals in day_buckets[day].items():
+                day_result[gcode] = {}
+                for etag, interval_sum in etag_intervals.items():
+                    if interval_sum == 0:
+                        continue
+
+                    day_result[gcode][etag] = interval_sum
+                    day_result['DSUM'][etag] = day_result['DSUM'].get(etag, 0) + interval_sum
+
+                    # compute sums for report in total per week
+                    week_gcode = week_result.setdefault(gcode, {})
+                    week_gcode[etag] = week_gcode.get(etag, 0) + interval_sum
+                    week_result['WSUM'][etag] = week_result['WSUM'].get(etag, 0) + interval_sum
+
+        return result
+
+    def compute_range_calcure_report(self, from_date, weeks: int, only_remaining: bool, only_done: bool,
+                                     months: bool = False):
+        """
+        The week report of each of the weeks weeks from from_date, keyed by week start, from a single pass over the
+        events. With months, MONTHS holds the minutes per month, gcode and etag (MSUM for all gcodes) of the days
+        in the range; the first and last months may be partial.
+        """
+        day_buckets = self.compute_day_buckets(from_date, 7 * weeks, only_remaining=only_remaining,
+                                               only_done=only_done)
+
+        result = {}
+        for week in range(weeks):
+            week_start_date = from_date + datetime.timedelta(days=7 * week)
+            result[self.date_s(week_start_date)] = \
+                self.week_report_from_buckets(week_start_date, day_buckets[7 * week:7 * (week + 1)])
+
+        if months:
+            month_results = result['MONTHS'] = {}
+            for day, buckets in enumerate(day_buckets):
+                day_date = from_date + datetime.timedelta(days=day)
+                month_result = month_results.setdefault(day_date.strftime('%Y-%m'), {'MSUM': {}})
+                for gcode, etag_intervals in buckets.items():
+                    for etag, interval_sum in etag_intervals.items():
+                        if interval_sum == 0:
+                            continue
+                        month_gcode = month_result.setdefault(gcode, {})
+                        month_gcode[etag] = month_gcode.get(etag, 0) + interval_sum
+                        month_result['MSUM'][etag] = month_result['MSUM'].get(etag, 0) + interval_sum
+
+        return result
+
+    def compute_week_calcure_report_reference(self, week_start_date, only_remaining: bool, only_done: bool):
+        """
+        The original per-filter implementation of compute_week_calcure_report, kept to check it against. It
+        re-filters the events for the week, then per day, gcode and etag.
+        """
         datetime_s = self.datetime_s
         
         # filter events by date window
@@ -113,37 +225,37 @@ class CalcureReport:
 
         return result
 
-    def combine_etag_intervals(self, week_start_date, week_calcure_report: dict, skipped_etags=[]):
-
-        def combine_etag_for_gcode(etag_intervals_for_gcode, is_week=False):
-            etags = list(etag_intervals_for_gcode.keys())
-
-            # Some tags should just be skipped and are documentation only. 
-            # The MISSED events/tasks: MTSK, MEVT
-            skipped_etags = ['MTSK', 'MEVT']
+    @classmethod
+    def combine_etag_for_gcode(cls, etag_intervals_for_gcode, is_week=False):
+        etags = list(etag_intervals_for_gcode.keys())
 
-            # Get these separately, and if they're more than the commited tags, use them instead
-            # Ignore WTSK and WEVT for any day and only max it for WEEK.
-            max_etags = ['DTSK', 'DEVT', 'WTSK', 'WEVT']
+        # Some tags should just be skipped and are documentation only. 
+        # The MISSED events/tasks: MTSK, MEVT
+        skipped_etags = ['MTSK', 'MEVT']
 
-            # get the sum of all commited events 
-            commited_interval = sum(etags | pipe.where(lambda etag: etag not in skipped_etags and etag not in max_etags)
-                                          | pipe.map(lambda etag: etag_intervals_for_gcode[etag])
-                                          | as_list)
+        # Get these separately, and if they're more than the commited tags, use them instead
+        # Ignore WTSK and WEVT for any day and only max it for WEEK.
+        max_etags = ['DTSK', 'DEVT', 'WTSK', 'WEVT']
 
-            max_etags_used = ['DTSK', 'DEVT'] if not is_week else ['WTSK', 'WEVT']
+        # get the sum of all commited events 
+        commited_interval = sum(etags | pipe.where(lambda etag: etag not in skipped_etags and etag not in max_etags)
+                                      | pipe.map(lambda etag: etag_intervals_for_gcode[etag])
+                                      | as_list)
 
-            # get the value that could be used if the interval is lower
-            planned_interval = sum(etags | pipe.where(lambda etag: etag in max_etags_used)
-                                         | pipe.map(lambda etag: etag_intervals_for_gcode[etag])
-                                         | as_list)
+        max_etags_used = ['DTSK', 'DEVT'] if not is_week else ['WTSK', 'WEVT']
 
-            # return max(commited_interval, planned_interval)
+        # get the value that could be used if the interval is lower
+        planned_interval = sum(etags | pipe.where(lambda etag: etag in max_etags_used)
+                                     | pipe.map(lambda etag: etag_intervals_for_gcode[etag])
+                                     | as_list)
 
-            # for now, don't take these into account
-            return commited_interval
+        # return max(commited_interval, planned_interval)
 
+        # for now, don't take these into account
+        return commited_interval
 
+    def combine_etag_intervals(self, week_start_date, week_calcure_report: dict, skipped_etags=[]):
+        combine_etag_for_gcode = self.combine_etag_for_gcode
 
         for day in range(7):
             day_date = week_start_date + datetime.timedelta(days=day)
@@ -198,17 +310,135 @@ class CalcureReport:
 
         return json.dumps(week_calcure_report)
 
+    def create_range_calcure_report(self, from_date, weeks: int, keep_etags: bool, only_remaining: bool,
+                                    only_done: bool, months: bool):
+        range_calcure_report = self.compute_range_calcure_report(from_date, weeks, only_remaining=only_remaining,
+                                                                 only_done=only_done, months=months)
+
+        # each week (and the month rollups) gets the same processing as a single week report
+        for week in range(weeks):
+            week_start_date = from_date + datetime.timedelta(days=7 * week)
+            week_calcure_report = range_calcure_report[self.date_s(week_start_date)]
+            if not keep_etags:
+                week_calcure_report = self.combine_etag_intervals(week_start_date, week_calcure_report)
+            range_calcure_report[self.date_s(week_start_date)] = \
+                self.convert_interval_format_for_calcure_report(week_calcure_report, keep_etags)
+
+        if months:
+            month_reports = range_calcure_report['MONTHS']
+            if not keep_etags:
+                for month_report in month_reports.values():
+                    for gcode in month_report.keys():
+                        month_report[gcode] = self.combine_etag_for_gcode(month_report[gcode], is_week=True)
+            self.convert_interval_format_for_calcure_report(month_reports, keep_etags)
+
+        return json.dumps(range_calcure_report)
+
 
 
 def main(args: argparse.Namespace):
     calcure_report = CalcureReport(args.events_file_path)
     week_start_date = datetime.datetime.strptime(args.week_start_date, '%Y-%m-%d')
 
+    if args.weeks is not None or args.to is not None or args.months:
+        weeks = args.weeks
+        if args.to is not None:
+            to_date = datetime.datetime.strptime(args.to, '%Y-%m-%d')
+            if to_date < week_start_date:
+                raise CalcureReportError(f'--to {args.to} is before the start date {args.week_start_date}')
+            # all the weeks up to the one that has to_date
+            weeks = (to_date - week_start_date).days // 7 + 1
+        elif weeks is None:
+            weeks = 1
+        if weeks < 1:
+            raise CalcureReportError(f'Expected at least one week, got {weeks}')
+
+        print(calcure_report.create_range_calcure_report(week_start_date, weeks, keep_etags=args.keep_etags,
+                                                         only_remaining=args.remaining, only_done=args.done,
+                                                         months=args.months))
+        return
+
     print(calcure_report.create_week_calcure_report(week_start_date, keep_etags=args.keep_etags,
                                                     only_remaining=args.remaining,
                                                     only_done=args.done))
 
 # ==================================================================================================
+SYNTHETIC_GCODES = ['G1', 'G2', 'G3', 'OPS', 'LRN']
+SYNTHETIC_ETAGS = ['EVNT', 'DTSK', 'DEVT', 'WTSK', 'WEVT', 'MTSK', 'TASK']
+SYNTHETIC_PRIORITIES = ['normal', 'important', 'unimportant']
+
+def write_synthetic_events(filename: str, start_date, days: int, events_per_day: int, seed: int = 0):
+    """
+    Writes a calcure events.csv of days days from start_date, with events of every gcode, etag and priority.
+    Some events have no gcode and some a 0000 interval, like real files.
+    """
+    import random
+
+    rng = random.Random(seed)
+    lines = []
+    for day in range(days):
+        date = start_date + datetime.timedelta(days=day)
+        for _ in range(rng.randint(0, 2 * events_per_day)):
+            start = f'{rng.randint(0, 23):02}{rng.choice([0, 20, 40]):02}'
+            interval = rng.choice(['0000', '0020', '0040', '0100', '0130', '0200'])
+            etag = rng.choice(SYNTHETIC_ETAGS)
+            if rng.random() < 0.1:
+                desc = f'{start}:{interval} {etag} untracked event'
+            else:
+                desc = f'{start}:{interval} {etag} {rng.choice(SYNTHETIC_GCODES)} {rng.getrandbits(32):08x} ' \
+                       f'project item description'
+            lines.append(f'{len(lines)},{date.year},{date.month},{date.day},"{desc}",1,once,'
+                         f'{rng.choice(SYNTHETIC_PRIORITIES)}\n')
+
+    with open(filename, 'w') as f:
+        f.writelines(lines)
+
+
+def bench(argv):
+    """
+    Times compute_week_calcure_report against compute_week_calcure_report_reference on a synthetic multi-year
+    events.csv, and checks that both give the same report for every week and filter.
+    """
+    import tempfile
+    import time
+
+    p = argparse.ArgumentParser(prog='calcure_report bench', description=bench.__doc__)
+    p.add_argument('--years', type=int, default=3,
+                   help="Years of events (default: %(default)s)")
+    p.add_argument('--events-per-day', type=int, default=10,
+                   help="Average events per day (default: %(default)s)")
+    p.add_argument('--weeks', type=int, default=20,
+                   help="Weeks to report, spread over the years (default: %(default)s)")
+    args = p.parse_args(argv)
+
+    start_date = datetime.datetime(2022, 1, 3)
+    days = args.years * 365
+    with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+        write_synthetic_events(f.name, start_date, days, args.events_per_day)
+        calcure_report = CalcureReport(f.name)
+    print(f'{len(calcure_report.calcure_events_file.events)} events over {args.years} years')
+
+    weeks = [start_date + datetime.timedelta(days=7 * (i * (days // 7) // args.weeks)) for i in range(args.weeks)]
+    filters = [(False, False), (True, False), (False, True)]
+
+    timings = {}
+    reports = {}
+    for name, compute in [('reference', calcure_report.compute_week_calcure_report_reference),
+                          ('single-pass', calcure_report.compute_week_calcure_report)]:
+        start = time.perf_counter()
+        # Compared as the json that is printed. The reference iterates sets, so the key order is not compared.
+        reports[name] = [json.loads(json.dumps(compute(week, only_remaining=only_remaining, only_done=only_done)))
+                         for week in weeks for only_remaining, only_done in filters]
+        timings[name] = time.perf_counter() - start
+        print(f'{name:12} {timings[name] * 1000 / len(reports[name]):8.2f} ms/report')
+
+    if reports['reference'] != reports['single-pass']:
+        print('MISMATCH: the reports differ')
+        return 1
+    print(f'{len(reports["reference"])} reports identical, {timings["reference"] / timings["single-pass"]:.1f}x faster')
+    return 0
+
+
 def define_args():
     p = argparse.ArgumentParser(description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -218,6 +448,14 @@ def define_args():
     p.add_argument('week_start_date',                   
                    help="The week start date to get the report for. %Y-%m-%d format expected.")
 
+    p.add_argument('-w', '--weeks', type=int,
+                   help="Report this many weeks from week_start_date, as one json object keyed by week start")
+    p.add_argument('-t', '--to',
+                   help="Report the weeks from week_start_date up to the one with this date, like --weeks. "
+                        "%%Y-%%m-%%d format expected.")
+    p.add_argument('-m', '--months', action='store_true',
+                   help="With a range of weeks, also sum the minutes per month under MONTHS")
+
     p.add_argument('-k', '--keep_etags', action='store_true',
                    help="Do not sum per etags")
     p.add_argument('-r', '--remaining', action='store_true',
@@ -250,6 +488,8 @@ def _main():
     if len(sys.argv) >= 1 and 'unittest' in sys.argv[0]:
         import unittest
         unittest.main()
+    if len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+        exit(bench(sys.argv[2:]))
 
     main(define_args())
 
@@ -259,6 +499,78 @@ class UnitTests(common.CommonTestCase):
     def test_dummy(self):
         self.assertEqual("dummy" != 0)
 
+    def test_week_report_matches_reference(self):
+        import tempfile
+
+        start_date = datetime.datetime(2024, 6, 24)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            write_synthetic_events(f.name, start_date - datetime.timedelta(days=10), 30, events_per_day=6)
+            calcure_report = CalcureReport(f.name)
+
+        for only_remaining, only_done in [(False, False), (True, False), (False, True)]:
+            report = calcure_report.compute_week_calcure_report(start_date, only_remaining, only_done)
+            reference = calcure_report.compute_week_calcure_report_reference(start_date, only_remaining, only_done)
+            self.assertEqual(report, reference)
+            self.assertNotEqual(report['WEEK']['WSUM'], {})
+
+    def test_events_file_queries(self):
+        import tempfile
+
+        start_date = datetime.datetime(2024, 6, 24)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            write_synthetic_events(f.name, start_date - datetime.timedelta(days=30), 60, events_per_day=4)
+            with open(f.name, 'r') as f_lines:
+                lines = f_lines.readlines()
+            # shuffled files come out sorted
+            with open(f.name, 'w') as f_lines:
+                f_lines.writelines(lines[1::2] + lines[::2])
+            events_file = CalcureEventsFile(f.name)
+
+        events = events_file.events
+        keys = [event.sort_key() for event in events]
+        self.assertEqual(keys, sorted(keys))
+
+        week = events_file.events_between(start_date, start_date + datetime.timedelta(days=7))
+        self.assertEqual(week, [e for e in events if CalcureReport.within_date(start_date, e, days=7)])
+        self.assertNotEqual(week, [])
+        self.assertEqual(events_file.events_on(start_date.date()),
+                         [e for e in events if CalcureReport.within_date(start_date, e, days=1)])
+
+        uuid = next(e.uuid for e in week if e.uuid is not None)
+        self.assertEqual(events_file.events_for_uuid(uuid), [e for e in events if e.uuid == uuid])
+        self.assertEqual(events_file.events_for_uuid('nouuid'), [])
+
+        # added events keep the order and the indexes
+        event = calcure_events_file.CalcureCsvEvent.parse(
+            f'0,{start_date.year},{start_date.month},{start_date.day},"1200:0100 EVNT G1 {uuid} p added",1,once,normal')
+        events_file.add(event)
+        self.assertIn(event, events_file.events_on(start_date))
+        self.assertIn(event, events_file.events_for_uuid(uuid))
+        keys = [event.sort_key() for event in events_file.events]
+        self.assertEqual(keys, sorted(keys))
+
+    def test_range_report_matches_week_reports(self):
+        import tempfile
+
+        start_date = datetime.datetime(2024, 6, 24)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            write_synthetic_events(f.name, start_date - datetime.timedelta(days=10), 60, events_per_day=4)
+            calcure_report = CalcureReport(f.name)
+
+        range_report = calcure_report.compute_range_calcure_report(start_date, 6, only_remaining=False,
+                                                                   only_done=False, months=True)
+        for week in range(6):
+            week_start_date = start_date + datetime.timedelta(days=7 * week)
+            self.assertEqual(range_report[week_start_date.strftime('%Y-%m-%d')],
+                             calcure_report.compute_week_calcure_report(week_start_date, False, False))
+
+        # the months add up to the weeks
+        self.assertEqual(list(range_report['MONTHS'].keys()), ['2024-06', '2024-07', '2024-08'])
+        month_total = sum(sum(month['MSUM'].values()) for month in range_report['MONTHS'].values())
+        week_total = sum(sum(range_report[week]['WEEK']['WSUM'].values())
+                         for week in range_report.keys() if week != 'MONTHS')
+        self.assertEqual(month_total, week_total)
+
 if __name__ == '__main__':
     _main()
 
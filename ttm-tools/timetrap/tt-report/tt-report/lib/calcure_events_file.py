@@ -1,101 +1,66 @@
-class CalcureCsvEvent:
-    def __init__(self, year, month, day, start, end, tag, desc, repeat_amt, repeat_mode, priority,
-                 gcode=None, uuid=None, project=None, item_desc=None):
-        self.year = year
-        self.month = month
-        self.day = day
-        self.start = start
-        self.end = end
-        self.tag = tag
-        self.desc = desc
-        self.repeat_amt = repeat_amt
-        self.repeat_mode = repeat_mode
-        self.priority = priority
-        self.gcode = gcode
-        self.uuid=uuid
-        self.project = project
-        self.item_desc = item_desc
+import bisect
+import datetime
+from typing import Dict, List
 
-    @staticmethod
-    def parse(csv_line: str) -> 'CalcureCsvEvent':
-        tokens = csv_line.split(',')
-        if len(tokens) != 8:
-            raise Exception(f'Calcure event csv line must have 8 comma-seperated tokens. Line: {csv_line}')
+try:
+    from ttm import calcure_events
+except ModuleNotFoundError as e:
+    if e.name != 'ttm':
+        raise
+    raise ModuleNotFoundError('tt-report needs the ttm package of ttm-tools: add ttm-tools/bin to PYTHONPATH',
+                              name='ttm') from e
 
-        _id = tokens[0]
-        year = tokens[1]
-        month = tokens[2]
-        day = tokens[3]
-        desc = tokens[4]
-        repeat_amt = tokens[5]
-        repeat_mode = tokens[6]
-        priority = tokens[7].strip()
-
-        # process out start-end from description. Required.
-        if len(desc) < len('"0000:0000 ') or desc[5] != ':':
-            raise Exception(f'Description must start with time stamp like 0000:0000. Desc: {desc}')
-        desc_split = desc.split(':')
-        start = desc_split[0][1:]
-        end = desc_split[1][:4]
-        desc_remaining = ':'.join(desc_split[1:])[5:-1]
-
-        # Every item should have a unique tag
-        desc_remaining_tokens = desc_remaining.split(' ')
-        if len(desc_remaining_tokens) < 2 or len(desc_remaining_tokens[0]) != 4:
-            raise Exception(f'Description must start with a 4 character tag like EVNT. Desc: {desc_remaining}')
-        tag = desc_remaining_tokens[0]
-        desc_remaining = ' '.join(desc_remaining_tokens[1:])
-
-        # Try to parse extra information from the description if possible: gcode, UUID, project, item_desc (remaining)
-        desc_remaining_tokens = desc_remaining.split(' ')
-        gcode = None
-        uuid = None
-        project = None
-        item_desc = None
-        if len(desc_remaining_tokens) >= 4:
-            gcode = desc_remaining_tokens[0]
-            uuid = desc_remaining_tokens[1]
-
-            # Since this is a variable length field, assumme some default padding
-            project = desc_remaining_tokens[2]
-            project = project + ' ' * (max(0, len('some_long_project_name') - len(project)))
-            item_desc = ' '.join(desc_remaining_tokens[3:]).strip()
-
-
-        return CalcureCsvEvent(year, month, day, start, end, tag, desc_remaining, repeat_amt, repeat_mode, priority,
-                               gcode, uuid, project, item_desc)
-
-
-    def display(self, event_id: int) -> str:
-        #if self.gcode != None:
-        #    return f'{event_id},{self.year},{self.month},{self.day},"{self.start}:{self.end} {self.gcode} {self.uuid} {self.project} {self.item_desc}",{self.repeat_amt},{self.repeat_mode},{self.priority}'
-        #else:
-        #    return f'{event_id},{self.year},{self.month},{self.day},"{self.start}:{self.end} {self.desc}",{self.repeat_amt},{self.repeat_mode},{self.priority}'
-        return f'{event_id},{self.year},{self.month},{self.day},"{self.start}:{self.end} {self.tag} {self.desc}",{self.repeat_amt},{self.repeat_mode},{self.priority}'
+CalcureCsvEvent = calcure_events.CalcureCsvEvent
 
 
 class CalcureEventsFile:
     def __init__(self, filename: str):
-        with open(filename, 'r') as f:
-            csv_lines = f.readlines()
-
-        # parse csv file
-        events: List[CalcureCsvEvent] = []
-        for line in csv_lines:
-            events.append(CalcureCsvEvent.parse(line))
-        
-        self.events = events
+        self.events: List[CalcureCsvEvent] = list(calcure_events.iter_events(filename))
         self.filename = filename
+        self.sort()
     
     def save(self):
         lines = []
         for i, event in enumerate(self.events):
-            lines.append(event.display(i))
+            lines.append(event.display(i) + '\n')
 
         with open(self.filename, 'w') as f:
             f.writelines(lines)
     
     def sort(self):
-        events_sorted = sorted(self.events, key=lambda e: (int(e.year), int(e.month), int(e.day), int(e.start)))
-        self.events = events_sorted
+        """
+        Sorts the events by date and start, keeping the file order of events that start together, and rebuilds the
+        date and uuid indexes. Call it again after changing events directly.
+        """
+        keyed_events = sorted(((event.sort_key(), event) for event in self.events), key=lambda ke: ke[0])
+        self.events = [event for _, event in keyed_events]
+        self._keys = [key for key, _ in keyed_events]
+
+        self._events_by_uuid: Dict[str, List[CalcureCsvEvent]] = {}
+        for event in self.events:
+            if event.uuid is not None:
+                self._events_by_uuid.setdefault(event.uuid, []).append(event)
+
+    def add(self, event: CalcureCsvEvent):
+        """Inserts event after the events that start at the same time."""
+        key = event.sort_key()
+        i = bisect.bisect_right(self._keys, key)
+        self._keys.insert(i, key)
+        self.events.insert(i, event)
+
+        if event.uuid is not None:
+            uuid_events = self._events_by_uuid.setdefault(event.uuid, [])
+            uuid_events.insert(bisect.bisect_right([e.sort_key() for e in uuid_events], key), event)
+
+    def events_between(self, start_date, end_date) -> List[CalcureCsvEvent]:
+        """The events from start_date up to, but not including, end_date, by date only."""
+        lo = bisect.bisect_left(self._keys, (start_date.toordinal(),))
+        hi = bisect.bisect_left(self._keys, (end_date.toordinal(),), lo)
+        return self.events[lo:hi]
+
+    def events_on(self, date) -> List[CalcureCsvEvent]:
+        return self.events_between(date, date + datetime.timedelta(days=1))
+
+    def events_for_uuid(self, uuid: str) -> List[CalcureCsvEvent]:
+        return list(self._events_by_uuid.get(uuid, []))
     
\ No newline at end of file